@@ -67,7 +67,7 @@ def skim():
     common.logger.info(f'Selection: {selection}')
     keep = common.pull_arg('-k', '--keep', type=float, default=None).keep
     rootfile = common.pull_arg('rootfile', type=str).rootfile
-    array = svj.open_root(rootfile, load_gen=True, load_jerjec=True)
+    array = common.open_root(rootfile, load_gen=True, load_jerjec=True)
 
     if keep is not None:
         common.logger.info(f'Keeping only fraction {keep} of total number of events for signal MC')
@@ -150,6 +150,7 @@ def skim():
         # Apply further selection now
         if selection == 'cutbased':
             common.logger.info('Applying cutbased selection')
+            cols = common.Columns.wrap(cols)
             cols = cols.select(common.mask_cutbased(cols))
             cols.cutflow['cutbased'] = len(cols)
         elif selection.startswith('bdt='):
@@ -170,7 +171,7 @@ def skim():
     # JEC/JER
 
     # Reload to undo preselection
-    array = svj.open_root(rootfile, load_gen=True, load_jerjec=True)
+    array = common.open_root(rootfile, load_gen=True, load_jerjec=True)
 
     for var_name, appl in [
         ('jer_up',   svj.apply_jer_up),
@@ -193,7 +194,7 @@ def skim():
     for var in ['up', 'down']:
         for match_type in ['both', 'full', 'partial']:
             common.logger.info(f'{var=}, {match_type=}')
-            arrays = svj.open_root(rootfile)
+            arrays = common.open_root(rootfile)
             common.logger.info(f'Loaded, applying jes')
             apply_jes(arrays, var, match_type)
             common.logger.info(f'Done, applying presel')
@@ -213,14 +214,59 @@ def skim():
     pbar.close()
 
 
+def sig_weights(cols, lumi, persist=False):
+    """
+    mt and the event weights of the central signal histogram and its scale,
+    PS, PU and PDF variations, for the events of `cols` (a central skim or a
+    chunk of it).
+    """
+    mt = cols.to_numpy(['mt']).ravel()
+    w = cols.to_numpy(['puweight']).ravel() * (lumi * cols.xs / cols.cutflow['raw'])
+    weights = {}
+
+    # Scale
+    scale_weight = cols.to_numpy(['scaleweights'])[:, np.array([0,1,2,3,4,6,8])]
+    weights['scale_up'] = w * np.max(scale_weight, axis=-1) * cols.metadata['scale_factor_up']
+    weights['scale_down'] = w * np.min(scale_weight, axis=-1) * cols.metadata['scale_factor_down']
+
+    # PS
+    ps_weights = w[:,None] * cols.to_numpy(['ps_isr_up', 'ps_isr_down',
+                                       'ps_fsr_up', 'ps_fsr_down'])
+    weights['isr_up']   = ps_weights[:,0]
+    weights['isr_down'] = ps_weights[:,1]
+    weights['fsr_up']   = ps_weights[:,2]
+    weights['fsr_down'] = ps_weights[:,3]
+
+    # PU
+    pu_weights = cols.to_numpy(['puweight', 'pu_sys_up', 'pu_sys_down'])
+    weights['pu_up'] = w / pu_weights[:,0] * pu_weights[:,1]
+    weights['pu_down'] = w / pu_weights[:,0] * pu_weights[:,2]
+
+    # PDF
+    pdf_envelope = cols.derived('pdf_envelope', persist)
+    weights['pdf_up'] = w*pdf_envelope[:,0]
+    weights['pdf_down'] = w*pdf_envelope[:,1]
+
+    weights['central'] = w
+    return mt, weights
+
+
 @scripter
-def build_sig_histograms(args=None):
+def build_sig_histograms(args=None, chunk_size=None, persist=False):
+    """
+    With `--chunk-size N`, skims are processed in blocks of N events, so
+    memory does not scale with the number of events (for column directory
+    skims). The histograms are identical to those of the in-memory default.
+    With `--persist`, the PDF envelope is stored next to the central skim.
+    """
     if args is None:
         change_bin_width()
         # Read from sys.argv
         selection = common.pull_arg('selection', type=str).selection
         lumi = common.pull_arg('--lumi', type=float, default=137.2, help='Luminosity (in fb-1)').lumi
         lumi *= 1e3 # Convert to nb-1, same unit as xs
+        chunk_size = common.pull_arg('--chunk-size', type=int, help='Number of events per chunk').chunk_size
+        persist = common.pull_arg('--persist', action='store_true', help='Store and reuse the PDF envelope').persist
         common.logger.info(f'Selection: {selection}')
         skim_files = common.pull_arg('skimfiles', type=str, nargs='+').skimfiles
     else:
@@ -231,26 +277,24 @@ def build_sig_histograms(args=None):
         return [s for s in skim_files if tag in s][0]
 
     mths = {}
-    central = svj.Columns.load(get_by_tag('central'))
-
-    mt = central.to_numpy(['mt']).ravel()
-    w = central.to_numpy(['puweight']).ravel()
-    w *= lumi * central.xs / central.cutflow['raw']
+    bins = common.MTHistogram.bins
+    central = common.Columns.load(get_by_tag('central'), lazy=chunk_size is not None)
+    central_hists = common.accumulate_histograms(
+        central, lambda cols: sig_weights(cols, lumi, persist), bins, chunk_size
+        )
 
     # Scale
-    scale_weight = central.to_numpy(['scaleweights'])[:, np.array([0,1,2,3,4,6,8])]
-    weight_up = w * np.max(scale_weight, axis=-1) * central.metadata['scale_factor_up']
-    weight_down = w * np.min(scale_weight, axis=-1) * central.metadata['scale_factor_down']
-    mths['scale_up'] = common.MTHistogram(mt, weight_up)
-    mths['scale_down'] = common.MTHistogram(mt, weight_down)
+    mths['scale_up'] = central_hists.histogram('scale_up')
+    mths['scale_down'] = central_hists.histogram('scale_down')
 
     # JEC/JER/JES
     def mth_jerjecjes(tag):
-        col = svj.Columns.load(get_by_tag(tag))
-        mt = col.to_numpy(['mt']).flatten()
-        w = col.to_numpy(['puweight']).flatten()
-        w *= lumi * col.xs / col.cutflow['raw']
-        return common.MTHistogram(mt, w)
+        col = common.Columns.load(get_by_tag(tag), columns=['mt', 'puweight'], lazy=chunk_size is not None)
+        def weights(col):
+            mt = col.to_numpy(['mt']).ravel()
+            w = col.to_numpy(['puweight']).ravel() * (lumi * col.xs / col.cutflow['raw'])
+            return mt, dict(central=w)
+        return common.accumulate_histograms(col, weights, bins, chunk_size).histogram('central')
     mths['jer_up'] = mth_jerjecjes('jer_up')
     mths['jer_down'] = mth_jerjecjes('jer_down')
     mths['jec_up'] = mth_jerjecjes('jec_up')
@@ -258,34 +302,15 @@ def build_sig_histograms(args=None):
     mths['jes_up'] = mth_jerjecjes('jesup_both')
     mths['jes_down'] = mth_jerjecjes('jesdown_both')
 
-    # PS
-    ps_weights = w[:,None] * central.to_numpy(['ps_isr_up', 'ps_isr_down',
-                                       'ps_fsr_up', 'ps_fsr_down'])
-    mths['isr_up']   = common.MTHistogram(mt, ps_weights[:,0])
-    mths['isr_down'] = common.MTHistogram(mt, ps_weights[:,1])
-    mths['fsr_up']   = common.MTHistogram(mt, ps_weights[:,2])
-    mths['fsr_down'] = common.MTHistogram(mt, ps_weights[:,3])
-
-    # PU
-    pu_weights = central.to_numpy(['puweight', 'pu_sys_up', 'pu_sys_down'])
-    mths['pu_up'] = common.MTHistogram(mt, w / pu_weights[:,0] * pu_weights[:,1])
-    mths['pu_down'] = common.MTHistogram(mt, w / pu_weights[:,0] * pu_weights[:,2])
-
-    # PDF
-    pdf_weights = central.to_numpy(['pdf_weights'])
-    pdf_weights /= pdf_weights[:,:1] # Divide by first pdf
-    mu_pdf = np.mean(pdf_weights, axis=1)
-    sigma_pdf = np.std(pdf_weights, axis=1)
-    pdfw_up = (mu_pdf+sigma_pdf) / central.metadata['pdfw_norm_up']
-    pdfw_down = (mu_pdf-sigma_pdf) / central.metadata['pdfw_norm_down']
-    mths['pdf_up'] = common.MTHistogram(mt, w*pdfw_up)
-    mths['pdf_down'] = common.MTHistogram(mt, w*pdfw_down)
+    # PS, PU, PDF
+    for name in ['isr_up', 'isr_down', 'fsr_up', 'fsr_down', 'pu_up', 'pu_down', 'pdf_up', 'pdf_down']:
+        mths[name] = central_hists.histogram(name)
 
     # MC stats
-    mth_central = common.MTHistogram(mt, w)
+    mth_central = central_hists.histogram('central')
     mth_central.metadata.update(central.metadata)
     mths['central'] = mth_central
-    mc_stat_err = np.sqrt(np.histogram(mt, bins=mth_central.binning, weights=w**2)[0])
+    mc_stat_err = np.sqrt(central_hists.sumw2('central'))
 
     for i in range(mth_central.nbins):
         mth = mth_central.copy()
@@ -298,11 +323,10 @@ def build_sig_histograms(args=None):
     meta = central.metadata
     outfile = (
         f'mz{meta["mz"]:.0f}_rinv{meta["rinv"]:.1f}_mdark{meta["mdark"]:.0f}'
-        f'_{selection}.json'
+        f'_{selection}{common.HISTOGRAMS_EXT}'
         )
     common.logger.info(f'Dumping histograms to {outfile}')
-    with open(outfile, 'w') as f:
-        json.dump(mths, f, cls=common.Encoder, indent=4)
+    common.dump_histograms(mths, outfile)
     return outfile
 
 
@@ -325,38 +349,42 @@ def build_bkg_histograms(args=None):
         'ttjets_individual' : [],
         'wjets_individual' : [],
         'zjets_individual' : [],
-        'qcd' : common.MTHistogram.empty(),
-        'ttjets' : common.MTHistogram.empty(),
-        'wjets' : common.MTHistogram.empty(),
-        'zjets' : common.MTHistogram.empty(),
-        'bkg' : common.MTHistogram.empty(),
         }
-    mths['bkg'].metadata['selection'] = selection
-    mths['bkg'].metadata['lumi'] = lumi
+    # Sums per background category and in total, accumulated in place
+    totals = common.HistogramSet(common.MTHistogram.bins, ['qcd', 'ttjets', 'wjets', 'zjets', 'bkg'])
+    totals.metadata['bkg']['selection'] = selection
+    totals.metadata['bkg']['lumi'] = lumi
 
-    for skim_file in tqdm.tqdm(skim_files):
+    def use_skim_file(skim_file):
         process = osp.basename(skim_file)
-
         # Filter out a few things
         if 'QCD_Pt' in process:
             # Low pt QCD bins have very few events, which get absurd weights
             left_pt_bound = int(re.match(r'QCD_Pt_(\d+)', process).group(1))
-            if left_pt_bound < 300.: continue
+            if left_pt_bound < 300.: return False
         elif 'WJetsToLNu_HT' in process:
             # Low HT WJets events have very few events, which get absurd weights
             left_ht_bound = int(re.match(r'WJetsToLNu_HT-(\d+)', process).group(1))
-            if left_ht_bound < 400.: continue
+            if left_ht_bound < 400.: return False
         elif 'WJetsToLNu_TuneCP5' in process:
             # Inclusive WJets bin after the stitch filter is basically HT (0,70)
             # Also too few events, too crazy weights
-            continue
+            return False
+        return True
 
-        col = svj.Columns.load(skim_file)
+    skim_files = [f for f in skim_files if use_skim_file(f)]
+
+    # Next skim files are read in the background while the current one is histogrammed
+    for skim_file, col in tqdm.tqdm(
+        common.prefetch_columns(skim_files, columns=['mt', 'weight', 'rt', 'ecfm2b1']),
+        total=len(skim_files)
+        ):
+        process = osp.basename(skim_file)
 
         # Apply further selection: cutbased or bdt
         if len(col) > 0:
             if selection == 'cutbased':
-                col = col.select(common.mask_cutbased(col))
+                col = col.select(col.selection('cutbased').mask())
             elif selection.startswith('bdt='):
                 common.logger.error('bdt mask to be implemented!!')
             else:
@@ -373,13 +401,13 @@ def build_bkg_histograms(args=None):
 
         bkg = [b for b in ['QCD', 'TTJets', 'ZJets', 'WJets'] if b in process][0].lower()
         mths[bkg+'_individual'].append(mth) # Save individual histogram
-        mths[bkg] += mth # Add up per background category (qcd/ttjet/...)
-        mths['bkg'] += mth # Add up all
+        totals.add(bkg, mth) # Add up per background category (qcd/ttjet/...)
+        totals.add('bkg', mth) # Add up all
 
-    outfile = f'bkghist_{strftime("%Y%m%d")}.json'
+    mths.update(totals.to_histograms())
+    outfile = f'bkghist_{strftime("%Y%m%d")}{common.HISTOGRAMS_EXT}'
     common.logger.info(f'Dumping histograms to {outfile}')
-    with open(outfile, 'w') as f:
-        json.dump(mths, f, cls=common.Encoder, indent=4)
+    common.dump_histograms(mths, outfile)
     return outfile
 
 
@@ -392,6 +420,7 @@ def build_histograms():
     selection = common.pull_arg('selection', type=str).selection
     lumi = common.pull_arg('--lumi', type=float, default=137.2, help='Luminosity (in fb-1)').lumi
     lumi *= 1e3 # Convert to nb-1, same unit as xs
+    chunk_size = common.pull_arg('--chunk-size', type=int, help='Number of signal events per chunk').chunk_size
     common.logger.info(f'Selection: {selection}')
     skim_files = common.pull_arg('skimfiles', type=str, nargs='+').skimfiles
 
@@ -415,17 +444,17 @@ def build_histograms():
         + "\n".join(bkg_skim_files)
         )
 
-    sig_outfile = build_sig_histograms((selection, lumi, sig_skim_files))
+    sig_outfile = build_sig_histograms((selection, lumi, sig_skim_files), chunk_size)
     bkg_outfile = build_bkg_histograms((selection, lumi, bkg_skim_files))
-    merged_outfile = sig_outfile.replace('.json', '_with_bkg.json')
+    merged_outfile = sig_outfile.replace(common.HISTOGRAMS_EXT, '_with_bkg' + common.HISTOGRAMS_EXT)
 
     if common.MTHistogram.non_standard_binning:
         binw = int(common.MTHistogram.bins[1] - common.MTHistogram.bins[0])
         left = common.MTHistogram.bins[0]
         right = common.MTHistogram.bins[-1]
         merged_outfile = merged_outfile.replace(
-            '.json',
-            f'_binw{binw:02d}_range{left:.0f}-{right:.0f}.json'
+            common.HISTOGRAMS_EXT,
+            f'_binw{binw:02d}_range{left:.0f}-{right:.0f}{common.HISTOGRAMS_EXT}'
             )
     merge((merged_outfile, [sig_outfile, bkg_outfile]))
 
@@ -474,8 +503,8 @@ class Plot:
 @scripter
 def plot_systematics():
     json_file = common.pull_arg('jsonfile', type=str).jsonfile
-    with open(json_file) as f:
-        mths = json.load(f, cls=common.Decoder)    
+    # Only the histograms that are plotted are read
+    mths = common.load_histograms(json_file, lazy=True)
 
     rebin_factor = 1
     x_max = 650.
@@ -484,24 +513,28 @@ def plot_systematics():
     common.logger.info(f'central integral: {n}')
     common.logger.info(f'central metadata:\n{mths["central"].metadata}')
 
-    central = mths['central'].rebin(rebin_factor).cut(x_max)
+    # Rebin and cut all histograms at once
+    systs = ['scale', 'jer', 'jec', 'jes', 'isr', 'fsr', 'pu', 'pdf']
+    names = ['central'] + [f'{syst}_{d}' for syst in systs for d in ['up', 'down']]
+    hists = common.HistogramSet.from_histograms({k: mths[k] for k in names}).rebin(rebin_factor).cut(x_max)
+    central = hists['central']
     meta = central.metadata
 
-    model_str = osp.basename(json_file).replace(".json","")
+    model_str = osp.splitext(osp.basename(json_file))[0]
     outdir = f'plots_{strftime("%Y%m%d")}_{model_str}'
     os.makedirs(outdir, exist_ok=True)
 
-    for syst in ['scale', 'jer', 'jec', 'jes', 'isr', 'fsr', 'pu', 'pdf']:
+    for syst in systs:
         plot = Plot(meta['selection'])
         plot.plot_hist(central, label='Central')
-        plot.plot_hist(mths[f'{syst}_up'].rebin(rebin_factor).cut(x_max), central, f'{syst} up')
-        plot.plot_hist(mths[f'{syst}_down'].rebin(rebin_factor).cut(x_max), central, f'{syst} down')
+        plot.plot_hist(hists[f'{syst}_up'], central, f'{syst} up')
+        plot.plot_hist(hists[f'{syst}_down'], central, f'{syst} down')
         plot.save(f'{outdir}/{syst}.png')
 
     stat_up = mths['central'].copy()
     stat_down = mths['central'].copy()
     i = 0
-    while f'mcstat{i}_up' in mths.keys():
+    while f'mcstat{i}_up' in mths:
         stat_up.vals[i] = mths[f'mcstat{i}_up'].vals[i]
         stat_down.vals[i] = mths[f'mcstat{i}_down'].vals[i]
         i += 1
@@ -519,8 +552,7 @@ def plot_systematics():
 @scripter
 def plot_bkg():
     json_file = common.pull_arg('jsonfile', type=str).jsonfile
-    with open(json_file) as f:
-        mths = json.load(f, cls=common.Decoder)    
+    mths = common.load_histograms(json_file, lazy=True)
 
     sig_json_file = common.pull_arg('sigjsonfile', type=str, nargs='*').sigjsonfile
     do_signal = len(sig_json_file) > 0
@@ -540,13 +572,12 @@ def plot_bkg():
             h.vals -= mths[bkg].rebin(rebin_factor).cut(750.).vals
 
         if do_signal:    
-            with open(sig_json_file[0]) as f:
-                sig = json.load(f, cls=common.Decoder)['central']
-                sig = sig.rebin(rebin_factor).cut(750.)
-                ax.step(
-                    sig.binning[:-1], sig.vals, '--k',
-                    where='post', label=sig.metadata['basename']
-                    )
+            sig = common.load_histograms(sig_json_file[0], lazy=True)['central']
+            sig = sig.rebin(rebin_factor).cut(750.)
+            ax.step(
+                sig.binning[:-1], sig.vals, '--k',
+                where='post', label=sig.metadata['basename']
+                )
 
         ax.set_yscale('log')
         ax.legend()
@@ -575,34 +606,42 @@ def merge(args=None):
     d = {}
     for json_file in json_files:
         common.logger.info(f'Merging {json_file}')
-        with open(json_file) as f:
-            mths = json.load(f, cls=common.Decoder)
-            d.update(mths)
+        d.update(common.load_histograms(json_file))
     
     if not outfile:
         for f in json_files:
             f = osp.abspath(f)
             if 'mz' not in f: continue
-            outfile = osp.basename(osp.abspath(f)) + '_withbkg.json'
+            outfile = osp.basename(osp.abspath(f)) + '_withbkg' + common.HISTOGRAMS_EXT
             break
         else:
-            outfile = 'out.npz'
+            outfile = 'out' + common.HISTOGRAMS_EXT
 
     common.logger.info(f'Dumping to {outfile}')
-    with open(outfile, 'w') as f:
-        json.dump(d, f, indent=4, cls=common.Encoder)
+    common.dump_histograms(d, outfile)
+
+
+@scripter
+def to_json():
+    """
+    Exports a histogram file to the (indented) JSON format.
+    """
+    infile = common.pull_arg('infile', type=str).infile
+    outfile = common.pull_arg('-o', '--outfile', type=str).outfile
+    if not outfile: outfile = osp.splitext(infile)[0] + '.json'
+    common.HistogramFile(infile).to_json(outfile)
+    common.logger.info(f'Exported {infile} to {outfile}')
 
 
 @scripter
 def ls():
     infile = common.pull_arg('infile', type=str).infile
-    if infile.endswith('.json'):
-        with open(infile, 'r') as f:
-            d = json.load(f, cls=common.Decoder)    
+    if infile.endswith('.json') or infile.endswith(common.HISTOGRAMS_EXT):
+        d = common.load_histograms(infile)
         from pprint import pprint
         pprint(d)
     elif infile.endswith('.root'):
-        array = svj.open_root(infile, load_gen=True, load_jerjec=True)
+        array = common.open_root(infile, load_gen=True, load_jerjec=True)
         print(f'Found {len(array)} in {infile}')
         print(f'Metdata:\n{array.metadata}')
     else:
@@ -1,6 +1,7 @@
-import os, os.path as osp, logging, re, time, json, argparse, sys, math
+import os, os.path as osp, logging, re, time, json, argparse, sys, math, glob, zipfile, threading
 import matplotlib.pyplot as plt
 from collections import OrderedDict
+from collections.abc import MutableMapping
 from contextlib import contextmanager
 import svj_ntuple_processing
 from scipy.ndimage import gaussian_filter
@@ -217,18 +218,27 @@ def imgcat(path) -> None:
         pass
 
 
-def expand_wildcards(pats):
-    import seutils
-    expanded = []
-    for pat in pats:
-        if '*' in pat:
-            if seutils.path.has_protocol(pat):
-                expanded.extend(seutils.ls_wildcard(pat))
-            else:
-                expanded.extend(glob.glob(pat))
-        else:
-            expanded.append(pat)
-    return expanded
+def expand_wildcards(pats, workers=16, ttl=None, backend=None):
+    """
+    Expands wildcards in a list of (local or remote) patterns; the order of
+    the patterns is kept.
+
+    Remote patterns are listed concurrently by `workers` threads, and their
+    listings are cached on disk for `ttl` seconds (default SVJ_LISTING_TTL),
+    so repeated invocations over the same directories do not list again.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    def expand(pat):
+        if '*' not in pat: return [pat]
+        if '://' in pat: return ls_wildcard_cached(pat, ttl, backend)
+        return glob.glob(pat)
+    remote = sum('*' in p and '://' in p for p in pats)
+    if remote > 1:
+        with ThreadPoolExecutor(min(workers, remote)) as pool:
+            expanded = list(pool.map(expand, pats))
+    else:
+        expanded = [expand(p) for p in pats]
+    return [path for paths in expanded for path in paths]
 
 
 class Scripter:
@@ -328,6 +338,17 @@ def quick_subplots(*args, **kwargs):
             pass
 
 
+def tmp_path(path, hidden=False):
+    """
+    Temporary name next to `path`, to write to and then os.replace onto `path`.
+    Unique per process and thread, so concurrent writers never share it.
+    With `hidden`, it is a dotfile, which sample globs skip.
+    """
+    tag = f'.tmp{os.getpid()}_{threading.get_ident()}'
+    if hidden: return osp.join(osp.dirname(path), tag + '_' + osp.basename(path))
+    return path + tag
+
+
 #__________________________________________________
 # Automatic cross section getter
 
@@ -356,6 +377,19 @@ class Record(dict):
         return self.xs*self.br*self.kfactor
 
 
+TREEMAKER_XS_URL = 'https://raw.githubusercontent.com/TreeMaker/TreeMaker/Run2_UL/WeightProducer/python/MCSampleValues.py'
+SIGNAL_XS_FIT_URL = 'https://raw.githubusercontent.com/boostedsvj/svj_madpt_crosssection/main/fit_madpt300.txt'
+
+# Pre-parsed cross section index; set SVJ_XS_INDEX to ship a prebuilt index to
+# worker nodes, and SVJ_OFFLINE=1 to forbid any network access.
+XS_INDEX_FILE = os.environ.get('SVJ_XS_INDEX', '/tmp/svj_xs_index.json')
+XS_INDEX_VERSION = 1
+
+
+def offline():
+    return os.environ.get('SVJ_OFFLINE', '0') not in ('', '0')
+
+
 def load_treemaker_crosssection_txt():
     """
     Downloads the cross section file from the TreeMaker repository and returns
@@ -364,8 +398,8 @@ def load_treemaker_crosssection_txt():
     import requests
     cache = '/tmp/treemaker_xs.txt'
     if not osp.isfile('/tmp/treemaker_xs.txt'):
-        url = 'https://raw.githubusercontent.com/TreeMaker/TreeMaker/Run2_UL/WeightProducer/python/MCSampleValues.py'
-        text = requests.get(url).text
+        if offline(): raise Exception(f'Offline mode, and no cached TreeMaker cross section file at {cache}')
+        text = requests.get(TREEMAKER_XS_URL).text
         with open(cache, 'w') as f:
             text = text.lower()
             f.write(text)
@@ -375,28 +409,120 @@ def load_treemaker_crosssection_txt():
             return f.read()
 
 
-def get_record(key):
+def parse_treemaker_crosssections(text):
     """
-    Looks for the sample key (e.g. "QCD_Pt_1400to1800") in the cross section
-    file from TreeMaker
+    Parses all records in the (lowercased) TreeMaker cross section file into
+    a dict of dicts, keyed by sample key (e.g. "qcd_pt_1400to1800").
+    """
+    records = {}
+    for match in re.finditer(r'"([^"]+)" : ({[\w\W]*?})', text):
+        record_txt = (
+            match.group(2)
+            .replace('xsvalues', 'dict')
+            .replace('brvalues', 'dict')
+            .replace('kfactorvalues', 'dict')
+            )
+        try:
+            records[match.group(1)] = eval(record_txt, {'__builtins__': {}}, {'dict': dict})
+        except Exception:
+            logger.debug(f'Could not parse record for {match.group(1)}')
+    return records
+
+
+def build_xs_index(outfile=XS_INDEX_FILE):
+    """
+    Parses the TreeMaker cross section file and fetches the signal cross
+    section fit, and stores both in one json file with a version stamp.
     """
+    import hashlib
     text = load_treemaker_crosssection_txt()
-    match = re.search('"'+key+'"' + r' : ({[\w\W]*?})', text, re.MULTILINE)
-    if not match: raise Exception(f'Could not find record for {key}')
-    # Turn it into a dict of dicts
-    record_txt = (
-        match.group(1)
-        .replace('xsvalues', 'dict')
-        .replace('brvalues', 'dict')
-        .replace('kfactorvalues', 'dict')
+    if offline(): raise Exception(f'Offline mode, cannot fetch the signal cross section fit')
+    index = dict(
+        version = XS_INDEX_VERSION,
+        created = time.strftime('%Y-%m-%d %H:%M:%S'),
+        treemaker_sha1 = hashlib.sha1(text.encode()).hexdigest(),
+        records = parse_treemaker_crosssections(text),
+        signal_xs_fit = requests.get(SIGNAL_XS_FIT_URL).json(),
         )
-    return Record(eval(record_txt))
+    tmp = tmp_path(outfile)
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, outfile)
+    logger.info(f'Stored {len(index["records"])} cross section records in {outfile}')
+    return index
+
+
+_XS_INDEX = None
+
+def xs_index():
+    """
+    Returns the cross section index. It is read at most once per process,
+    and only built (which requires network) if no valid index file exists.
+    """
+    global _XS_INDEX
+    if _XS_INDEX is None:
+        index = None
+        if osp.isfile(XS_INDEX_FILE):
+            with open(XS_INDEX_FILE) as f:
+                index = json.load(f)
+            if index.get('version') != XS_INDEX_VERSION:
+                logger.warning(f'Outdated cross section index {XS_INDEX_FILE}; rebuilding')
+                index = None
+        if index is None:
+            if offline(): raise Exception(f'Offline mode, and no valid cross section index at {XS_INDEX_FILE}')
+            index = build_xs_index()
+        _XS_INDEX = index
+        _XS_INDEX['signal_xs_fit'] = np.poly1d(_XS_INDEX['signal_xs_fit'])
+    return _XS_INDEX
+
+
+def get_record(key):
+    """
+    Looks for the sample key (e.g. "QCD_Pt_1400to1800") in the cross section
+    index built from the TreeMaker cross section file
+    """
+    try:
+        return Record(xs_index()['records'][key.lower()])
+    except KeyError:
+        raise Exception(f'Could not find record for {key}')
+
+
+def signal_xs(mz):
+    """
+    Signal cross section from the fit, as a function of mz
+    """
+    return xs_index()['signal_xs_fit'](mz)
 
 
+def mt_slice(mt, mt_low, mt_high):
+    """
+    Slice of the events with mt_low < mt < mt_high, for an ascending `mt` array.
+    """
+    return slice(
+        int(np.searchsorted(mt, mt_low, side='right')),
+        int(np.searchsorted(mt, mt_high, side='left'))
+        )
+
 def mt_wind(cols, mt_high, mt_low):
+    """
+    Selects mt_low < mt < mt_high. Returns a boolean mask, or, if the sample
+    was saved sorted by mt (see Columns.sort_by), a contiguous slice found
+    by binary search.
+    """
+    if cols.metadata.get('sorted_by') == 'mt':
+        return mt_slice(cols.arrays['mt'], mt_low, mt_high)
     mt_cut = (cols.arrays['mt']>mt_low) & (cols.arrays['mt']<mt_high)
     return mt_cut
 
+def mask_to_rows(mask):
+    """
+    Turns a boolean mask into row indices; slices are kept as they are.
+    """
+    return mask if isinstance(mask, slice) else np.flatnonzero(mask)
+
+def n_rows(rows):
+    return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
 def filter_pt(cols, min_pt):
     """
     Filters for a minimum pt (only valid for QCD).
@@ -563,6 +689,174 @@ class MTHistogram(Histogram):
         super().__init__(self.bins, vals, errs)
 
 
+class HistogramSet:
+    """
+    Many histograms with the same binning, stored as one (n_histograms x
+    n_bins) array of values and one of squared errors, with a name index.
+
+    Accumulation happens in place and rebin/cut/normalize act on all
+    histograms at once. Convert from and to Histogram objects with
+    `from_histograms` and `to_histograms`.
+
+    Example:
+        >>> hists = HistogramSet(MT_BINS, ['qcd', 'ttjets'])
+        >>> hists.add('qcd', mth)
+        >>> hists.rebin(2).cut(650.)['qcd']
+    """
+    def __init__(self, binning, names=(), vals=None, sumw2=None):
+        self.binning = np.asarray(binning)
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        shape = (len(self.names), self.nbins)
+        self.vals = np.zeros(shape) if vals is None else vals
+        self.sumw2 = np.zeros(shape) if sumw2 is None else sumw2
+        self.metadata = {name: {} for name in self.names}
+
+    @classmethod
+    def from_histograms(cls, hists):
+        """
+        Builds a set from a dict name -> Histogram; all need the same binning.
+        """
+        hists = {name: h for name, h in hists.items() if isinstance(h, Histogram)}
+        names = list(hists)
+        binning = hists[names[0]].binning
+        for name, h in hists.items():
+            if not np.array_equal(h.binning, binning):
+                raise ValueError(f'Histogram {name} has a different binning')
+        inst = cls(
+            binning, names,
+            np.array([hists[n].vals for n in names], dtype=float),
+            np.array([hists[n].errs**2 for n in names], dtype=float)
+            )
+        for name in names: inst.metadata[name] = hists[name].metadata.copy()
+        return inst
+
+    @property
+    def nbins(self):
+        return len(self.binning)-1
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        """Returns histogram `name` as a (copied) Histogram"""
+        i = self.index[name]
+        h = Histogram(self.binning.copy(), self.vals[i].copy(), np.sqrt(self.sumw2[i]))
+        h.metadata = self.metadata[name].copy()
+        return h
+
+    def __setitem__(self, name, hist):
+        i = self.row(name)
+        self.vals[i] = hist.vals
+        self.sumw2[i] = hist.errs**2
+        self.metadata[name] = hist.metadata.copy()
+
+    def to_histograms(self):
+        return {name: self[name] for name in self.names}
+
+    def row(self, name):
+        """Row index of histogram `name`; a new name gets an empty row"""
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.metadata[name] = {}
+            self.vals = np.vstack((self.vals, np.zeros((1, self.nbins))))
+            self.sumw2 = np.vstack((self.sumw2, np.zeros((1, self.nbins))))
+        return self.index[name]
+
+    def add(self, name, other):
+        """
+        Adds a Histogram or a numpy array of values (with Poisson errors, like
+        Histogram.__add__) to histogram `name`, in place.
+        """
+        i = self.row(name)
+        if isinstance(other, Histogram):
+            self.vals[i] += other.vals
+            self.sumw2[i] += other.errs**2
+        else:
+            self.vals[i] += other
+            self.sumw2[i] += other
+
+    def _new(self, binning, vals, sumw2, names=None):
+        inst = self.__class__(binning, self.names if names is None else names, vals, sumw2)
+        if names is None:
+            inst.metadata = {name: meta.copy() for name, meta in self.metadata.items()}
+        return inst
+
+    def rebin(self, n=2):
+        """
+        Merges every n bins of all histograms, like Histogram.rebin.
+        Returns a new set.
+        """
+        if n == 1: return self._new(self.binning.copy(), self.vals.copy(), self.sumw2.copy())
+        binning_new = self.binning[::n]
+        if binning_new[-1] != self.binning[-1]:
+            binning_new = np.append(binning_new, self.binning[-1])
+        starts = np.arange(0, self.nbins, n)
+        return self._new(
+            binning_new,
+            np.add.reduceat(self.vals, starts, axis=1),
+            np.add.reduceat(self.sumw2, starts, axis=1),
+            )
+
+    def cut(self, x_max):
+        """
+        Throws away all bins for which the right bin boundary > x_max, like
+        Histogram.cut. Returns a new set.
+        """
+        i_bin = np.argmax(self.binning > x_max)
+        return self._new(
+            self.binning[:i_bin].copy(), self.vals[:,:i_bin-1].copy(), self.sumw2[:,:i_bin-1].copy()
+            )
+
+    @property
+    def norm(self):
+        return self.vals.sum(axis=1)
+
+    def normalize(self, norm=1.):
+        """
+        Scales every (non-empty) histogram to integral `norm`. Returns a new set.
+        """
+        current = self.norm
+        scale = np.divide(norm, current, out=np.ones_like(current), where=current!=0.)
+        return self._new(self.binning.copy(), self.vals * scale[:,None], self.sumw2 * scale[:,None]**2)
+
+    def group_sum(self, groups):
+        """
+        Sums histograms per group. `groups` is a dict group -> list of names,
+        or a function name -> group. Returns a new set with one histogram per
+        group.
+        """
+        if callable(groups):
+            by_group = {}
+            for name in self.names:
+                by_group.setdefault(groups(name), []).append(name)
+            groups = by_group
+        rows = [[self.index[name] for name in names] for names in groups.values()]
+        return self._new(
+            self.binning.copy(),
+            np.array([self.vals[r].sum(axis=0) for r in rows]).reshape(len(rows), self.nbins),
+            np.array([self.sumw2[r].sum(axis=0) for r in rows]).reshape(len(rows), self.nbins),
+            list(groups)
+            )
+
+    def sum(self, names=None):
+        """Sum of histograms `names` (default all) as a Histogram"""
+        rows = [self.index[n] for n in (self.names if names is None else names)]
+        return Histogram(
+            self.binning.copy(), self.vals[rows].sum(axis=0), np.sqrt(self.sumw2[rows].sum(axis=0))
+            )
+
+    def __repr__(self):
+        return f'<HistogramSet n={len(self)} nbins={self.nbins} names={self.names}>'
+
+
 class Encoder(json.JSONEncoder):
     """
     Standard JSON encoder, but support for the Histogram class
@@ -590,175 +884,2561 @@ class Decoder(json.JSONDecoder):
         return d
 
 #__________________________________________________
-# Data pipeline
+# Histogram files
 
-class Columns(svj_ntuple_processing.Columns):
-    """
-    Data structure that contains all the training data (features)
-    and information about the sample.
-    
-    See: https://github.com/boostedsvj/svj_ntuple_processing/blob/main/svj_ntuple_processing/__init__.py#L357
+HISTOGRAMS_EXT = '.hists'
+
+
+class HistogramFile:
     """
-    @classmethod
-    def load(cls, *args, **kwargs):
-        inst = super().load(*args, **kwargs)
-        # Transforming bytes keys to str keys
-        old_cf = inst.cutflow
-        inst.cutflow = OrderedDict()
-        for key in old_cf.keys():
-            if isinstance(key, bytes):
-                inst.cutflow[key.decode()] = old_cf[key]
-            else:
-                inst.cutflow[key] = old_cf[key]
-        return inst
+    Binary, random-access container for (nested dicts and lists of)
+    histograms: a zip file with one .npy entry of shape (2, nbins) per
+    histogram (vals and errs), every distinct binning stored once, and a
+    JSON table of contents with the structure, the metadata and any
+    non-histogram values.
 
-    def __repr__(self):
-        return (
-            '<Column '
-            + ' '.join([f'{k}={v}' for k, v in self.metadata.items() if k!='src'])
-            + '>'
-            )
+    Histograms are read only when accessed, by their path in the tree
+    (e.g. 'central', or 'histograms/0.300/qcd'). `append` adds entries
+    without rewriting the file. Use `to_json` for the old JSON format.
 
-    @property
-    def key(self):
-        return (
-            osp.basename(self.metadata['src'])
-            .replace('.npz', '')
-            ).split('_TuneCP5_13TeV')[0].lower()
+    Example:
+        >>> HistogramFile.write('sig.hists', mths)
+        >>> f = HistogramFile('sig.hists')
+        >>> f['central'], f['mcstat3_up']
+    """
+    def __init__(self, path):
+        self.path = path
+        self._toc = None
+        self._zip = None
+        self._axes = {}
 
     @property
-    def record(self):
-        if not hasattr(self, '_record'):
-            self._record = get_record(self.key)
-        return self._record
+    def toc(self):
+        if self._toc is None:
+            if not osp.isfile(self.path):
+                self._toc = dict(version=0, axes=[], entries={})
+            else:
+                with zipfile.ZipFile(self.path) as zf:
+                    tocs = sorted(n for n in zf.namelist() if n.startswith('toc'))
+                    self._toc = json.loads(zf.read(tocs[-1]))
+        return self._toc
 
-    @property
-    def presel_eff(self):
-        if self.cutflow['raw']==0: return 0.
-        return self.cutflow['preselection'] / self.cutflow['raw']
+    @classmethod
+    def write(cls, path, tree):
+        """Writes `tree` to a new file at `path`, atomically"""
+        tmp = tmp_path(path)
+        inst = cls(tmp)
+        inst.append(tree)
+        os.replace(tmp, path)
+        return cls(path)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def keys(self):
+        """Paths of all histograms and values"""
+        return [k for k, entry in self.toc['entries'].items() if 'container' not in entry]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self.toc['entries'] and 'container' not in self.toc['entries'][key]
+
+    def _read(self, member):
+        if self._zip is None: self._zip = zipfile.ZipFile(self.path)
+        with self._zip.open(member) as f:
+            return np.lib.format.read_array(f)
+
+    def axis(self, i):
+        if i not in self._axes: self._axes[i] = self._read(self.toc['axes'][i]['member'])
+        return self._axes[i]
+
+    def __getitem__(self, key):
+        """Reads one histogram (or value) by its path"""
+        entry = self.toc['entries'][key]
+        if 'value' in entry: return entry['value']
+        vals, errs = self._read(entry['member'])
+        h = Histogram(self.axis(entry['axis']).copy(), vals, errs)
+        h.metadata = entry['metadata'].copy()
+        return h
 
-    @property
-    def xs(self):
-        if hasattr(self, 'manual_xs'):
-            # Only for setting a manual cross section
-            return self.manual_xs
-        elif 'bkg_type' in self.metadata:
-            return self.record.effxs
-        else:
-            if not hasattr(self, '_signal_xs_fit'):
-                self._signal_xs_fit = np.poly1d(
-                    requests
-                    .get('https://raw.githubusercontent.com/boostedsvj/svj_madpt_crosssection/main/fit_madpt300.txt')
-                    .json()
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def append(self, tree):
+        """
+        Adds the histograms and values of `tree` (merged on keys, like
+        dict.update); entries that already exist are replaced.
+        Histograms may be Histogram objects or their .json() dicts.
+        """
+        import hashlib
+        toc = self.toc
+        self.close()
+        toc['version'] += 1
+        axis_index = {axis['sha1']: i for i, axis in enumerate(toc['axes'])}
+        with zipfile.ZipFile(self.path, 'a') as zf:
+            # Running count of written members, so replaced entries get new names
+            toc.setdefault('n_members', len(zf.namelist()))
+
+            def write_array(member, array):
+                with zf.open(member, 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+            for path, leaf in flatten_histogram_tree(tree):
+                if isinstance(leaf, HistogramTreeContainer):
+                    if path: toc['entries'][path] = dict(container=leaf.kind)
+                    continue
+                if isinstance(leaf, dict) and leaf.get('type') == 'Histogram':
+                    leaf = Histogram.from_dict(leaf)
+                if not isinstance(leaf, Histogram):
+                    toc['entries'][path] = dict(value=leaf)
+                    continue
+                binning = np.asarray(leaf.binning, dtype=float)
+                sha1 = hashlib.sha1(binning.tobytes()).hexdigest()
+                if sha1 not in axis_index:
+                    axis_index[sha1] = len(toc['axes'])
+                    member = f'axis{len(toc["axes"])}.npy'
+                    write_array(member, binning)
+                    toc['axes'].append(dict(member=member, sha1=sha1))
+                member = f'h{toc["n_members"]}.npy'
+                toc['n_members'] += 1
+                write_array(member, np.array([leaf.vals, leaf.errs], dtype=float))
+                toc['entries'][path] = dict(
+                    member=member, axis=axis_index[sha1],
+                    metadata=json_metadata(leaf.metadata)
                     )
-            return self._signal_xs_fit(self.metadata['mz'])
+            zf.writestr(f'toc{toc["version"]:06d}.json', json.dumps(toc, cls=NumpyEncoder))
 
-    @property
-    def effxs(self):
-        return self.xs * self.presel_eff
+    def load(self, prefix=''):
+        """
+        Reads the whole tree (or the subtree at path `prefix`) back into
+        nested dicts and lists of Histograms.
+        """
+        entries = self.toc['entries']
+        children = {'': []}
+        for path, entry in entries.items():
+            if 'container' in entry: children[path] = []
+            children[path.rsplit('/', 1)[0] if '/' in path else ''].append(path)
+        def build(path):
+            if path != '' and 'container' not in entries[path]: return self[path]
+            values = {child.rsplit('/', 1)[-1]: build(child) for child in children[path]}
+            if path != '' and entries[path]['container'] == 'list':
+                return [values[str(i)] for i in range(len(values))]
+            return values
+        return build(prefix)
+
+    def to_json(self, outfile):
+        """Exports to the (indented) JSON format of json.dump with Encoder"""
+        with open(outfile, 'w') as f:
+            json.dump(self.load(), f, cls=Encoder, indent=4)
+
+
+class HistogramTreeContainer:
+    def __init__(self, kind):
+        self.kind = kind
+
+
+def flatten_histogram_tree(tree, prefix=''):
+    """
+    Yields (path, leaf) for all leaves of nested dicts and lists, preceded by
+    (path, HistogramTreeContainer) for every dict or list.
+    """
+    if isinstance(tree, (dict, list)) and not (isinstance(tree, dict) and tree.get('type') == 'Histogram'):
+        yield prefix, HistogramTreeContainer('list' if isinstance(tree, list) else 'dict')
+        items = enumerate(tree) if isinstance(tree, list) else tree.items()
+        for key, value in items:
+            key = str(key)
+            if '/' in key: raise ValueError(f'Key {key} cannot contain a "/"')
+            yield from flatten_histogram_tree(value, f'{prefix}/{key}' if prefix else key)
+    else:
+        yield prefix, tree
 
-    @property
-    def weight_per_event(self):
-        return self.effxs / len(self)
 
+def json_metadata(metadata):
+    """Metadata as Histogram.json stores it: anything float-like as a float"""
+    out = {}
+    for k, v in metadata.items():
+        try:
+            out[k] = float(v)
+        except (ValueError, TypeError):
+            out[k] = v
+    return out
 
-def columns_to_numpy(
-    signal_cols, bkg_cols, features,
-    downsample=.4, weight_key='weight',
-    mt_high=650, mt_low=180
-    ):
+
+def dump_histograms(tree, outfile):
     """
-    Takes a list of signal and background Column instances, and outputs
-    a numpy array with `features` as the columns.
+    Writes histograms to a HistogramFile, or to JSON if outfile ends with .json.
     """
-    X = []
-    y = []
-    bkg_weight = []
-    signal_weight = []
-
-    logger.info(f'Downsampling bkg, keeping fraction of {downsample}')
-    # Get the features for the bkg samples
-    for cols in bkg_cols:
-        mtwind = mt_wind(cols, mt_high, mt_low)
-        this_X = cols.to_numpy(features)[mtwind]
-        this_weight = cols.arrays[weight_key][mtwind]
-        if downsample < 1.:
-            #select = np.random.choice(len(cols), int(downsample*len(cols)), replace=False)
-            select = np.random.choice(len(this_weight), int(downsample*len(this_weight)), replace=False)
-            this_X = this_X[select]
-            this_weight = this_weight[select]
-        X.append(this_X)
-        bkg_weight.append(this_weight)
-        y.append(np.zeros(len(this_X)))
-
-    # Get the features for the signal samples
-    for cols in signal_cols:
-        sigmtwind = mt_wind(cols, mt_high, mt_low)
-        X.append(cols.to_numpy(features)[sigmtwind])
-        #print(features)
-        len_sig_cols=len(cols.arrays[features[0]][sigmtwind])
-        #print(cols.to_numpy(features)[sigmtwind])
-        #print(len(cols.to_numpy(features)[sigmtwind]))
-        #length_of_signalCol=len(cols.arrays(features)[mtwind])
-        #print(length_of_signalCol, len(cols))
-        y.append(np.ones(len_sig_cols))
-        # All signal model parameter variations should get equal weight,
-        # but some signal samples have more events.
-        # Use 1/n_events as a weight per event.
-        signal_weight.append((1./len_sig_cols)*np.ones(len_sig_cols))
-    
-    bkg_weight = np.concatenate(bkg_weight)
-    signal_weight = np.concatenate(signal_weight)
-    # Set total signal weight equal to total bkg weight
-    signal_weight *= np.sum(bkg_weight) / np.sum(signal_weight)
-    weight = np.concatenate((bkg_weight, signal_weight))
+    if outfile.endswith('.json'):
+        with open(outfile, 'w') as f:
+            json.dump(tree, f, cls=Encoder, indent=4)
+    else:
+        HistogramFile.write(outfile, tree)
 
-    X = np.concatenate(X)
-    y = np.concatenate(y)
-    return X, y, weight
 
+def load_histograms(path, lazy=False):
+    """
+    Reads a HistogramFile or a JSON histogram file. With `lazy`, a
+    HistogramFile is returned as is, so only accessed histograms are read.
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f, cls=Decoder)
+    f = HistogramFile(path)
+    return f if lazy else f.load()
 
-def add_key_value_to_json(json_file, key, value):
-    with open(json_file, 'r') as f:
-        json_str = f.read()
-    json_str = json_str.rstrip()
-    json_str = json_str[:-1] # Strip off the last }
-    json_str += f',"{key}":{json.dumps(value)}}}'
-    with open(json_file, 'w') as f:
-        f.write(json_str)
-    logger.info(f'Added "{key}":{json.dumps(value)} to {json_file}')
 
+#__________________________________________________
+# Chunked histogramming
 
-def add_manual_weight_column(signal_cols, bkg_cols):
+# Block size np.histogram processes events in
+HIST_BLOCK = 65536
+# Default number of events per chunk for out-of-core processing
+CHUNK_SIZE = 4 * HIST_BLOCK
+
+
+class HistogramAccumulator:
     """
-    Adds the manual weight calculation as a column
+    Fills weighted histograms of one variable, for several named weights at
+    once, incrementally from chunks of events.
+
+    Follows np.histogram's algorithm for explicit bin edges: events are
+    processed in blocks of HIST_BLOCK, the cumulative (sorted) weight at the
+    bin edges of every block is added up, and the bin contents are the
+    differences of that sum. Filled events are buffered into the same blocks
+    np.histogram would use, so the result is bit-identical to a single
+    np.histogram call on all events, whatever the chunk sizes.
     """
-    total_bkg_weight = 0
-    for c in bkg_cols:
-        c.arrays['manualweight'] = np.ones(len(c)) * c.weight_per_event
-        total_bkg_weight += c.arrays['manualweight'].sum()
+    def __init__(self, bins):
+        self.bins = bins
+        self.cum_sumw = {}
+        self.cum_sumw2 = {}
+        self.pending = []
+        self.n_pending = 0
+
+    def fill(self, x, weights):
+        """
+        Adds events: `x` the values, `weights` a dict of weight arrays.
+        Every fill must have the same weight names.
+        """
+        self.pending.append((x, weights))
+        self.n_pending += len(x)
+        if self.n_pending >= HIST_BLOCK: self._process()
 
-    # Set signal weights scaled relatively to one another (but not yet w.r.t. bkg)
-    total_signal_weight = 0
-    for c in signal_cols:
-        c.arrays['manualweight'] = np.ones(len(c)) / len(c)
-        total_signal_weight += c.arrays['manualweight'].sum()
-    
-    # Scale signal weights correctly w.r.t. bkg
-    for c in signal_cols:
-        c.arrays['manualweight'] *= total_bkg_weight / total_signal_weight
+    def _process(self, final=False):
+        if len(self.pending) == 1:
+            x, weights = self.pending[0]
+        else:
+            x = np.concatenate([p[0] for p in self.pending])
+            weights = {
+                name : np.concatenate([p[1][name] for p in self.pending])
+                for name in self.pending[0][1]
+                }
+        n_done = len(x) if final else len(x) - len(x) % HIST_BLOCK
+        for i in range(0, n_done, HIST_BLOCK):
+            self._add_block(
+                x[i:i+HIST_BLOCK], {name: w[i:i+HIST_BLOCK] for name, w in weights.items()}
+                )
+        self.pending = [] if n_done == len(x) else [
+            (x[n_done:], {name: w[n_done:] for name, w in weights.items()})
+            ]
+        self.n_pending = len(x) - n_done
+
+    def _add_block(self, x, weights):
+        sorting_index = np.argsort(x)
+        sx = x[sorting_index]
+        bin_index = np.concatenate((
+            sx.searchsorted(self.bins[:-1], 'left'),
+            sx.searchsorted(self.bins[-1:], 'right')
+            ))
+        for name, w in weights.items():
+            for cum, values in [(self.cum_sumw, w), (self.cum_sumw2, w**2)]:
+                sw = values[sorting_index]
+                cw = np.concatenate((np.zeros(1, dtype=sw.dtype), sw.cumsum()))
+                if name not in cum: cum[name] = np.zeros(len(self.bins), dtype=sw.dtype)
+                cum[name] += cw[bin_index]
+
+    def finish(self):
+        """
+        Processes the remaining buffered events; call after the last fill.
+        """
+        if self.pending: self._process(final=True)
 
+    def sumw(self, name):
+        return np.diff(self.cum_sumw.get(name, np.zeros(len(self.bins))))
 
-def read_training_features(model_file):
+    def sumw2(self, name):
+        return np.diff(self.cum_sumw2.get(name, np.zeros(len(self.bins))))
+
+    def histogram(self, name):
+        """
+        Histogram of weight `name`, equal to MTHistogram(x, weights[name])
+        when the bins are MTHistogram.bins.
+        """
+        return Histogram(
+            self.bins, self.sumw(name).astype(float),
+            np.sqrt(self.sumw2(name).astype(float))
+            )
+
+
+def is_uniform(bins):
+    bins = np.asarray(bins)
+    return len(bins) > 1 and np.allclose(
+        np.diff(bins), (bins[-1]-bins[0]) / (len(bins)-1), rtol=1e-9, atol=0.
+        )
+
+
+def bin_index(x, bins):
     """
-    Reads the features used to train a model from a .json file.
-    Only works for xgboost-trained models.
+    Returns the bin index of every value in x, with np.histogram conventions:
+    bins are left-closed, except the last bin, which is closed on both sides.
+    Values outside of the binning get index -1.
+
+    Uniform bins (like MT_BINS) are computed arithmetically, corrected by
+    comparing to the edges like np.histogram does; other bins by binary search.
     """
-    with open(model_file, 'rb') as f:
-        model = json.load(f)
-        return model['features']
+    bins = np.asarray(bins)
+    x = np.asarray(x)
+    nbins = len(bins) - 1
+    if not is_uniform(bins):
+        idx = np.searchsorted(bins, x, side='right') - 1
+        idx[x == bins[-1]] = nbins - 1
+        idx[(idx < 0) | (idx >= nbins)] = -1
+        return idx
+    idx = np.full(len(x), -1, dtype=np.intp)
+    inside = (x >= bins[0]) & (x <= bins[-1])
+    x = x[inside].astype(bins.dtype, copy=False)
+    i = ((x - bins[0]) / (bins[-1] - bins[0]) * nbins).astype(np.intp)
+    i[i == nbins] -= 1
+    # Arithmetic can be off by one ulp at the bin edges
+    i[x < bins[i]] -= 1
+    i[(x >= bins[i+1]) & (i != nbins-1)] += 1
+    idx[inside] = i
+    return idx
+
+
+# Events per parallel partial sum of the numba fill kernel
+NUMBA_SUBBLOCK = 4096
+
+
+_NUMBA_KERNEL = []
+
+
+def numba_fill_kernel():
+    """
+    Returns the numba kernel of HistogramBank (compiled on the first call),
+    or None if numba is not installed.
+
+    Events are split in fixed sub-blocks that are summed in parallel, and the
+    partial sums are added in order, so the result does not depend on the
+    number of threads.
+    """
+    if _NUMBA_KERNEL: return _NUMBA_KERNEL[0]
+    try:
+        import numba
+    except ImportError:
+        _NUMBA_KERNEL.append(None)
+        return None
+
+    @numba.njit(parallel=True)
+    def kernel(idx, w, sumw, sumw2):
+        n, n_weights = w.shape
+        n_sub = (n + NUMBA_SUBBLOCK - 1) // NUMBA_SUBBLOCK
+        partial_w = np.zeros((n_sub,) + sumw.shape)
+        partial_w2 = np.zeros((n_sub,) + sumw.shape)
+        for i_sub in numba.prange(n_sub):
+            for i in range(i_sub*NUMBA_SUBBLOCK, min(n, (i_sub+1)*NUMBA_SUBBLOCK)):
+                b = idx[i]
+                if b < 0: continue
+                for k in range(n_weights):
+                    partial_w[i_sub, k, b] += w[i, k]
+                    partial_w2[i_sub, k, b] += w[i, k] * w[i, k]
+        for i_sub in range(n_sub):
+            sumw += partial_w[i_sub]
+            sumw2 += partial_w2[i_sub]
+
+    _NUMBA_KERNEL.append(kernel)
+    return kernel
+
+
+class HistogramBank(HistogramAccumulator):
+    """
+    Fills histograms of one variable for many weights (e.g. all systematic
+    variations) in a single pass.
+
+    The bin index of every event is computed once (see `bin_index`), and sumw
+    and sumw2 of the whole (n_events x n_weights) weight matrix are filled
+    with a single np.bincount, or, if numba is installed and `use_numba`,
+    with a parallel kernel. Events are summed in the same blocks of
+    HIST_BLOCK as HistogramAccumulator, so the result does not depend on how
+    the events are split over fills; it agrees with np.histogram up to
+    floating point rounding.
+    """
+    def __init__(self, bins, use_numba=True):
+        super().__init__(bins)
+        self.use_numba = use_numba
+        self.names = None
+
+    def _add_block(self, x, weights):
+        if self.names is None:
+            self.names = list(weights)
+            self.sumw_matrix = np.zeros((len(self.names), len(self.bins)-1))
+            self.sumw2_matrix = np.zeros((len(self.names), len(self.bins)-1))
+        idx = bin_index(x, self.bins)
+        w = np.column_stack([np.asarray(weights[name], dtype=float) for name in self.names])
+        kernel = numba_fill_kernel() if self.use_numba else None
+        if kernel is not None:
+            kernel(idx, w, self.sumw_matrix, self.sumw2_matrix)
+            return
+        select = idx >= 0
+        n_weights, nbins = self.sumw_matrix.shape
+        # Flat index (weight, bin) of every entry of the weight matrix
+        flat_idx = (np.arange(n_weights) * nbins + idx[select, None]).ravel()
+        w = w[select].ravel()
+        self.sumw_matrix += np.bincount(flat_idx, weights=w, minlength=n_weights*nbins).reshape(n_weights, nbins)
+        self.sumw2_matrix += np.bincount(flat_idx, weights=w**2, minlength=n_weights*nbins).reshape(n_weights, nbins)
+
+    def sumw(self, name):
+        if self.names is None: return np.zeros(len(self.bins)-1)
+        return self.sumw_matrix[self.names.index(name)].copy()
+
+    def sumw2(self, name):
+        if self.names is None: return np.zeros(len(self.bins)-1)
+        return self.sumw2_matrix[self.names.index(name)].copy()
+
+    def histograms(self):
+        return {name: self.histogram(name) for name in self.names or []}
+
+
+def fill_histograms(x, weights, bins=None):
+    """
+    Histograms x for every weight in the dict `weights` in one pass.
+    Returns a dict name -> Histogram, by default in MTHistogram.bins.
+    """
+    bank = HistogramBank(MTHistogram.bins if bins is None else bins)
+    bank.fill(x, weights)
+    bank.finish()
+    return {name: bank.histogram(name) for name in weights}
+
+
+def accumulate_histograms(cols, fn, bins, chunk_size=None, exact=True):
+    """
+    Runs `fn(chunk)`, which returns the values to histogram and a dict of
+    weights, over chunks of `chunk_size` events of `cols` (all events at once
+    if chunk_size is None), and returns the filled HistogramAccumulator, which
+    reproduces np.histogram (and MTHistogram) bit for bit.
+
+    With `exact=False`, a HistogramBank is used instead: faster for many
+    weights, but the sums are added in another order, so bin contents differ
+    from np.histogram by floating point rounding (about 1e-12 of the summed
+    absolute weights in the bin), and can differ between runs with and
+    without numba.
+    """
+    accumulator = HistogramAccumulator(bins) if exact else HistogramBank(bins)
+    for chunk in cols.iter_chunks(chunk_size):
+        accumulator.fill(*fn(chunk))
+    accumulator.finish()
+    return accumulator
+
+
+#__________________________________________________
+# Remote file cache
+
+CACHE_DIR = os.environ.get('SVJ_CACHE_DIR', osp.expanduser('~/.cache/svj_uboost'))
+CACHE_BYTES = int(float(os.environ.get('SVJ_CACHE_BYTES', 50e9)))
+
+
+class SEBackend:
+    """
+    Remote storage through seutils (root://, gsiftp://, ...).
+    """
+    def stat(self, remote):
+        import seutils
+        inode = seutils.stat(remote)
+        return inode.size, str(inode.modtime)
+
+    def copy(self, remote, local):
+        import seutils
+        seutils.cp(remote, local, force=True)
 
-def rhoddt_windowcuts(mt, pt, rho):
+    def ls_wildcard(self, pattern):
+        import seutils
+        return seutils.ls_wildcard(pattern)
+
+    def walk(self, remote):
+        """(path, size, mtime) of all files under directory `remote`"""
+        import seutils
+        return [
+            (f.path, f.size, str(f.modtime))
+            for _, _, files in seutils.walk(remote, stat=True) for f in files
+            ]
+
+    def checksum(self, remote):
+        """adler32 of a remote file, or None if the storage does not provide it"""
+        return None
+
+
+class LocalBackend:
+    """
+    Stands in for remote storage with a local directory: 'root://host//a/b.npz'
+    maps to <root>/a/b.npz. Without a root, paths are used as they are.
+    """
+    def __init__(self, root=None):
+        self.root = root
+
+    def path(self, remote):
+        if self.root is None: return remote
+        return osp.join(self.root, re.sub(r'^\w+://[^/]*/+', '', remote))
+
+    def stat(self, remote):
+        stat = os.stat(self.path(remote))
+        return stat.st_size, stat.st_mtime_ns
+
+    def copy(self, remote, local):
+        import shutil
+        shutil.copyfile(self.path(remote), local)
+
+    def ls_wildcard(self, pattern):
+        if self.root is None: return sorted(glob.glob(pattern))
+        prefix = re.match(r'^\w+://[^/]*/+', pattern).group()
+        return [
+            prefix + osp.relpath(p, self.root)
+            for p in sorted(glob.glob(self.path(pattern)))
+            ]
+
+    def walk(self, remote):
+        out = []
+        for dirpath, dirnames, files in os.walk(self.path(remote)):
+            dirnames.sort()
+            for f in sorted(files):
+                local = osp.join(dirpath, f)
+                stat = os.stat(local)
+                path = osp.join(remote, osp.relpath(local, self.path(remote)))
+                out.append((path, stat.st_size, stat.st_mtime_ns))
+        return out
+
+    def checksum(self, remote):
+        return adler32(self.path(remote))
+
+
+def adler32(path, blocksize=1<<22):
+    """adler32 checksum of a local file, as 8 hex digits (like xrdadler32)"""
+    import zlib
+    value = 1
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            value = zlib.adler32(block, value)
+    return f'{value:08x}'
+
+
+class FileCache:
+    """
+    Local copies of remote files, keyed by remote path, size and mtime, so a
+    changed remote file is fetched again.
+
+    Files are stored as <cachedir>/<key>/<basename>, so readers that look at
+    file names or extensions still work. Downloads go to a temporary name and
+    are moved into place when complete; a lock file per entry keeps concurrent
+    processes from downloading the same file twice. When the cache exceeds
+    `max_bytes`, the least recently used entries are removed, except entries
+    used in the last `grace` seconds (another process may be about to open them).
+    """
+    def __init__(self, cachedir=CACHE_DIR, max_bytes=CACHE_BYTES, backend=None, grace=300.):
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.backend = SEBackend() if backend is None else backend
+        self.grace = grace
+
+    def entry(self, remote):
+        import hashlib
+        size, mtime = self.backend.stat(remote)
+        key = hashlib.sha1(f'{remote}|{size}|{mtime}'.encode()).hexdigest()
+        return osp.join(self.cachedir, key, osp.basename(remote.rstrip('/'))), size
+
+    def get(self, remote):
+        """
+        Returns the local path of `remote`, downloading it first if needed.
+        """
+        import fcntl
+        local, size = self.entry(remote)
+        if not osp.isfile(local):
+            os.makedirs(osp.dirname(local), exist_ok=True)
+            with open(osp.join(osp.dirname(local), '.lock'), 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not osp.isfile(local):
+                    self.evict(size)
+                    tmp = tmp_path(local, hidden=True)
+                    with time_and_log(f'Caching {remote} -> {local}'):
+                        self.backend.copy(remote, tmp)
+                    os.replace(tmp, local)
+        os.utime(local) # mtime marks the last use, for LRU eviction
+        return local
+
+    def entries(self):
+        """(last use, size, path) of all cached files"""
+        if not osp.isdir(self.cachedir): return []
+        out = []
+        for key in os.listdir(self.cachedir):
+            d = osp.join(self.cachedir, key)
+            if key.startswith('.') or not osp.isdir(d): continue
+            for f in os.listdir(d):
+                if f.startswith('.'): continue
+                stat = os.stat(osp.join(d, f))
+                out.append((stat.st_mtime, stat.st_size, osp.join(d, f)))
+        return out
+
+    def evict(self, incoming=0):
+        """
+        Removes least recently used files until `incoming` more bytes fit.
+        """
+        import shutil
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries) + incoming
+        now = time.time()
+        for last_use, size, path in entries:
+            if total <= self.max_bytes: break
+            if now - last_use < self.grace: continue
+            logger.info(f'Evicting {path} from the file cache')
+            shutil.rmtree(osp.dirname(path), ignore_errors=True)
+            total -= size
+
+
+LISTING_TTL = float(os.environ.get('SVJ_LISTING_TTL', 3600.))
+
+
+def ls_wildcard_cached(pattern, ttl=None, backend=None):
+    """
+    Lists a remote wildcard pattern; the result is cached on disk (in the
+    file cache directory) for `ttl` seconds. A `ttl` of 0 always lists.
+    """
+    import hashlib
+    if ttl is None: ttl = LISTING_TTL
+    if backend is None: backend = file_cache().backend
+    cachefile = osp.join(
+        file_cache().cachedir, '.listings',
+        hashlib.sha1(pattern.encode()).hexdigest() + '.json'
+        )
+    if ttl > 0 and osp.isfile(cachefile) and time.time() - os.stat(cachefile).st_mtime < ttl:
+        with open(cachefile) as f:
+            return json.load(f)['paths']
+    paths = backend.ls_wildcard(pattern)
+    os.makedirs(osp.dirname(cachefile), exist_ok=True)
+    tmp = tmp_path(cachefile)
+    with open(tmp, 'w') as f:
+        json.dump(dict(pattern=pattern, paths=paths), f)
+    os.replace(tmp, cachefile)
+    return paths
+
+
+_FILE_CACHE = None
+
+def file_cache():
+    """
+    The FileCache used by Columns.load and open_root (see SVJ_CACHE_DIR, SVJ_CACHE_BYTES).
+    """
+    global _FILE_CACHE
+    if _FILE_CACHE is None: _FILE_CACHE = FileCache()
+    return _FILE_CACHE
+
+
+def cached(path):
+    """
+    Local path for `path`: remote paths are served from the file cache.
+    """
+    if '://' not in path: return path
+    return file_cache().get(path)
+
+
+def open_root(rootfile, *args, **kwargs):
+    """
+    svj.open_root, reading remote files through the file cache.
+    """
+    arrays = svj_ntuple_processing.open_root(cached(rootfile), *args, **kwargs)
+    arrays.metadata['src'] = rootfile
+    return arrays
+
+
+#__________________________________________________
+# Data pipeline
+
+# Column directories: one uncompressed .npy file per column + a json index
+COLUMNDIR_EXT = '.cols'
+COLUMNDIR_INDEX = 'columns.json'
+COLUMNDIR_VERSION = 1
+
+
+# Extra .npz entry with the number of events, see Columns.save
+NPZ_N_EVENTS = 'n_events'
+
+
+PARQUET_EXT = '.parquet'
+ARROW_METADATA_KEY = b'svj_metadata'
+ARROW_CUTFLOW_KEY = b'svj_cutflow'
+
+
+def is_columndir(path):
+    return osp.isfile(osp.join(path, COLUMNDIR_INDEX))
+
+
+class NumpyEncoder(json.JSONEncoder):
+    """
+    Standard JSON encoder, but turns numpy scalars and arrays into python types
+    """
+    def default(self, obj):
+        if isinstance(obj, np.generic):
+            return obj.item()
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, bytes):
+            return obj.decode()
+        return super().default(obj)
+
+
+def memoize_by_args(fn):
+    """
+    Caches the result of a function per (hashable) positional arguments.
+    """
+    cache = {}
+    def wrapper(*args):
+        if args not in cache: cache[args] = fn(*args)
+        return cache[args]
+    return wrapper
+
+
+def memoize_once(fn):
+    """
+    Wraps a function without arguments so that it is only called once.
+    """
+    result = []
+    def wrapper():
+        if not result: result.append(fn())
+        return result[0]
+    return wrapper
+
+
+def range_to_slice(r):
+    return slice(r.start, r.stop if r.stop >= 0 else None, r.step)
+
+
+def take_index(array, index):
+    """
+    Takes `index` (range or integer array) from the first axis of `array`.
+    A range is taken as a slice, so it returns a view.
+    """
+    if isinstance(index, range): return array[range_to_slice(index)]
+    return array[index]
+
+
+def compose_index(base, index):
+    """
+    Returns the index equivalent to taking `base` first and then `index`.
+    Both are ranges or integer arrays; the result is a range if both are.
+    """
+    if isinstance(base, range):
+        if isinstance(index, range): return base[range_to_slice(index)]
+        return base.start + base.step * index
+    return take_index(base, index)
+
+
+class ColumnArrays(MutableMapping):
+    """
+    Dict-like container for the arrays of a Columns instance.
+
+    Arrays can be registered as loaders, which are only called the first time
+    the array is requested. A pending loader returns a whole dict of arrays,
+    and is used when not even the array names are known before reading.
+
+    A ColumnArrays can be a view on a selection of the events of a parent
+    ColumnArrays; see `select`.
+
+    Keys assigned after construction are recorded in `modified`, since their
+    arrays may no longer be the ones stored in the sample.
+    """
+    def __init__(self, arrays=None):
+        self._data = {}
+        self._loaders = {}
+        self._pending = None
+        self._view = None
+        self._view_keys = set()
+        self.n_events = None
+        self.modified = set()
+        if arrays: self._data.update(arrays)
+
+    def set_loader(self, key, loader):
+        self._data[key] = None
+        self._loaders[key] = loader
+
+    def set_pending(self, loader):
+        self._pending = loader
+
+    def _resolve_pending(self):
+        if self._pending is None: return
+        loader, self._pending = self._pending, None
+        for key, array in loader().items():
+            if key not in self._data: self._data[key] = array
+
+    def __getitem__(self, key):
+        if key not in self._data: self._resolve_pending()
+        if key in self._loaders:
+            self._data[key] = self._loaders.pop(key)()
+        return self._data[key]
+
+    def __setitem__(self, key, array):
+        self._loaders.pop(key, None)
+        self._view_keys.discard(key)
+        self._data[key] = array
+        self.modified.add(key)
+
+    def __delitem__(self, key):
+        if key not in self._data: self._resolve_pending()
+        self._loaders.pop(key, None)
+        self._view_keys.discard(key)
+        del self._data[key]
+
+    def select(self, index, n_events):
+        """
+        Returns a view on the events in `index` (boolean mask, integer indices
+        or slice) of the `n_events` events in this container.
+
+        Nothing is copied here: an array is taken from the parent only when it
+        is first read. A slice gives numpy views; other selections gather
+        only the selected rows. Selecting on a view composes the indices, so
+        arrays are always taken straight from the unselected parent.
+        """
+        if isinstance(index, slice):
+            index = range(n_events)[index]
+        else:
+            index = np.asarray(index)
+            if index.dtype == bool:
+                if len(index) != n_events:
+                    raise ValueError(f'Mask of length {len(index)} for {n_events} events')
+                index = np.flatnonzero(index)
+        view = self.__class__()
+        if self._view is None:
+            root, base = self, range(n_events)
+        else:
+            root, base = self._view
+        composed = compose_index(base, index)
+        view._view = (root, composed)
+        view.n_events = len(composed)
+        view.modified = self.modified.copy()
+        for key in self:
+            if root is self or (key in self._view_keys and key in self._loaders):
+                # Array of the root container, not read through this view yet
+                view.set_loader(key, lambda key=key: take_index(root[key], composed))
+                view._view_keys.add(key)
+            else:
+                # Array that was set or resolved on this view itself
+                view.set_loader(key, lambda key=key: take_index(self[key], index))
+        return view
+
+    def __contains__(self, key):
+        if key not in self._data: self._resolve_pending()
+        return key in self._data
+
+    def __iter__(self):
+        self._resolve_pending()
+        return iter(list(self._data))
+
+    def __len__(self):
+        self._resolve_pending()
+        return len(self._data)
+
+    def loaded_keys(self):
+        """Keys of arrays that are already in memory (or memory-mapped)."""
+        return [k for k in self._data if k not in self._loaders]
+
+    def load_all(self):
+        for key in self: self[key]
+
+    def copy(self):
+        copy = self.__class__()
+        copy._data = self._data.copy()
+        copy._loaders = self._loaders.copy()
+        copy._pending = self._pending
+        copy._view = self._view
+        copy._view_keys = self._view_keys.copy()
+        copy.n_events = self.n_events
+        copy.modified = self.modified.copy()
+        return copy
+
+    def __repr__(self):
+        return f'<ColumnArrays {list(self._data)} loaded={self.loaded_keys()}>'
+
+
+class Columns(svj_ntuple_processing.Columns):
+    """
+    Data structure that contains all the training data (features)
+    and information about the sample.
+    
+    See: https://github.com/boostedsvj/svj_ntuple_processing/blob/main/svj_ntuple_processing/__init__.py#L357
+    """
+    @classmethod
+    def load(cls, path, *args, columns=None, lazy=False, split=None, **kwargs):
+        """
+        Loads a Columns instance from an .npz file, a column directory,
+        or a .parquet file (see `from_parquet`).
+
+        If `columns` is given, only those arrays are made available.
+        If `lazy` is True, only the metadata and cutflow are read right away;
+        arrays are read the first time they are requested.
+        With `split` ('train' or 'test'), returns a view on that part of the
+        sample, as stored by `make_split_index`.
+        """
+        if split is not None:
+            mask = load_split_mask(path, split)
+            inst = cls.load(path, *args, columns=columns, lazy=True, **kwargs)
+            if inst.arrays.n_events is None:
+                inst.arrays.n_events = len(mask)
+            elif inst.arrays.n_events != len(mask):
+                raise ValueError(
+                    f'Split index {split_index_path(path)} is for {len(mask)} events,'
+                    f' {path} has {inst.arrays.n_events}'
+                    )
+            inst = inst.select(mask)
+            if not lazy: inst.arrays.load_all()
+            return inst
+        if '://' in path:
+            # Remote file: read the local copy in the file cache
+            inst = cls.load(cached(path), *args, columns=columns, lazy=lazy, **kwargs)
+            inst.metadata['src'] = path
+            return inst
+        if is_columndir(path):
+            return cls.load_columndir(path, columns, lazy)
+        if path.endswith(PARQUET_EXT):
+            return cls.from_parquet(path, columns)
+        if columns is None and not lazy:
+            inst = super().load(path, *args, **kwargs)
+        else:
+            inst = cls.load_npz_lazy(path, columns)
+            if not lazy: inst.arrays.load_all()
+        # Transforming bytes keys to str keys
+        old_cf = inst.cutflow
+        inst.cutflow = OrderedDict()
+        for key in old_cf.keys():
+            if isinstance(key, bytes):
+                inst.cutflow[key.decode()] = old_cf[key]
+            else:
+                inst.cutflow[key] = old_cf[key]
+        return inst
+
+    @classmethod
+    def load_npz_lazy(cls, path, columns=None):
+        """
+        Reads only the metadata and cutflow of an .npz file.
+
+        All arrays are pickled together in one entry of the .npz file, so the
+        first access of any array unpickles that entry; arrays not listed in
+        `columns` are dropped immediately after.
+        """
+        with np.load(path, allow_pickle=True) as d:
+            metadata = d['metadata'].item()
+            if 'cutflow' in d.files:
+                cutflow = d['cutflow'].item()
+            else:
+                cutflow = OrderedDict(zip(d['cutflow_keys'], d['cutflow_vals']))
+            # Written by Columns.save; files from the plain svj Columns lack it
+            n_events = int(d[NPZ_N_EVENTS]) if NPZ_N_EVENTS in d.files else None
+        inst = cls()
+        inst.metadata = metadata
+        inst.metadata['src'] = path
+        inst.cutflow = cutflow
+        inst.arrays.n_events = n_events
+
+        def read_arrays():
+            with np.load(path, allow_pickle=True) as d:
+                arrays = d['arrays'].item()
+            if columns is None: return arrays
+            return {k: arrays[k] for k in columns}
+
+        if columns is None:
+            inst.arrays.set_pending(read_arrays)
+        else:
+            read_arrays = memoize_once(read_arrays)
+            for key in columns:
+                inst.arrays.set_loader(key, lambda key=key: read_arrays()[key])
+        return inst
+
+    @classmethod
+    def load_columndir(cls, path, columns=None, lazy=False):
+        """
+        Loads a column directory (see `save_columndir`). Every column is
+        memory-mapped copy-on-write, so only the bytes that are actually
+        accessed are read from disk, and in-place edits never touch the file.
+        """
+        path = path.rstrip('/')
+        with open(osp.join(path, COLUMNDIR_INDEX)) as f:
+            index = json.load(f)
+        inst = cls()
+        inst.metadata = index['metadata']
+        inst.metadata['src'] = path
+        inst.cutflow = OrderedDict((k, v) for k, v in index['cutflow'])
+        inst.arrays.n_events = index['n_events']
+        if columns is None: columns = list(index['columns'].keys())
+        for key in columns:
+            if key not in index['columns']:
+                raise KeyError(f'Column {key} not available in {path}')
+            npy = osp.join(path, key + '.npy')
+            if index['columns'][key]['dtype'] == 'object':
+                load = lambda npy=npy: np.load(npy, allow_pickle=True)
+            else:
+                load = lambda npy=npy: np.load(npy, mmap_mode='c')
+            inst.arrays.set_loader(key, load)
+        if not lazy: inst.arrays.load_all()
+        return inst
+
+    @classmethod
+    def wrap(cls, cols):
+        """
+        Returns `cols` (any svj_ntuple_processing.Columns) as an instance of
+        this class, without copying the arrays.
+        """
+        if isinstance(cols, cls): return cols
+        inst = cls()
+        inst.metadata = cols.metadata
+        inst.cutflow = cols.cutflow
+        inst.arrays = cols.arrays
+        return inst
+
+    def select(self, mask):
+        """
+        Returns a new Columns with only the events in `mask` (boolean mask,
+        integer indices or slice).
+
+        The arrays are not copied: the returned instance is a view on this one
+        and takes a column from it only when the column is read. Chained
+        selections are composed into a single index on the original arrays.
+        """
+        inst = self.__class__()
+        inst.metadata = self.metadata.copy()
+        inst.cutflow = self.cutflow.copy()
+        inst.arrays = self.arrays.select(mask, len(self))
+        # Masks and increasing slices keep the events in order
+        keeps_order = (
+            isinstance(mask, slice) and (mask.step or 1) > 0
+            or np.asarray(mask).dtype == bool
+            )
+        if not keeps_order: inst.metadata.pop('sorted_by', None)
+        return inst
+
+    def iter_chunks(self, chunk_size=None):
+        """
+        Yields views (see `select`) on consecutive blocks of `chunk_size`
+        events, or this instance itself if chunk_size is None.
+
+        Memory use is bounded by the chunk size for column directories (the
+        arrays are memory-mapped and a view reads only its own rows); .npz
+        skims pickle all arrays together, so those are read whole.
+        """
+        if chunk_size is None:
+            yield self
+            return
+        for start in range(0, len(self), chunk_size):
+            yield self.select(slice(start, start+chunk_size))
+
+    def selection(self, name, persist=True, **params):
+        """
+        Returns the Bitmap of a named selection (see SELECTIONS), e.g.
+        cols.selection('cutbased') or cols.selection('mt_window', mt_low=180., mt_high=650.).
+
+        For a sample loaded from a local file, bitmaps are read from and saved
+        to its SelectionIndex, so the feature columns are only read the first
+        time a selection is used. Views, remote samples and `persist=False`
+        compute the bitmap without storing it.
+        """
+        src = self.metadata.get('src')
+        if not persist or self.arrays._view is not None or src is None or '://' in src:
+            return Bitmap.from_mask(selection_function(name)(self, **params))
+        if getattr(self, 'selection_index', None) is None:
+            self.selection_index = SelectionIndex(src)
+        bitmap = self.selection_index.get(self, name, **params)
+        if self.selection_index.dirty: self.selection_index.save()
+        return bitmap
+
+    def derived(self, name, persist=False, **params):
+        """
+        Returns derived column `name` (see DERIVED_COLUMNS), e.g.
+        cols.derived('bdtscore', model='model.json').
+
+        The column is computed once per instance and kept in self.arrays[name].
+        With `persist`, it is also stored next to a local sample, and reused by
+        later runs as long as its inputs and definition are unchanged.
+        """
+        spec = json.dumps(params, sort_keys=True, cls=NumpyEncoder)
+        specs = self.__dict__.setdefault('derived_specs', {})
+        if specs.get(name) == spec and name in self.arrays.loaded_keys():
+            return self.arrays[name]
+        column = DERIVED_COLUMNS[name]
+        array = column.compute(self, persist, **params)
+        self.arrays[name] = array
+        if not column.modified_inputs(self, **params):
+            # Computed from the arrays as stored, so as good as stored itself
+            self.arrays.modified.discard(name)
+        specs[name] = spec
+        return array
+
+    def add_derived(self, name, persist=False, **params):
+        """
+        Makes derived column `name` available as self.arrays[name], computed
+        (or read from disk) only when it is first accessed.
+        """
+        self.arrays.set_loader(name, lambda: self.derived(name, persist, **params))
+
+    def sort_by(self, key):
+        """
+        Returns a view with the events sorted by array `key`. The key is stored
+        as metadata['sorted_by'], so that window selections on it (see
+        `mt_wind`) become a contiguous slice.
+        """
+        inst = self.select(np.argsort(self.arrays[key], kind='stable'))
+        inst.metadata['sorted_by'] = key
+        return inst
+
+    @property
+    def arrays(self):
+        return self._arrays
+
+    @arrays.setter
+    def arrays(self, arrays):
+        self._arrays = arrays if isinstance(arrays, ColumnArrays) else ColumnArrays(arrays)
+
+    def __len__(self):
+        for key in self.arrays.loaded_keys():
+            return len(self.arrays[key])
+        if self.arrays.n_events is not None:
+            return self.arrays.n_events
+        return super().__len__()
+
+    def save(self, outfile, *args, sort_by=None, **kwargs):
+        """
+        Saves to .npz, to a column directory if `outfile` ends with .cols,
+        or to parquet if it ends with .parquet.
+        With `sort_by`, the events are written sorted by that array.
+        """
+        if sort_by is not None and self.metadata.get('sorted_by') != sort_by:
+            return self.sort_by(sort_by).save(outfile, *args, **kwargs)
+        if outfile.rstrip('/').endswith(COLUMNDIR_EXT):
+            self.save_columndir(outfile)
+        elif outfile.endswith(PARQUET_EXT):
+            self.to_parquet(outfile)
+        else:
+            # The .npz format pickles the arrays, so they need to be a plain dict
+            plain = svj_ntuple_processing.Columns()
+            plain.arrays = dict(self.arrays)
+            plain.metadata = self.metadata
+            plain.cutflow = self.cutflow
+            plain.save(outfile, *args, **kwargs)
+            if plain.arrays and osp.isfile(outfile):
+                # Extra entry so len() of a lazily loaded file needs no unpickling;
+                # the plain svj Columns.load ignores it
+                with zipfile.ZipFile(outfile, 'a') as zf, zf.open(NPZ_N_EVENTS + '.npy', 'w') as f:
+                    np.lib.format.write_array(f, np.asarray(len(plain)))
+
+    def save_columndir(self, outdir):
+        """
+        Saves as a directory with one uncompressed .npy file per column, plus
+        a small json index with the metadata, cutflow, and column dtypes/shapes.
+
+        The directory is written under a temporary name and moved into place
+        at the end, so readers never see a half-written sample.
+        """
+        outdir = osp.abspath(outdir.rstrip('/'))
+        tmpdir = tmp_path(outdir)
+        os.makedirs(tmpdir, exist_ok=True)
+        index = dict(
+            version = COLUMNDIR_VERSION,
+            n_events = len(self) or 0,
+            metadata = {k: v for k, v in self.metadata.items() if k!='src'},
+            cutflow = list(self.cutflow.items()),
+            columns = {},
+            )
+        for key, array in self.arrays.items():
+            array = np.asarray(array)
+            np.save(osp.join(tmpdir, key + '.npy'), array, allow_pickle=(array.dtype==object))
+            index['columns'][key] = dict(dtype=str(array.dtype), shape=list(array.shape))
+        with open(osp.join(tmpdir, COLUMNDIR_INDEX), 'w') as f:
+            json.dump(index, f, cls=NumpyEncoder)
+        if osp.isdir(outdir):
+            import shutil
+            shutil.rmtree(outdir)
+        os.rename(tmpdir, outdir)
+        logger.info(f'Saved {len(index["columns"])} columns to {outdir}')
+
+    def to_arrow(self):
+        """
+        Returns the arrays as a pyarrow.Table. Numeric columns are wrapped
+        without copying; 2D arrays (e.g. pdf_weights) become fixed size lists.
+        Metadata and cutflow are stored as json in the schema metadata.
+        """
+        import pyarrow as pa
+        names, columns = [], []
+        for key, array in self.arrays.items():
+            array = np.ascontiguousarray(array)
+            if array.ndim == 2:
+                column = pa.FixedSizeListArray.from_arrays(pa.array(array.ravel()), array.shape[1])
+            else:
+                column = pa.array(array)
+            names.append(key)
+            columns.append(column)
+        schema_metadata = {
+            ARROW_METADATA_KEY: json.dumps(
+                {k: v for k, v in self.metadata.items() if k!='src'}, cls=NumpyEncoder
+                ),
+            ARROW_CUTFLOW_KEY: json.dumps(list(self.cutflow.items()), cls=NumpyEncoder),
+            }
+        return pa.Table.from_arrays(columns, names=names, metadata=schema_metadata)
+
+    @classmethod
+    def from_arrow(cls, table, metadata=None):
+        """
+        Builds a Columns from a pyarrow.Table written by `to_arrow`. Columns
+        without nulls in a single chunk are converted without copying.
+        """
+        import pyarrow as pa
+        inst = cls()
+        schema_metadata = metadata or table.schema.metadata or {}
+        if ARROW_METADATA_KEY in schema_metadata:
+            inst.metadata = json.loads(schema_metadata[ARROW_METADATA_KEY])
+        if ARROW_CUTFLOW_KEY in schema_metadata:
+            inst.cutflow = OrderedDict((k, v) for k, v in json.loads(schema_metadata[ARROW_CUTFLOW_KEY]))
+        arrays = {}
+        for key, column in zip(table.column_names, table.columns):
+            column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+            if pa.types.is_fixed_size_list(column.type):
+                array = column.flatten().to_numpy(zero_copy_only=False).reshape(-1, column.type.list_size)
+            else:
+                array = column.to_numpy(zero_copy_only=False)
+            arrays[key] = array
+        inst.arrays = arrays
+        inst.arrays.n_events = table.num_rows
+        return inst
+
+    def to_parquet(self, outfile):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), outfile)
+        logger.info(f'Saved {len(self.arrays)} columns to {outfile}')
+
+    @classmethod
+    def from_parquet(cls, path, columns=None, filters=None):
+        """
+        Loads a .parquet file written by `to_parquet`, memory-mapped.
+        Only `columns` are read, and `filters` (pyarrow filter expression or
+        list of tuples, e.g. [('mt', '>', 180.)]) are pushed down to the reader.
+        Note that the cutflow still describes the unfiltered sample.
+        """
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+        inst = cls.from_arrow(table, pq.read_schema(path).metadata)
+        inst.metadata['src'] = path
+        return inst
+
+    def __repr__(self):
+        return (
+            '<Column '
+            + ' '.join([f'{k}={v}' for k, v in self.metadata.items() if k!='src'])
+            + '>'
+            )
+
+    @property
+    def key(self):
+        return (
+            osp.basename(self.metadata['src'].rstrip('/'))
+            .replace('.npz', '')
+            .replace(COLUMNDIR_EXT, '')
+            ).split('_TuneCP5_13TeV')[0].lower()
+
+    @property
+    def record(self):
+        if not hasattr(self, '_record'):
+            self._record = get_record(self.key)
+        return self._record
+
+    @property
+    def presel_eff(self):
+        if self.cutflow['raw']==0: return 0.
+        return self.cutflow['preselection'] / self.cutflow['raw']
+
+    @property
+    def xs(self):
+        if hasattr(self, 'manual_xs'):
+            # Only for setting a manual cross section
+            return self.manual_xs
+        elif 'bkg_type' in self.metadata:
+            return self.record.effxs
+        else:
+            return signal_xs(self.metadata['mz'])
+
+    @property
+    def effxs(self):
+        return self.xs * self.presel_eff
+
+    @property
+    def weight_per_event(self):
+        return self.effxs / len(self)
+
+
+def npz_to_columndir(npzfile, dst=None, sort_by=None):
+    """
+    Converts a Columns .npz file to the column directory format.
+    By default the directory is placed next to the .npz file.
+    With `sort_by` (e.g. 'mt'), events are stored sorted by that array.
+    Returns the path to the created directory.
+    """
+    if dst is None: dst = re.sub(r'\.npz$', '', npzfile) + COLUMNDIR_EXT
+    cols = Columns.load(npzfile)
+    cols.save(dst, sort_by=sort_by)
+    return dst
+
+
+def metadata_matches(c, key, value):
+    """
+    Checks whether c.metadata[key] equals value; numbers are compared as floats,
+    so e.g. mdark=10 matches '10.'.
+    """
+    if key not in c.metadata: return False
+    try:
+        return math.isclose(float(c.metadata[key]), float(value))
+    except (TypeError, ValueError):
+        return c.metadata[key] == value
+
+
+def apply_filters(cols, filters):
+    """
+    Applies filters to a list of Columns. A filter is either a dict of
+    required metadata values, or a function that takes and returns a list
+    of Columns. A single filter may be passed instead of a list.
+    """
+    if isinstance(filters, dict) or callable(filters): filters = [filters]
+    for f in filters:
+        if isinstance(f, dict):
+            cols = [c for c in cols if all(metadata_matches(c, k, v) for k, v in f.items())]
+        else:
+            cols = f(cols)
+    return cols
+
+
+def load_columns(patterns, filters=(), workers=8, **load_kwargs):
+    """
+    Loads many Columns at once.
+
+    `patterns` (a path or list of paths, may contain wildcards) are expanded
+    once and deduplicated. Then only metadata and cutflow are read, and
+    `filters` are applied before any arrays are read. A filter is either a dict
+    of required metadata values (e.g. dict(mdark=10., rinv=.3)), or a function
+    that takes and returns a list of Columns (e.g. lambda cols: filter_pt(cols, 300.)).
+    The remaining arrays are read concurrently by `workers` threads.
+
+    Extra keyword arguments (`columns`, `lazy`) are passed to Columns.load.
+    Results are sorted by path, so the order is deterministic.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    if isinstance(patterns, str): patterns = [patterns]
+    paths = sorted(set(
+        p if '://' in p else osp.abspath(p.rstrip('/'))
+        for p in expand_wildcards(patterns)
+        ))
+    lazy = load_kwargs.pop('lazy', False)
+    with ThreadPoolExecutor(workers) as pool:
+        cols = list(pool.map(lambda p: Columns.load(p, lazy=True, **load_kwargs), paths))
+
+    cols = apply_filters(cols, filters)
+
+    if not lazy:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda c: c.arrays.load_all(), cols))
+    logger.info(f'Loaded {len(cols)} of {len(paths)} samples matching {patterns}')
+    return cols
+
+
+def prefetch_columns(paths, prefetch=2, max_bytes=2<<30, **load_kwargs):
+    """
+    Iterates over (path, Columns) for `paths`, in order, while the next
+    `prefetch` samples are loaded by background threads. Reading and
+    decompressing the next samples thus overlaps with processing the current one.
+
+    No new samples are started while the samples that are loaded but not yet
+    consumed take more than `max_bytes` of memory.
+    Extra keyword arguments (`columns`, `lazy`) are passed to Columns.load.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from collections import deque
+    paths = iter(paths)
+    queue = deque()
+
+    def buffered_bytes():
+        return sum(
+            sum(c.arrays[k].nbytes for k in c.arrays.loaded_keys())
+            for c in (f.result() for _, f in queue if f.done() and not f.exception())
+            )
+
+    def fill(pool):
+        while len(queue) <= prefetch:
+            if queue and buffered_bytes() > max_bytes: return
+            path = next(paths, None)
+            if path is None: return
+            queue.append((path, pool.submit(Columns.load, path, **load_kwargs)))
+
+    with ThreadPoolExecutor(max(prefetch, 1)) as pool:
+        try:
+            fill(pool)
+            while queue:
+                path, future = queue.popleft()
+                cols = future.result()
+                fill(pool)
+                yield path, cols
+        finally:
+            for _, future in queue: future.cancel()
+
+
+#__________________________________________________
+# Parquet datasets
+
+PARTITION_KEYS = ('bkg_type', 'mz', 'mdark', 'rinv')
+HIVE_NULL = '__HIVE_DEFAULT_PARTITION__'
+
+
+def partition_values(cols, partition_by=PARTITION_KEYS):
+    """
+    Metadata values a sample is partitioned by. Signal samples have no
+    bkg_type in their metadata; they get bkg_type='signal'.
+    """
+    values = {}
+    for key in partition_by:
+        value = cols.metadata.get(key)
+        if key == 'bkg_type' and value is None and 'mz' in cols.metadata:
+            value = 'signal'
+        values[key] = value
+    return values
+
+
+def write_dataset(cols, outdir, partition_by=PARTITION_KEYS):
+    """
+    Writes samples as a hive-partitioned parquet dataset, one file per sample:
+    outdir/bkg_type=signal/mz=350.0/mdark=10.0/rinv=0.3/<sample>.parquet
+    Missing values (e.g. mz for backgrounds) are hive nulls.
+
+    Readable with `load_dataset`, or with any arrow tool, e.g.
+    pyarrow.dataset.dataset(outdir, partitioning='hive').
+    Returns the list of written files.
+    """
+    outfiles = []
+    for i, c in enumerate(cols):
+        subdir = osp.join(outdir, *(
+            f'{k}={HIVE_NULL if v is None else v}'
+            for k, v in partition_values(c, partition_by).items()
+            ))
+        os.makedirs(subdir, exist_ok=True)
+        src = c.metadata.get('src')
+        name = re.sub(r'(\.npz|\{}|\{})$'.format(COLUMNDIR_EXT, PARQUET_EXT), '', osp.basename(src.rstrip('/'))) if src else f'sample{i}'
+        outfile = osp.join(subdir, name + PARQUET_EXT)
+        c.to_parquet(outfile)
+        outfiles.append(outfile)
+    return outfiles
+
+
+def load_dataset(outdir, filter=None, columns=None, partition_by=PARTITION_KEYS):
+    """
+    Loads a dataset written by `write_dataset` as a list of Columns, one per
+    sample. `filter` is a pyarrow.dataset expression; it can select on the
+    partition keys (whole samples are skipped without being opened) and on
+    columns (pushed down to the parquet reader), e.g.
+    (pc.field('bkg_type') == 'qcd') & (pc.field('mt') > 180.)
+    Partition keys other than bkg_type are read as floats.
+    """
+    import pyarrow as pa, pyarrow.dataset as ds
+    partitioning = ds.partitioning(
+        pa.schema([(k, pa.string() if k=='bkg_type' else pa.float64()) for k in partition_by]),
+        flavor='hive'
+        )
+    dataset = ds.dataset(outdir, format='parquet', partitioning=partitioning)
+    cols = []
+    for fragment in dataset.get_fragments(filter=filter):
+        table = fragment.to_table(columns=columns, filter=filter, schema=dataset.schema)
+        table = table.drop_columns([k for k in dataset.partitioning.schema.names if k in table.column_names])
+        c = Columns.from_arrow(table, fragment.physical_schema.metadata)
+        c.metadata['src'] = fragment.path
+        cols.append(c)
+    return cols
+
+
+#__________________________________________________
+# Sample catalog
+
+CATALOG_FILE = 'catalog.json'
+CATALOG_VERSION = 1
+
+
+def sample_stat(path):
+    """
+    os.stat of a sample file; for a column directory, of its index, which is
+    rewritten with every save (unlike the directory, whose mtime also changes
+    when sidecars like selections.sel or derived/ are written).
+    """
+    return os.stat(osp.join(path, COLUMNDIR_INDEX) if is_columndir(path) else path)
+
+
+def content_hash(path):
+    """
+    sha1 of the file contents; for a column directory, of the index and the
+    column files it lists (sidecars inside the directory are not hashed).
+    """
+    import hashlib
+    sha1 = hashlib.sha1()
+    if is_columndir(path):
+        index = osp.join(path, COLUMNDIR_INDEX)
+        with open(index) as f:
+            keys = json.load(f)['columns'].keys()
+        files = [index] + [osp.join(path, key + '.npy') for key in keys]
+    else:
+        files = [path]
+    for file in files:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1<<20), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def catalog_entry(path):
+    """
+    Reads one sample and summarizes everything that metadata queries need.
+    """
+    cols = Columns.load(path)
+    mt = cols.arrays['mt'] if 'mt' in cols.arrays else np.zeros(0)
+    stat = sample_stat(path)
+    return dict(
+        metadata = {k: v for k, v in cols.metadata.items() if k!='src'},
+        cutflow = list(cols.cutflow.items()),
+        n_events = len(cols) or 0,
+        columns = {
+            k: dict(dtype=str(v.dtype), shape=list(v.shape))
+            for k, v in cols.arrays.items()
+            },
+        mt_min = float(mt.min()) if len(mt) else None,
+        mt_max = float(mt.max()) if len(mt) else None,
+        size = stat.st_size,
+        mtime = stat.st_mtime,
+        hash = content_hash(path),
+        )
+
+
+class Catalog:
+    """
+    Index of all samples in a data directory: per sample the metadata, cutflow,
+    number of events, column names/dtypes, mt range and a content hash.
+
+    Metadata-only work (filtering samples, cutflow tables, xs * presel_eff)
+    can be done from the catalog without opening any sample file.
+
+    Example:
+        >>> catalog = Catalog.build('data/bkg')  # Once
+        >>> catalog = Catalog.load('data/bkg')
+        >>> paths = catalog.query('Summer20UL18/QCD_*', dict(bkg_type='qcd'))
+        >>> cols = catalog.columns('Summer20UL18/*', lambda cols: filter_pt(cols, 300.))
+    """
+    def __init__(self, datadir, entries=None):
+        self.datadir = osp.abspath(datadir)
+        self.entries = {} if entries is None else entries
+
+    @classmethod
+    def load(cls, datadir):
+        with open(osp.join(datadir, CATALOG_FILE)) as f:
+            d = json.load(f)
+        if d['version'] != CATALOG_VERSION:
+            raise Exception(f'Catalog in {datadir} has version {d["version"]}, expected {CATALOG_VERSION}')
+        return cls(datadir, d['entries'])
+
+    @classmethod
+    def build(cls, datadir, workers=8):
+        """
+        Scans `datadir` recursively for samples and saves the catalog in it.
+        Entries of an existing catalog are reused if size and mtime did not change.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        try:
+            old = cls.load(datadir).entries
+        except (IOError, OSError):
+            old = {}
+        inst = cls(datadir)
+
+        paths = []
+        for dirpath, dirnames, files in os.walk(inst.datadir):
+            paths.extend(osp.join(dirpath, f) for f in files if f.endswith('.npz'))
+            for d in list(dirnames):
+                if d.endswith(COLUMNDIR_EXT):
+                    paths.append(osp.join(dirpath, d))
+                    dirnames.remove(d) # Do not descend into column directories
+
+        def entry(path):
+            relpath = osp.relpath(path, inst.datadir)
+            stat = sample_stat(path)
+            if relpath in old and (old[relpath]['size'], old[relpath]['mtime']) == (stat.st_size, stat.st_mtime):
+                return relpath, old[relpath]
+            logger.info(f'Cataloging {relpath}')
+            return relpath, catalog_entry(path)
+
+        with ThreadPoolExecutor(workers) as pool:
+            inst.entries = dict(sorted(pool.map(entry, paths)))
+        inst.save()
+        return inst
+
+    def save(self):
+        outfile = osp.join(self.datadir, CATALOG_FILE)
+        tmp = tmp_path(outfile)
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=CATALOG_VERSION, entries=self.entries), f, cls=NumpyEncoder)
+        os.replace(tmp, outfile)
+        logger.info(f'Saved catalog of {len(self.entries)} samples to {outfile}')
+
+    def columns(self, pattern='*', filters=()):
+        """
+        Returns Columns for all samples whose path (relative to the data directory)
+        matches `pattern` and that pass `filters` (see apply_filters).
+        Metadata, cutflow and len() come from the catalog; arrays are only
+        read from disk when accessed.
+        """
+        import fnmatch
+        cols = []
+        for relpath, entry in self.entries.items():
+            if not fnmatch.fnmatch(relpath, pattern): continue
+            path = osp.join(self.datadir, relpath)
+            c = Columns()
+            c.metadata = dict(entry['metadata'], src=path)
+            c.cutflow = OrderedDict((k, v) for k, v in entry['cutflow'])
+            c.arrays.n_events = entry['n_events']
+            c.arrays.set_pending(lambda path=path: Columns.load(path).arrays)
+            c.catalog_entry = entry
+            cols.append(c)
+        return apply_filters(cols, filters)
+
+    def query(self, pattern='*', filters=()):
+        """
+        Like `columns`, but only returns the paths.
+        """
+        return [c.metadata['src'] for c in self.columns(pattern, filters)]
+
+
+#__________________________________________________
+# Selection bitmaps
+
+SELECTIONS_EXT = '.sel' # Not .npz, so sample globs do not pick it up
+SELECTIONS_FILE = 'selections' + SELECTIONS_EXT
+
+
+def selection_mt_window(cols, mt_low=180., mt_high=650.):
+    window = mt_wind(cols, mt_high, mt_low)
+    if isinstance(window, slice):
+        mask = np.zeros(len(cols), dtype=bool)
+        mask[window] = True
+        return mask
+    return window
+
+def selection_ddt_window(cols):
+    return rhoddt_windowcuts(
+        cols.arrays['mt'], cols.arrays['pt'], cols.arrays['rho'],
+        mt_sorted=cols.metadata.get('sorted_by')=='mt'
+        )
+
+# name -> names of the function returning the boolean mask, and of the
+# functions it depends on (all are part of the selection definition)
+SELECTIONS = {
+    'cutbased' : ('mask_cutbased',),
+    'mt_window' : ('selection_mt_window', 'mt_wind', 'mt_slice'),
+    'ddt_window' : ('selection_ddt_window', 'rhoddt_windowcuts', 'mt_slice'),
+    }
+
+def selection_function(name):
+    return globals()[SELECTIONS[name][0]]
+
+
+def selection_key(name, **params):
+    """
+    Hash of the definition of a selection: its name, parameters and the source
+    code of the functions computing it. Changing a cut value gives a new key.
+    """
+    import inspect, hashlib
+    code = [inspect.getsource(globals()[f]) for f in SELECTIONS[name]]
+    definition = json.dumps([name, params, code], sort_keys=True, cls=NumpyEncoder)
+    return name + '_' + hashlib.sha1(definition.encode()).hexdigest()[:16]
+
+
+class Bitmap:
+    """
+    Boolean event mask stored as packed bits (np.packbits), 8x smaller than a
+    boolean array. Combine with &, | and ~; count() is a popcount.
+    """
+    def __init__(self, bits, n):
+        self.bits = bits
+        self.n = n
+
+    @classmethod
+    def from_mask(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask), len(mask))
+
+    def mask(self):
+        return np.unpackbits(self.bits, count=self.n).astype(bool)
+
+    def count(self):
+        if hasattr(np, 'bitwise_count'):
+            return int(np.bitwise_count(self.bits).sum())
+        return int(np.count_nonzero(np.unpackbits(self.bits)))
+
+    def __len__(self):
+        return self.n
+
+    def _check(self, other):
+        if self.n != other.n:
+            raise ValueError(f'Bitmaps of different lengths: {self.n} and {other.n}')
+
+    def __and__(self, other):
+        self._check(other)
+        return self.__class__(self.bits & other.bits, self.n)
+
+    def __or__(self, other):
+        self._check(other)
+        return self.__class__(self.bits | other.bits, self.n)
+
+    def __invert__(self):
+        bits = ~self.bits
+        if self.n % 8: bits[-1] &= (0xFF << (8 - self.n % 8)) & 0xFF
+        return self.__class__(bits, self.n)
+
+    def __repr__(self):
+        return f'<Bitmap {self.count()}/{self.n}>'
+
+
+def sample_stamp(path):
+    """
+    Size and modification time of a sample, used to detect that it changed.
+    """
+    stat = sample_stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SelectionIndex:
+    """
+    Bitmaps of named selections of one sample, persisted in a sidecar file:
+    <sample>.sel next to an .npz, or selections.sel inside a column directory.
+    Bitmaps are keyed by `selection_key`, and all of them are dropped when
+    the sample file changes.
+    """
+    def __init__(self, sample_path):
+        sample_path = sample_path.rstrip('/')
+        self.sample_path = sample_path
+        if is_columndir(sample_path):
+            self.path = osp.join(sample_path, SELECTIONS_FILE)
+        else:
+            self.path = re.sub(r'\.npz$', '', sample_path) + SELECTIONS_EXT
+        self.stamp = sample_stamp(sample_path)
+        self.n_events = None
+        self.bitmaps = {}
+        self.dirty = False
+        self.writable = True
+        if osp.isfile(self.path):
+            with np.load(self.path) as d:
+                if d['stamp'].tolist() == self.stamp:
+                    self.n_events = int(d['n_events'])
+                    for key in d.files:
+                        if key in ('stamp', 'n_events'): continue
+                        self.bitmaps[key] = Bitmap(d[key], self.n_events)
+
+    def get(self, cols, name, **params):
+        """
+        Returns the Bitmap of selection `name` on `cols`, computing and
+        storing it if it is not in the index yet.
+        """
+        key = selection_key(name, **params)
+        if key not in self.bitmaps:
+            if self.n_events is not None and self.n_events != len(cols):
+                raise ValueError(f'{self.path} is for {self.n_events} events, sample has {len(cols)}')
+            self.bitmaps[key] = Bitmap.from_mask(selection_function(name)(cols, **params))
+            self.n_events = len(cols)
+            self.dirty = True
+        return self.bitmaps[key]
+
+    def save(self):
+        """
+        Writes the index to its sidecar file. If that fails (e.g. a read-only
+        sample area), the bitmaps are kept in memory only, and later saves of
+        this index are skipped.
+        """
+        if not self.writable: return
+        tmp = tmp_path(self.path)
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(
+                    f, stamp=np.array(self.stamp), n_events=self.n_events,
+                    **{k: b.bits for k, b in self.bitmaps.items()}
+                    )
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f'Could not save selection index {self.path}, keeping it in memory: {e}')
+            self.writable = False
+            if osp.isfile(tmp): os.remove(tmp)
+            return
+        self.dirty = False
+
+
+#__________________________________________________
+# Virtual train/test split
+
+SPLIT_EXT = '.split' # Not .npz, so sample globs do not pick it up
+SPLIT_FILE = 'train_test' + SPLIT_EXT
+
+
+def split_index_path(path):
+    path = path.rstrip('/')
+    if is_columndir(path): return osp.join(path, SPLIT_FILE)
+    return re.sub(r'\.npz$', '', path) + SPLIT_EXT
+
+
+def make_split_index(path, train_fraction=.9, seed=1001, key=None):
+    """
+    Stores a train/test split of a sample as a packed train mask next to it,
+    instead of writing copies of the data. The random stream is seeded per
+    sample, by `seed` and `key` (default: `path`), so files can be split in
+    any order or in parallel with reproducible results. Pass the path
+    relative to the data directory as `key` to get the same split wherever
+    the data directory lives.
+    """
+    import zlib
+    cols = Columns.load(path, lazy=True)
+    n = len(cols)
+    if key is None: key = path
+    rng = np.random.default_rng([seed, zlib.crc32(key.rstrip('/').encode())])
+    train = np.zeros(n, dtype=bool)
+    train[rng.choice(n, math.ceil(train_fraction*n), replace=False)] = True
+    outfile = split_index_path(path)
+    tmp = tmp_path(outfile)
+    with open(tmp, 'wb') as f:
+        np.savez(
+            f, train=Bitmap.from_mask(train).bits, n_events=n,
+            train_fraction=train_fraction, seed=seed, stamp=np.array(sample_stamp(path.rstrip('/')))
+            )
+    os.replace(tmp, outfile)
+    return outfile
+
+
+def load_split_mask(path, split):
+    """
+    Returns the boolean mask of `split` ('train' or 'test') for a sample,
+    from the index written by `make_split_index`. Raises a ValueError if the
+    sample changed since the index was written.
+    """
+    if split not in ('train', 'test'):
+        raise ValueError(f'split should be "train" or "test", not {split}')
+    index = split_index_path(path)
+    with np.load(index) as d:
+        stamp = d['stamp'].tolist() if 'stamp' in d.files else None
+        train = Bitmap(d['train'], int(d['n_events']))
+    if stamp != sample_stamp(path.rstrip('/')):
+        raise ValueError(
+            f'Split index {index} does not match {path}, which changed after'
+            f' the index was made; rerun make_split_index'
+            )
+    return (train if split == 'train' else ~train).mask()
+
+
+#__________________________________________________
+# Derived columns
+
+DERIVED_DIR_EXT = '.derived'
+DERIVED_DIR = 'derived'
+
+DERIVED_COLUMNS = {}
+
+
+class DerivedColumn:
+    """
+    A named column computed from other columns of the same sample.
+
+    `fn(cols, **params)` computes the column for the whole sample at once.
+    `inputs` is the list of columns it reads, or a function of the params
+    returning that list. `metadata` lists the metadata keys it reads.
+    Bump `version` whenever `fn` changes, to invalidate stored copies.
+    """
+    def __init__(self, name, fn, inputs, version=1, metadata=()):
+        self.name = name
+        self.fn = fn
+        self.inputs = inputs
+        self.version = version
+        self.metadata = metadata
+
+    def input_columns(self, **params):
+        return self.inputs(**params) if callable(self.inputs) else list(self.inputs)
+
+    def modified_inputs(self, cols, **params):
+        """Inputs that were assigned on `cols` after loading (see ColumnArrays)"""
+        return [k for k in self.input_columns(**params) if k in cols.arrays.modified]
+
+    def key(self, cols, **params):
+        """
+        Key of a stored copy, computed without reading any arrays:
+        '<hash of version, params and metadata values>-<hash of the sample stamp>'.
+        Parameters that are paths to existing files (e.g. a model) are
+        hashed by their contents. The inputs are taken to be the columns as
+        stored in the sample; `compute` checks that they were not modified.
+        """
+        import hashlib
+        hashed_params = {
+            k: content_hash(v) if isinstance(v, str) and osp.isfile(v) else v
+            for k, v in params.items()
+            }
+        params_key = hashlib.sha1(json.dumps(
+            [self.name, self.version, hashed_params, [cols.metadata.get(k) for k in self.metadata]],
+            sort_keys=True, cls=NumpyEncoder
+            ).encode()).hexdigest()[:16]
+        sample_key = hashlib.sha1(json.dumps(sample_stamp(cols.metadata['src'])).encode()).hexdigest()[:16]
+        return f'{params_key}-{sample_key}'
+
+    def compute(self, cols, persist=False, **params):
+        """
+        Returns the column, computed from `cols`. With `persist`, it is read
+        from the sidecar of the sample if it is there and still valid, and
+        otherwise stored there after computing. Inputs that were assigned
+        on `cols` after loading turn persisting off.
+
+        Stored copies are named <name>-<key>.npy, so the array and its key are
+        written in one atomic step, and copies for different params live
+        side by side. If the sample directory is not writable, the column is
+        just computed.
+        """
+        src = cols.metadata.get('src')
+        if not persist or cols.arrays._view is not None or src is None or '://' in src:
+            return self.fn(cols, **params)
+        modified = self.modified_inputs(cols, **params)
+        if modified:
+            logger.info(f'Not persisting derived column {self.name}: inputs {modified} were modified')
+            return self.fn(cols, **params)
+        outdir = derived_dir(src)
+        key = self.key(cols, **params)
+        npy = osp.join(outdir, f'{self.name}-{key}.npy')
+        if osp.isfile(npy):
+            return np.load(npy, mmap_mode='c')
+        array = self.fn(cols, **params)
+        try:
+            os.makedirs(outdir, exist_ok=True)
+            tmp = tmp_path(npy) + '.npy'
+            np.save(tmp, array)
+            os.replace(tmp, npy)
+            # Drop copies with the same params for an older version of the sample
+            params_key = key.split('-')[0]
+            for old in glob.glob(osp.join(outdir, f'{self.name}-{params_key}-*.npy')):
+                if old != npy: os.remove(old)
+        except OSError as e:
+            logger.warning(f'Could not store derived column {self.name} in {outdir}: {e}')
+            return array
+        logger.info(f'Stored derived column {self.name} in {outdir}')
+        return array
+
+
+def derived_column(name, inputs, version=1, metadata=()):
+    """
+    Decorator registering a function as a derived column; see DerivedColumn.
+    """
+    def decorator(fn):
+        DERIVED_COLUMNS[name] = DerivedColumn(name, fn, inputs, version, metadata)
+        return fn
+    return decorator
+
+
+def derived_dir(src):
+    """
+    Where derived columns of a sample are stored: <sample>.derived/ next to an
+    .npz file, or derived/ inside a column directory.
+    """
+    src = src.rstrip('/')
+    if is_columndir(src): return osp.join(src, DERIVED_DIR)
+    return re.sub(r'\.npz$', '', src) + DERIVED_DIR_EXT
+
+
+@memoize_by_args
+def xgboost_model(model_file):
+    import xgboost as xgb
+    model = xgb.XGBClassifier()
+    model.load_model(model_file)
+    return model
+
+
+@derived_column('bdtscore', inputs=lambda model: read_training_features(model))
+def derived_bdtscore(cols, model):
+    """BDT score of an xgboost model (.json file)"""
+    X = cols.to_numpy(read_training_features(model))
+    return xgboost_model(model).predict_proba(X)[:,1]
+
+
+@derived_column('pdf_envelope', inputs=['pdf_weights'], metadata=['pdfw_norm_up', 'pdfw_norm_down'])
+def derived_pdf_envelope(cols):
+    """Normalized up and down PDF weights (mean +/- std over the PDF set), shape (n, 2)"""
+    pdf_weights = cols.arrays['pdf_weights']
+    pdf_weights = pdf_weights / pdf_weights[:,:1] # Divide by first pdf
+    mu_pdf = np.mean(pdf_weights, axis=1)
+    sigma_pdf = np.std(pdf_weights, axis=1)
+    return np.column_stack((
+        (mu_pdf+sigma_pdf) / cols.metadata['pdfw_norm_up'],
+        (mu_pdf-sigma_pdf) / cols.metadata['pdfw_norm_down'],
+        ))
+
+
+#__________________________________________________
+# Quantized features
+
+class QuantileCuts:
+    """
+    Per-feature bin edges at global weighted quantiles, to store features as
+    uint8 bin codes (at most 255 bins per feature; code 255 marks NaN).
+
+    Code k means edges[k] <= x < edges[k+1]. Decoding maps code k back to
+    edges[k], so a tree trained on decoded values has its thresholds exactly
+    on bin edges, and gives the same decisions on the raw float features.
+    NaNs decode to NaN again, so xgboost still treats them as missing.
+    Edges and comparisons are in float32, like xgboost.
+    """
+    MISSING = 255
+
+    def __init__(self, features, edges):
+        self.features = list(features)
+        self.edges = [np.asarray(e, dtype=np.float32) for e in edges]
+
+    @classmethod
+    def compute(cls, cols, features, weights=None, n_bins=255):
+        """
+        Computes the edges from a list of Columns. `weights` is an optional
+        list with one per-event weight array per sample. NaNs are ignored.
+        """
+        if n_bins > cls.MISSING: raise ValueError(f'At most {cls.MISSING} bins fit in uint8 codes')
+        edges = []
+        for feature in features:
+            x = np.concatenate([c.arrays[feature] for c in cols])
+            w = np.concatenate(weights) if weights is not None else np.ones(len(x))
+            valid = ~np.isnan(x)
+            x, w = x[valid], w[valid]
+            if not len(x):
+                edges.append(np.zeros(1, dtype=np.float32))
+                continue
+            order = np.argsort(x, kind='stable')
+            x, cdf = x[order], np.cumsum(w[order])
+            cdf /= cdf[-1]
+            levels = np.arange(1, n_bins) / n_bins
+            cuts = x[np.minimum(np.searchsorted(cdf, levels, side='right'), len(x)-1)]
+            edges.append(np.unique(np.concatenate(([x[0]], cuts)).astype(np.float32)))
+        return cls(features, edges)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            d = json.load(f)
+        return cls(d['features'], d['edges'])
+
+    def save(self, path):
+        if osp.dirname(path): os.makedirs(osp.dirname(path), exist_ok=True)
+        tmp = tmp_path(path)
+        with open(tmp, 'w') as f:
+            json.dump(dict(features=self.features, edges=self.edges), f, cls=NumpyEncoder)
+        os.replace(tmp, path)
+        logger.info(f'Saved quantile cuts for {len(self.features)} features to {path}')
+
+    @property
+    def n_bins(self):
+        return max(len(e) for e in self.edges)
+
+    def quantize(self, X):
+        """Float matrix (n, n_features) -> uint8 bin codes"""
+        codes = np.empty(X.shape, dtype=np.uint8)
+        for j, edges in enumerate(self.edges):
+            x = X[:,j].astype(np.float32)
+            codes[:,j] = np.searchsorted(edges[1:], x, side='right')
+            codes[np.isnan(x), j] = self.MISSING
+        return codes
+
+    def decode(self, codes):
+        """uint8 bin codes -> float32 lower bin edges (NaN for missing)"""
+        X = np.empty(codes.shape, dtype=np.float32)
+        for j, edges in enumerate(self.edges):
+            table = np.full(256, np.nan, dtype=np.float32)
+            table[:len(edges)] = edges
+            X[:,j] = table[codes[:,j]]
+        return X
+
+    def reference_dmatrix(self):
+        """
+        Small xgboost QuantileDMatrix whose histogram cuts are these edges,
+        one bin per code; pass it as `ref` to bin data without re-sketching.
+        """
+        import xgboost as xgb
+        n = self.n_bins
+        X = np.column_stack([np.pad(edges, (0, n - len(edges)), mode='edge') for edges in self.edges])
+        return xgb.QuantileDMatrix(X, max_bin=n)
+
+
+@memoize_by_args
+def load_quantile_cuts(path):
+    return QuantileCuts.load(path)
+
+
+@derived_column('quantized', inputs=lambda cuts: load_quantile_cuts(cuts).features, version=2)
+def derived_quantized(cols, cuts):
+    """Features of a QuantileCuts file as uint8 bin codes, shape (n, n_features)"""
+    cuts = load_quantile_cuts(cuts)
+    return cuts.quantize(cols.to_numpy(cuts.features))
+
+
+def quantile_dmatrix(codes, y, weight, cuts, chunk_size=1<<20):
+    """
+    Builds an xgboost QuantileDMatrix from uint8 `codes` (see QuantileCuts).
+    The histogram cuts are taken from `cuts` (see QuantileCuts.reference_dmatrix),
+    so xgboost does not sketch the data again. The codes are decoded chunk
+    by chunk, so no full float matrix is made.
+    """
+    import xgboost as xgb
+
+    class CodesIter(xgb.DataIter):
+        def __init__(self):
+            self.i = 0
+            super().__init__()
+
+        def next(self, input_data):
+            if self.i >= len(codes): return False
+            sl = slice(self.i, self.i + chunk_size)
+            input_data(data=cuts.decode(codes[sl]), label=y[sl], weight=weight[sl])
+            self.i += chunk_size
+            return True
+
+        def reset(self):
+            self.i = 0
+
+    return xgb.QuantileDMatrix(CodesIter(), ref=cuts.reference_dmatrix(), max_bin=cuts.n_bins)
+
+
+def xgb_train_args(parameters):
+    """
+    Translates XGBClassifier constructor arguments into the params and the
+    num_boost_round of xgb.train, with the same binary:logistic objective.
+    """
+    renames = dict(learning_rate='eta', reg_alpha='alpha', reg_lambda='lambda', random_state='seed', n_jobs='nthread')
+    sklearn_only = ['use_label_encoder', 'missing', 'importance_type', 'enable_categorical', 'early_stopping_rounds', 'callbacks']
+    params = dict(objective='binary:logistic')
+    for key, value in parameters.items():
+        if key == 'n_estimators' or key in sklearn_only or value is None: continue
+        params[renames.get(key, key)] = value
+    return params, parameters.get('n_estimators', 100)
+
+
+#__________________________________________________
+# Sharing Columns between processes
+
+def _open_shared_memory(name):
+    from multiprocessing import shared_memory
+    try:
+        # Only the publishing process should track (and eventually unlink) the block
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python<3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedColumns:
+    """
+    Picklable handle to a Columns instance whose arrays are stored in
+    multiprocessing.shared_memory blocks.
+
+    The publishing process creates it with `SharedColumns.publish(cols)` and
+    must call `unlink()` when all workers are done (or use the `shared_columns`
+    context manager). Workers get a Columns with zero-copy views on the
+    shared blocks with `attach()`, and should call `detach(cols)` when done.
+
+    Example:
+        >>> def worker(handle):
+        >>>     cols = handle.attach()
+        >>>     hist = np.histogram(cols.arrays['mt'], MT_BINS)[0]
+        >>>     handle.detach(cols)
+        >>>     return hist
+        >>> with shared_columns(bkg_cols) as handles:
+        >>>     with mp.Pool(8) as pool:
+        >>>         hists = pool.map(worker, handles)
+    """
+    def __init__(self, metadata, cutflow, specs):
+        self.metadata = metadata
+        self.cutflow = cutflow
+        self.specs = specs # key -> (block name, dtype, shape)
+        self._blocks = []
+
+    @classmethod
+    def publish(cls, cols):
+        from multiprocessing import shared_memory
+        inst = cls(cols.metadata.copy(), cols.cutflow.copy(), {})
+        try:
+            for key, array in cols.arrays.items():
+                array = np.asarray(array)
+                if array.dtype == object:
+                    raise TypeError(f'Cannot share column {key} with dtype object')
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                inst._blocks.append(shm)
+                np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+                inst.specs[key] = (shm.name, array.dtype.str, array.shape)
+        except Exception:
+            inst.unlink()
+            raise
+        return inst
+
+    def __getstate__(self):
+        # Block objects stay with the publishing process
+        return dict(metadata=self.metadata, cutflow=self.cutflow, specs=self.specs, _blocks=[])
+
+    def attach(self):
+        cols = Columns()
+        cols.metadata = self.metadata.copy()
+        cols.cutflow = self.cutflow.copy()
+        cols._shared_blocks = []
+        for key, (name, dtype, shape) in self.specs.items():
+            shm = _open_shared_memory(name)
+            cols._shared_blocks.append(shm)
+            cols.arrays[key] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        return cols
+
+    @staticmethod
+    def detach(cols):
+        """
+        Drops the views of an attached Columns and closes its blocks. Fails with
+        a BufferError if other references to the shared arrays still exist.
+        """
+        cols.arrays = {}
+        for shm in getattr(cols, '_shared_blocks', []):
+            shm.close()
+        cols._shared_blocks = []
+
+    def unlink(self):
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+
+@contextmanager
+def shared_columns(cols):
+    """
+    Publishes a list of Columns to shared memory, and yields the list of
+    SharedColumns handles. Blocks are unlinked when the context exits.
+    """
+    handles = []
+    try:
+        for c in cols:
+            handles.append(SharedColumns.publish(c))
+        yield handles
+    finally:
+        for handle in handles:
+            handle.unlink()
+
+
+#__________________________________________________
+# Multi-sample containers
+
+
+
+class SampleCollection:
+    """
+    Stores the requested columns of many Columns as contiguous arrays, plus the
+    offsets of every sample (segment) in those arrays and per-sample metadata.
+
+    Allows scoring/histogramming all samples in one vectorized call instead of
+    one call per sample.
+
+    Example:
+        >>> bkg = SampleCollection(bkg_cols, ['mt'] + features)
+        >>> bkg.arrays['score'] = model.predict_proba(bkg.to_numpy(features))[:,1]
+        >>> w = bkg.per_event(bkg.xs * bkg.presel_eff / bkg.lengths)
+        >>> hists = bkg.group_histogram('mt', MT_BINS, weights=w, mask=bkg.arrays['score']>.5)
+    """
+    def __init__(self, cols, keys):
+        self.keys = list(keys)
+        self.lengths = np.array([len(c) for c in cols], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+        # Keep only metadata and cutflow of the samples, not their arrays
+        self.samples = []
+        for c in cols:
+            sample = Columns()
+            sample.metadata = c.metadata
+            sample.cutflow = c.cutflow
+            if hasattr(c, 'manual_xs'): sample.manual_xs = c.manual_xs
+            self.samples.append(sample)
+
+        self.arrays = {}
+        for key in self.keys:
+            if not cols:
+                self.arrays[key] = np.zeros(0)
+                continue
+            first = np.asarray(cols[0].arrays[key])
+            self.arrays[key] = np.empty((len(self),) + first.shape[1:], dtype=first.dtype)
+            for c, left, right in zip(cols, self.offsets[:-1], self.offsets[1:]):
+                self.arrays[key][left:right] = c.arrays[key]
+        self._segment_ids = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    @property
+    def n_samples(self):
+        return len(self.lengths)
+
+    @property
+    def segment_ids(self):
+        """Sample index of every event"""
+        if self._segment_ids is None:
+            self._segment_ids = np.repeat(np.arange(self.n_samples), self.lengths)
+        return self._segment_ids
+
+    def sample_arrays(self, i):
+        """Views on the arrays of sample i"""
+        left, right = self.offsets[i], self.offsets[i+1]
+        return {k: v[left:right] for k, v in self.arrays.items()}
+
+    def metadata_array(self, key, default=None):
+        return np.array([s.metadata.get(key, default) for s in self.samples])
+
+    @property
+    def bkg_type(self):
+        return self.metadata_array('bkg_type', 'signal')
+
+    @property
+    def xs(self):
+        return np.array([s.xs for s in self.samples])
+
+    @property
+    def presel_eff(self):
+        return np.array([s.presel_eff for s in self.samples])
+
+    def per_event(self, values):
+        """Broadcasts one value per sample to all events of that sample"""
+        return np.repeat(values, self.lengths)
+
+    def to_numpy(self, keys):
+        return np.column_stack([self.arrays[k] for k in keys])
+
+    def segment_sum(self, values):
+        """Sum of per-event values per sample"""
+        return np.bincount(self.segment_ids, weights=values, minlength=self.n_samples)
+
+    def histogram(self, key, bins, weights=None, mask=None):
+        """
+        Histograms `key` for every sample at once. Returns an array of shape
+        (n_samples, n_bins), filled with a single bincount over (sample, bin).
+        """
+        nbins = len(bins) - 1
+        idx = bin_index(self.arrays[key], bins)
+        select = idx >= 0
+        if mask is not None: select &= mask
+        flat_idx = self.segment_ids[select] * nbins + idx[select]
+        w = None if weights is None else weights[select]
+        return (
+            np.bincount(flat_idx, weights=w, minlength=self.n_samples*nbins)
+            .astype(float)
+            .reshape(self.n_samples, nbins)
+            )
+
+    def group_histogram(self, key, bins, by='bkg_type', weights=None, mask=None):
+        """
+        Like `histogram`, but summed per group of samples with the same value for
+        the metadata key `by`. Returns a dict group -> histogram values.
+        """
+        per_sample = self.histogram(key, bins, weights, mask)
+        groups = self.bkg_type if by=='bkg_type' else self.metadata_array(by)
+        return {g: per_sample[groups==g].sum(axis=0) for g in dict.fromkeys(groups.tolist())}
+
+
+def sample_rngs(n, seed=None):
+    """
+    Returns `n` independent random generators, one per sample, spawned from
+    `seed`. Without a seed, the seed is drawn from the global (seeded) numpy
+    random state, so scripts calling np.random.seed stay reproducible.
+    """
+    if seed is None: seed = np.random.randint(2**32)
+    return [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(n)]
+
+
+def importance_sample(weights, fraction, rng):
+    """
+    Keeps each event with probability p = min(1, |w|/cap), with the cap
+    chosen such that on average `fraction` of the events is kept. Events with
+    large weights are always kept, events with tiny weights mostly dropped.
+
+    Returns the indices of the kept events and the factor to multiply their
+    weights with (1/p, rescaled so that the weight sum of the sample is
+    exactly preserved).
+    """
+    abs_w = np.abs(weights)
+    n_keep = fraction * len(weights)
+    if n_keep >= np.count_nonzero(abs_w):
+        select = np.flatnonzero(abs_w)
+        return select, np.ones(len(select))
+    # sum(min(1, |w|/cap)) decreases with cap; bisect it to n_keep
+    low, high = 0., abs_w.max() * len(weights) / n_keep
+    for _ in range(100):
+        cap = .5 * (low + high)
+        if np.minimum(1., abs_w/cap).sum() > n_keep:
+            low = cap
+        else:
+            high = cap
+    p = np.minimum(1., abs_w/high)
+    select = np.flatnonzero(rng.random(len(weights)) < p)
+    factor = 1. / p[select]
+    kept_sum = np.sum(weights[select] * factor)
+    if kept_sum != 0.: factor *= np.sum(weights) / kept_sum
+    return select, factor
+
+
+def columns_to_numpy(
+    signal_cols, bkg_cols, features,
+    downsample=.4, weight_key='weight',
+    mt_high=650, mt_low=180, dtype=np.float64, quantile_cuts=None,
+    sampling='uniform', seed=None
+    ):
+    """
+    Takes a list of signal and background Column instances, and outputs
+    a numpy array with `features` as the columns.
+
+    Works in two passes: the first pass determines which rows of every sample
+    are kept (mt window and downsampling), the second pass fills one
+    preallocated X/y/weight buffer column by column. No intermediate copies
+    of the full feature matrix are made. Use `dtype=np.float32` to halve the
+    memory of X.
+
+    With `quantile_cuts` (path to a QuantileCuts file for `features`), X holds
+    the uint8 bin codes instead, read from each sample's stored 'quantized'
+    derived column. Feed it to xgboost with `quantile_dmatrix`.
+
+    Bkg is downsampled to a fraction `downsample` of the events per sample.
+    With `sampling='uniform'` every event has the same chance to be kept, and
+    the total bkg weight shrinks by the same fraction. With
+    `sampling='importance'` events are kept with a probability that grows
+    with their weight (see `importance_sample`), and the kept events are
+    reweighted such that the weight sum of every sample is preserved; this
+    allows a much smaller `downsample` at the same effective statistics.
+    Every sample draws from its own random stream seeded by `seed`.
+    """
+    if sampling not in ['uniform', 'importance']:
+        raise ValueError(f'Unknown sampling {sampling}; choose uniform or importance')
+    logger.info(f'Downsampling bkg ({sampling}), keeping fraction of {downsample}')
+
+    # First pass: row indices (and weight factors) to keep per sample
+    bkg_rows, bkg_factors = [], []
+    rngs = sample_rngs(len(bkg_cols), seed) if seed is not None or sampling == 'importance' else None
+    for i_sample, cols in enumerate(bkg_cols):
+        rows = mask_to_rows(mt_wind(cols, mt_high, mt_low))
+        factor = None
+        if downsample < 1.:
+            if sampling == 'importance':
+                select, factor = importance_sample(
+                    cols.arrays[weight_key][rows], downsample, rngs[i_sample]
+                    )
+            else:
+                choice = rngs[i_sample].choice if rngs else np.random.choice
+                select = choice(n_rows(rows), int(downsample*n_rows(rows)), replace=False)
+            rows = rows.start + select if isinstance(rows, slice) else rows[select]
+        bkg_rows.append(rows)
+        bkg_factors.append(factor)
+    signal_rows = [mask_to_rows(mt_wind(cols, mt_high, mt_low)) for cols in signal_cols]
+
+    n_bkg = sum(n_rows(rows) for rows in bkg_rows)
+    n_total = n_bkg + sum(n_rows(rows) for rows in signal_rows)
+    if quantile_cuts is not None:
+        if load_quantile_cuts(quantile_cuts).features != list(features):
+            raise ValueError(f'{quantile_cuts} is not for features {features}')
+        dtype = np.uint8
+    X = np.empty((n_total, len(features)), dtype=dtype)
+    y = np.zeros(n_total)
+    weight = np.empty(n_total)
+    y[n_bkg:] = 1.
+
+    # Second pass: fill the buffers in place
+    i = 0
+    factors = bkg_factors + [None]*len(signal_cols)
+    samples = zip(bkg_cols + signal_cols, bkg_rows + signal_rows, factors)
+    for i_sample, (cols, rows, factor) in enumerate(samples):
+        n = n_rows(rows)
+        if n == 0: continue
+        if quantile_cuts is not None:
+            X[i:i+n] = cols.derived('quantized', True, cuts=quantile_cuts)[rows]
+        else:
+            for j, feature in enumerate(features):
+                X[i:i+n, j] = cols.arrays[feature][rows]
+        if i_sample < len(bkg_cols):
+            weight[i:i+n] = cols.arrays[weight_key][rows]
+            if factor is not None: weight[i:i+n] *= factor
+        else:
+            # All signal model parameter variations should get equal weight,
+            # but some signal samples have more events.
+            # Use 1/n_events as a weight per event.
+            weight[i:i+n] = 1./n
+        i += n
+
+    # Set total signal weight equal to total bkg weight
+    weight[n_bkg:] *= np.sum(weight[:n_bkg]) / np.sum(weight[n_bkg:])
+    return X, y, weight
+
+
+def add_key_value_to_json(json_file, key, value):
+    with open(json_file, 'r') as f:
+        json_str = f.read()
+    json_str = json_str.rstrip()
+    json_str = json_str[:-1] # Strip off the last }
+    json_str += f',"{key}":{json.dumps(value)}}}'
+    with open(json_file, 'w') as f:
+        f.write(json_str)
+    logger.info(f'Added "{key}":{json.dumps(value)} to {json_file}')
+
+
+def add_manual_weight_column(signal_cols, bkg_cols):
+    """
+    Adds the manual weight calculation as a column
+    """
+    total_bkg_weight = 0
+    for c in bkg_cols:
+        c.arrays['manualweight'] = np.ones(len(c)) * c.weight_per_event
+        total_bkg_weight += c.arrays['manualweight'].sum()
+
+    # Set signal weights scaled relatively to one another (but not yet w.r.t. bkg)
+    total_signal_weight = 0
+    for c in signal_cols:
+        c.arrays['manualweight'] = np.ones(len(c)) / len(c)
+        total_signal_weight += c.arrays['manualweight'].sum()
+    
+    # Scale signal weights correctly w.r.t. bkg
+    for c in signal_cols:
+        c.arrays['manualweight'] *= total_bkg_weight / total_signal_weight
+
+
+def read_training_features(model_file):
+    """
+    Reads the features used to train a model from a .json file.
+    Only works for xgboost-trained models.
+    """
+    with open(model_file, 'rb') as f:
+        model = json.load(f)
+        return model['features']
+
+def rhoddt_windowcuts(mt, pt, rho, mt_sorted=False):
+    """
+    If `mt_sorted`, the mt window is found by binary search and the other
+    cuts are only evaluated inside it.
+    """
+    if mt_sorted:
+        window = mt_slice(mt, 200, 1000)
+        cuts = np.zeros(len(mt), dtype=bool)
+        pt, rho = pt[window], rho[window]
+        cuts[window] = (pt>110) & (pt<1500) & (rho>-4) & (rho<0)
+        return cuts
     cuts = (mt>200) & (mt<1000) & (pt>110) & (pt<1500) & (rho>-4) & (rho<0)
     return cuts
 
@@ -0,0 +1,88 @@
+import os, os.path as osp
+
+import common
+
+scripter = common.Scripter()
+
+
+@scripter
+def columndir():
+    """
+    Converts .npz skims to the memory-mappable column directory format.
+    Directories passed on the command line are searched recursively.
+    Use `--sort-by mt` to store events sorted by mt, so that mt windows
+    are selected with a binary search instead of a full pass.
+    """
+    paths = common.pull_arg('paths', type=str, nargs='+').paths
+    outdir = common.pull_arg('-o', '--outdir', type=str).outdir
+    sort_by = common.pull_arg('--sort-by', type=str).sort_by
+
+    npzfiles = []
+    for path in paths:
+        if osp.isdir(path):
+            for dirpath, _, files in os.walk(path):
+                npzfiles.extend((osp.join(dirpath, f), path) for f in files if f.endswith('.npz'))
+        else:
+            npzfiles.append((path, osp.dirname(path)))
+
+    for npz, root in npzfiles:
+        dst = None
+        if outdir:
+            dst = osp.join(outdir, osp.relpath(npz, root)).replace('.npz', common.COLUMNDIR_EXT)
+        dst = common.npz_to_columndir(npz, dst, sort_by)
+        common.logger.info(f'Converted {npz} -> {dst}')
+
+
+@scripter
+def xsindex():
+    """
+    Builds the pre-parsed cross section index. Copy the output file along with
+    batch jobs and point SVJ_XS_INDEX to it to run fully offline (SVJ_OFFLINE=1).
+    """
+    outfile = common.pull_arg('-o', '--outfile', type=str, default=common.XS_INDEX_FILE).outfile
+    common.build_xs_index(outfile)
+
+
+@scripter
+def catalog():
+    """
+    Builds (or updates) the sample catalog of one or more data directories.
+    """
+    datadirs = common.pull_arg('datadirs', type=str, nargs='+').datadirs
+    for datadir in datadirs:
+        common.Catalog.build(datadir)
+
+
+@scripter
+def selections():
+    """
+    Precomputes the bitmap index of the standard selections (cutbased,
+    ddt_window, and the training mt window) for samples.
+    """
+    paths = common.pull_arg('paths', type=str, nargs='+').paths
+    mt_low = common.pull_arg('--mtlow', type=float, default=180.).mtlow
+    mt_high = common.pull_arg('--mthigh', type=float, default=650.).mthigh
+    for path in paths:
+        cols = common.Columns.load(path, lazy=True)
+        counts = {
+            'cutbased' : cols.selection('cutbased').count(),
+            'mt_window' : cols.selection('mt_window', mt_low=mt_low, mt_high=mt_high).count(),
+            }
+        if all(k in cols.arrays for k in ['pt', 'rho']):
+            counts['ddt_window'] = cols.selection('ddt_window').count()
+        common.logger.info(f'{path}: {len(cols)} events, {counts}')
+
+
+@scripter
+def parquet():
+    """
+    Writes samples as a parquet dataset partitioned by bkg_type and signal
+    parameters, for use in notebooks and other arrow-based tools.
+    """
+    patterns = common.pull_arg('patterns', type=str, nargs='+').patterns
+    outdir = common.pull_arg('-o', '--outdir', type=str, default='dataset').outdir
+    common.write_dataset(common.load_columns(patterns), outdir)
+
+
+if __name__ == '__main__':
+    scripter.run()
@@ -3,7 +3,7 @@ from collections import OrderedDict
 
 import numpy as np
 
-from common import Columns, columns_to_numpy, DATADIR, filter_pt, set_mpl_fontsize, imgcat
+from common import Columns, columns_to_numpy, DATADIR, filter_pt, set_mpl_fontsize, imgcat, logger, Catalog, CATALOG_FILE
 
 
 def format_val(s, ndec=2):
@@ -100,12 +100,23 @@ def make_table(cols, combined=True):
 #bkg_DATADIR = '/home/snabili/hadoop/BKG/Ultra_Legacy/HADD_BKGBDT/Summer20UL18'
 sig_DATADIR = '/home/snabili/hadoop/HADD_puweight'
 bkg_DATADIR = '/home/snabili/hadoop/HADD_puweight/bkg/Summer20UL18'
+def load_lazy(datadir, pattern):
+    """
+    Uses the sample catalog in datadir if there is one (see `python convert.py catalog`),
+    otherwise reads only the metadata and cutflow of every file.
+    """
+    if osp.isfile(osp.join(datadir, CATALOG_FILE)):
+        logger.info(f'Using catalog in {datadir}')
+        return Catalog.load(datadir).columns(pattern)
+    return [Columns.load(f, lazy=True) for f in glob.glob(osp.join(datadir, pattern))]
+
+
 def collect_columns():
     #signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/signal_notruthcone/*.npz')]
-    signal_cols = [Columns.load(f) for f in glob.glob(sig_DATADIR+'/signal_notruth/*mdark10_rinv0.3.npz')]
+    signal_cols = load_lazy(sig_DATADIR, 'signal_notruth/*mdark10_rinv0.3.npz')
     signal_cols.sort(key=lambda s: (s.metadata['mz'], s.metadata['rinv']))
 
-    bkg_cols = [Columns.load(f) for f in glob.glob(bkg_DATADIR+'/*.npz')]
+    bkg_cols = load_lazy(bkg_DATADIR, '*.npz')
     bkg_cols = filter_pt(bkg_cols, 170.)
     bkg_cols = [c for c in bkg_cols if not(c.metadata['bkg_type']=='wjets' and 'htbin' not in c.metadata)]
 
@@ -1,41 +1,155 @@
-import os, os.path as osp
-import seutils
+import os, os.path as osp, json, threading, time
+from concurrent.futures import ThreadPoolExecutor
 
+import common
 from common import logger
 
 
 DATADIR = osp.join(osp.dirname(osp.abspath(__file__)), 'data')
+MANIFEST_FILE = 'download_manifest.json'
 
 
-def copy(tup):
-    src, dirname = tup
-    logger.info('Copying %s -> %s', src, DATADIR)
-    seutils.cp(src, DATADIR, recursive=True, parallel=4)
-    wrong_named_dir = osp.join(DATADIR, osp.basename(src))
-    correct_named_dir = osp.join(DATADIR, dirname)
-    logger.info('Renaming %s -> %s', wrong_named_dir, correct_named_dir)
-    os.rename(wrong_named_dir, correct_named_dir)
+def get_backend(src):
+    """
+    Remote storage (anything with a protocol) goes through seutils,
+    plain paths (e.g. a mounted hadoop directory) are copied locally.
+    """
+    return common.SEBackend() if '://' in src else common.LocalBackend()
 
 
-def main():
-    if not osp.isdir(DATADIR): os.makedirs(DATADIR)
+class Manifest:
+    """
+    List of all files to download, with their expected size and checksum,
+    and which of them are complete. While downloading it is saved at most
+    every `save_interval` seconds (and once more at the end), so an
+    interrupted download resumes close to where it stopped.
+    """
+    def __init__(self, path, files=None, save_interval=30.):
+        self.path = path
+        self.files = files or {}
+        self.save_interval = save_interval
+        self.last_save = 0.
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        if not osp.isfile(path): return cls(path)
+        with open(path) as f:
+            return cls(path, json.load(f)['files'])
+
+    def save(self):
+        with self.lock:
+            tmp = common.tmp_path(self.path)
+            with open(tmp, 'w') as f:
+                json.dump(dict(files=self.files), f, indent=1)
+            os.replace(tmp, self.path)
+            self.last_save = time.time()
+
+    def add(self, dst, src, size, mtime):
+        """
+        Adds a file; a file that changed remotely since it was listed is reset.
+        """
+        entry = self.files.get(dst)
+        if entry and (entry['src'], entry['size'], entry['mtime']) == (src, size, mtime):
+            return
+        self.files[dst] = dict(src=src, size=size, mtime=mtime, checksum=None, done=False)
+
+    def set_done(self, dst, checksum):
+        with self.lock:
+            self.files[dst]['done'] = True
+            self.files[dst]['checksum'] = checksum
+        if time.time() - self.last_save > self.save_interval: self.save()
+
+
+def is_complete(entry, local):
+    return entry['done'] and osp.isfile(local) and os.stat(local).st_size == entry['size']
+
+
+def download_file(dst, entry, datadir, backend):
+    """
+    Copies one file to a temporary name, verifies its size (and its adler32
+    checksum, if the backend provides one), and moves it into place.
+    Returns the checksum.
+    """
+    local = osp.join(datadir, dst)
+    os.makedirs(osp.dirname(local), exist_ok=True)
+    tmp = common.tmp_path(local, hidden=True)
+    try:
+        backend.copy(entry['src'], tmp)
+        size = os.stat(tmp).st_size
+        if size != entry['size']:
+            raise IOError(f'{entry["src"]}: expected {entry["size"]} bytes, got {size}')
+        checksum = common.adler32(tmp)
+        expected = backend.checksum(entry['src'])
+        if expected is not None and expected != checksum:
+            raise IOError(f'{entry["src"]}: checksum {checksum} does not match {expected}')
+        os.replace(tmp, local)
+    finally:
+        if osp.isfile(tmp): os.remove(tmp)
+    return checksum
 
+
+def download(sources, datadir=DATADIR, workers=8, backend=None):
+    """
+    Downloads directories to `datadir`. `sources` is a list of
+    (source directory, destination directory name) tuples.
+
+    All files are listed first and recorded in a manifest in `datadir`.
+    They are then copied by `workers` threads. Files already complete are
+    skipped, so rerunning after an interruption only copies what is missing.
+    Manifest entries of sources not passed in this run are left alone.
+    Returns the list of files that failed.
+    """
+    os.makedirs(datadir, exist_ok=True)
+    manifest = Manifest.load(osp.join(datadir, MANIFEST_FILE))
+    backends = {}
+    for src, dirname in sources:
+        backends[dirname] = get_backend(src) if backend is None else backend
+        files = backends[dirname].walk(src)
+        logger.info(f'{src}: {len(files)} files, {sum(f[1] for f in files)/1e9:.2f} GB')
+        for path, size, mtime in files:
+            dst = osp.join(dirname, osp.relpath(path, src))
+            manifest.add(dst, path, size, mtime)
+    manifest.save()
+
+    files = {dst: entry for dst, entry in manifest.files.items() if dst.split(os.sep)[0] in backends}
+    todo = [(dst, entry) for dst, entry in files.items() if not is_complete(entry, osp.join(datadir, dst))]
+    logger.info(f'{len(files)-len(todo)} files already complete, {len(todo)} to download')
+
+    failed = []
+    def work(item):
+        dst, entry = item
+        try:
+            checksum = download_file(dst, entry, datadir, backends[dst.split(os.sep)[0]])
+        except Exception as e:
+            logger.error(f'Failed to download {entry["src"]}: {e}')
+            failed.append(dst)
+            return
+        manifest.set_done(dst, checksum)
+        logger.info(f'Downloaded {entry["src"]} -> {dst}')
+
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(work, todo))
+    finally:
+        manifest.save()
+    if failed:
+        logger.error(f'{len(failed)} files failed; rerun to retry them')
+    return failed
+
+
+def main():
     base_dir = '/home/snabili/hadoop/HADD_puweight/'
     signal_dir = base_dir + 'signal_truth'
     bkg_dir = base_dir + 'bkg'
     #signal_dir_notruthcone = base_dir + '/signal_apr27_notruthcone'
 
-    fn_args = [
+    sources = [
         (signal_dir, 'signal_truth'),
         #(signal_dir_notruthcone, 'signal_notruthcone'),
         (bkg_dir, 'bkg'),
         ]
-
-    import multiprocessing as mp
-    p = mp.Pool(3)
-    p.map(copy, fn_args)
-    p.close()
-    p.join()
+    download(sources)
 
 
 
@@ -8,7 +8,7 @@ from sklearn.metrics import confusion_matrix, roc_curve, roc_auc_score, auc
 
 np.random.seed(1001)
 
-from common import logger, DATADIR, Columns, time_and_log, imgcat, set_matplotlib_fontsizes, columns_to_numpy
+from common import logger, DATADIR, Columns, time_and_log, imgcat, set_matplotlib_fontsizes, columns_to_numpy, load_columns
 
 
 training_features = [
@@ -22,11 +22,13 @@ all_features = training_features + ['mt']
 
 def main():
     set_matplotlib_fontsizes(18, 22, 26)
-    qcd_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/test_bkg/Summer20UL18/QCD_*.npz')]
-    qcd_cols = list(filter(lambda c: c.metadata['ptbin'][0]>=300., qcd_cols))
-    ttjets_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/test_bkg/Summer20UL18/TTJets_*.npz')]
+    qcd_cols = load_columns(
+        DATADIR+'/test_bkg/Summer20UL18/QCD_*.npz',
+        filters=lambda cols: [c for c in cols if c.metadata['ptbin'][0]>=300.]
+        )
+    ttjets_cols = load_columns(DATADIR+'/test_bkg/Summer20UL18/TTJets_*.npz')
     bkg_cols = qcd_cols + ttjets_cols
-    signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/test_signal/*.npz')]
+    signal_cols = load_columns(DATADIR+'/test_signal/*.npz')
 
     # models = {
     #     'ref_mz250_rinv0p1' : 'models/svjbdt_Nov22_reweight_mt_ref_mz250_rinv0p1.json',
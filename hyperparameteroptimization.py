@@ -4,6 +4,8 @@ import multiprocessing as mp
 
 from common import logger
 
+QUANTILE_CUTS = 'models/quantile_cuts_training_features.json'
+
 
 def worker(tup):
     variations, lpc_node_nr = tup
@@ -23,6 +25,7 @@ def worker(tup):
             f'python training.py xgboost'
             f' --reweight rho --ref data/train_signal/madpt300_mz250_mdark10_rinv0.3.npz'
             f' --node {lpc_node_nr} --tag {tag}'
+            f' --quantize {QUANTILE_CUTS}' # Bins computed once, shared by all runs
             #f' --tag {tag}'
             f' --lr {learning_rate}'
             f' --minchildweight {min_child_weight}'
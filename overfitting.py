@@ -5,7 +5,7 @@ import numpy as np
 import xgboost as xgb
 import matplotlib.pyplot as plt
 
-from common import logger, DATADIR, filter_pt, filter_ht, Columns, time_and_log, columns_to_numpy, read_training_features, set_matplotlib_fontsizes, imgcat
+from common import logger, DATADIR, filter_pt, filter_ht, Columns, time_and_log, columns_to_numpy, read_training_features, set_matplotlib_fontsizes, imgcat, load_columns
 from training import reweight
 
 
@@ -24,20 +24,6 @@ def main():
     # __________________________________________________________
     # Load data
     DATADIR='allrinv_inclmetdphi_mz350rinv0p1ref/data'
-    train_signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/train_signal/*.npz')]
-    test_signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/test_signal/*.npz')]
-
-    train_bkg_cols = [
-        Columns.load(f) for f in
-        glob.glob(DATADIR+'/train_bkg/Summer20UL18/QCD_*.npz')
-        + glob.glob(DATADIR+'/train_bkg/Summer20UL18/TTJets_*.npz')
-        ]
-    test_bkg_cols = [
-        Columns.load(f) for f in
-        glob.glob(DATADIR+'/test_bkg/Summer20UL18/QCD_*.npz')
-        + glob.glob(DATADIR+'/test_bkg/Summer20UL18/TTJets_*.npz')
-        ]
-
     def filter_bkg(bkg_cols):
         bkg_cols = filter_pt(bkg_cols, 300.)
         bkg_cols = filter_ht(bkg_cols, 400., 'wjets')
@@ -45,8 +31,16 @@ def main():
         bkg_cols = [c for c in bkg_cols if not(c.metadata['bkg_type']=='wjets' and 'htbin' not in c.metadata)]
         return bkg_cols
 
-    train_bkg_cols = filter_bkg(train_bkg_cols)
-    test_bkg_cols = filter_bkg(test_bkg_cols)
+    train_signal_cols = load_columns(DATADIR+'/train_signal/*.npz')
+    test_signal_cols = load_columns(DATADIR+'/test_signal/*.npz')
+    train_bkg_cols = load_columns(
+        [DATADIR+'/train_bkg/Summer20UL18/QCD_*.npz', DATADIR+'/train_bkg/Summer20UL18/TTJets_*.npz'],
+        filters=filter_bkg
+        )
+    test_bkg_cols = load_columns(
+        [DATADIR+'/test_bkg/Summer20UL18/QCD_*.npz', DATADIR+'/test_bkg/Summer20UL18/TTJets_*.npz'],
+        filters=filter_bkg
+        )
 
     if args.debug:
         # Use very small portion of data for debugging
@@ -4,7 +4,7 @@ import os, os.path as osp, json, argparse
 import matplotlib.pyplot as plt
 import numpy as np
 
-from common import logger
+from common import logger, load_histograms
 
 
 def main():
@@ -12,21 +12,18 @@ def main():
     parser.add_argument('jsonfile', type=str)
     args = parser.parse_args()
 
-    plotdir = 'plots_' + args.jsonfile.replace('.json','')
+    plotdir = 'plots_' + osp.splitext(args.jsonfile)[0]
     if not osp.isdir(plotdir): os.makedirs(plotdir)
 
-    with open(args.jsonfile, 'r') as f:
-        d = json.load(f)
-
-    d = d['histograms']
+    d = load_histograms(args.jsonfile)['histograms']
 
     fig = plt.figure(figsize=(8,8))
     ax = fig.gca()
 
     for bdtcut, histograms in d.items():
         for name, hist in histograms.items():
-            ax.step(hist['binning'][:-1], hist['vals'], where='pre')
-            is_bkg = 'mz' not in hist['metadata']
+            ax.step(hist.binning[:-1], hist.vals, where='pre')
+            is_bkg = 'mz' not in hist.metadata
             outfile = osp.join(plotdir, f'bdt{bdtcut}_{"bkg" if is_bkg else "sig"}_{name}.png')
             ax.set_title(f'bdt{bdtcut}_{name}')
             logger.info(f'Saving to {outfile}')
@@ -8,7 +8,7 @@ import common
 from common import (
     logger, DATADIR, filter_pt, filter_ht, Columns, time_and_log,
     columns_to_numpy, read_training_features, Scripter, mask_cutbased,
-    Histogram, MTHistogram
+    Histogram, MTHistogram, HistogramSet, load_columns
     )
 
 scripter = Scripter()
@@ -23,7 +23,9 @@ def repr_dict(d, depth=0):
         if isinstance(val, np.ndarray):
             print(f'WARNING: {key} is type ndarray! {val=}')
         s.append(depth*'  ' + repr(key))
-        if hasattr(val, 'items') and len(val):
+        if isinstance(val, Histogram):
+            s[-1] += f' (histogram; norm={val.norm:.4f})'
+        elif hasattr(val, 'items') and len(val):
             if val.get('type', '') == 'Histogram':
                 s[-1] += f' (histogram; norm={sum(val["vals"]):.4f})'
             else:
@@ -34,6 +36,13 @@ def repr_dict(d, depth=0):
 def filter_bad_bkgs(bkgs):
     # Filter empty backgrounds
     bkgs = [c for c in bkgs if len(c)]
+    return filter_bad_bkg_bins(bkgs)
+
+
+def filter_bad_bkg_bins(bkgs):
+    """
+    Part of filter_bad_bkgs that only needs metadata
+    """
     # Filter out QCD with pT<300
     # Only singular events pass the preselection, which creates spikes in the final bkg dist
     bkgs = filter_pt(bkgs, 300.)
@@ -50,13 +59,13 @@ def cutbased():
     mt_axis = common.MT_BINS
     lumi = common.pull_arg('--lumi', type=float, default=137.2).lumi
     systfile = common.pull_arg('-s', '--systfile', type=str).systfile
-    outfile = common.pull_arg('-o', '--outfile', type=str, default=strftime('histograms_cutbased_%Y%m%d.json')).outfile
+    outfile = common.pull_arg('-o', '--outfile', type=str, default=strftime('histograms_cutbased_%Y%m%d'+common.HISTOGRAMS_EXT)).outfile
     lumi *= 1e3 # Convert to nb-1 for easier multiplication with xs (which is in nb)
     npzfiles = common.pull_arg('npzfiles', nargs='+', type=str).npzfiles
 
     signals = [] ; bkgs = []
-    for c in (Columns.load(f) for f in npzfiles):
-        c.mask = mask_cutbased(c)
+    for _, c in common.prefetch_columns(npzfiles, columns=['mt', 'rt', 'ecfm2b1']):
+        c.mask = c.selection('cutbased').mask() # Stored bitmap after the first run
         if 'mz' in c.metadata:
             signals.append(c)
         else:
@@ -69,27 +78,21 @@ def cutbased():
     out['mt'] = list(mt_axis)
 
     out['histograms'] = {}
-    out['histograms']['0.000'] = {
-        'qcd' : Histogram(mt_axis),
-        'ttjets' : Histogram(mt_axis),
-        'wjets' : Histogram(mt_axis),
-        'zjets' : Histogram(mt_axis)
-        }
+    bkg_hists = HistogramSet(mt_axis, ['qcd', 'ttjets', 'wjets', 'zjets'])
 
     # Backgrounds
     for c in bkgs:
         mt = c.arrays['mt']
         mt_dist = np.histogram(mt[c.mask], mt_axis)[0] / len(mt)
         mt_dist *= c.xs * c.presel_eff * lumi
-        out['histograms']['0.000'][c.metadata['bkg_type']] += mt_dist
-    out['histograms']['0.000']['bkg'] = sum(out['histograms']['0.000'].values())
+        bkg_hists.add(c.metadata['bkg_type'], mt_dist)
+    bkg_hists['bkg'] = bkg_hists.sum()
     # Convert to json
-    out['histograms']['0.000'] = {k: h.json() for k, h in out['histograms']['0.000'].items()}
+    out['histograms']['0.000'] = {k: h.json() for k, h in bkg_hists.to_histograms().items()}
 
     if systfile:
         common.logger.info(f'Loading systematics from {systfile}')
-        with open(systfile, 'r') as f:
-            systs = json.load(f)
+        systs = common.load_histograms(systfile)
 
     # Signals
     for c in signals:
@@ -103,18 +106,17 @@ def cutbased():
         if systfile:
             # Histograms don't have the correct normalization yet
             # Normalize them to the current signal
-            central_norm = np.array(systs['central']['vals']).sum()
+            central_norm = systs['central'].norm
             for name, hist in systs.items():
                 if name in ['central', 'selection']: continue
-                hist = Histogram.from_dict(hist)
+                hist = hist.copy()
                 hist.vals *= histogram.norm / central_norm
                 hist.metadata.update(histogram.metadata)
                 hist.metadata['systname'] = name
                 out['histograms']['0.000'][f'SYST_{key}_{name}'] = hist.json()                
 
     logger.info(f'Dumping the following dict tree to {outfile}:\n{repr_dict(out)}')
-    with open(outfile, 'w') as f:
-        json.dump(out, f, indent=4)
+    common.dump_histograms(out, outfile)
 
 
 @scripter
@@ -123,24 +125,16 @@ def bdt():
     parser.add_argument('model', help='.json file to the trained model')
     parser.add_argument('-d', '--debug', action='store_true', help='Uses only small part of data set for testing')
     parser.add_argument('--lumi', type=float, default=137.2, help='Luminosity (in fb-1)')
-    parser.add_argument('-o', '--outfile', type=str, default=strftime('histograms_%b%d.json'), help='Output file for the histograms')
+    parser.add_argument('-o', '--outfile', type=str, default=strftime('histograms_%b%d'+common.HISTOGRAMS_EXT), help='Output file for the histograms (.json for the JSON format)')
+    parser.add_argument('--persist', action='store_true', help='Store the BDT scores next to the samples, and reuse stored ones')
     args = parser.parse_args()
     lumi = args.lumi * 1e3 # Convert to nb-1 for easier multiplication with xs (which is in nb)
 
-    model = xgb.XGBClassifier()
-    model.load_model(args.model)
-
-    training_features = read_training_features(args.model)
     DATADIR = '/home/snabili/hadoop/BKG/Ultra_Legacy/HADD_BKGCutbase'
     #signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/signal_notruthcone/*.npz')]
-    signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/signal_notruth/*.npz')]
-    bkg_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/bkg/Summer20UL18/*.npz')]
+    signal_cols = load_columns(DATADIR+'/signal_notruth/*.npz', lazy=True)
+    bkg_cols = load_columns(DATADIR+'/bkg/Summer20UL18/*.npz', filters=filter_bad_bkg_bins, lazy=True)
     bkg_cols = [c for c in bkg_cols if len(c)] # Filter empty backgrounds
-    bkg_cols = filter_pt(bkg_cols, 300.)
-    bkg_cols = filter_ht(bkg_cols, 400., 'wjets')
-    # Filter out wjets inclusive bin - it's practically the HT<100 bin,
-    # and it's giving problems
-    bkg_cols = [c for c in bkg_cols if not(c.metadata['bkg_type']=='wjets' and 'htbin' not in c.metadata)]
 
     if args.debug:
         signal_cols = signal_cols[:2]
@@ -149,13 +143,23 @@ def bdt():
     n_bins = 100
     mt_axis = np.linspace(100., 1000., n_bins+1)
     
+    # With --persist, BDT scores are stored next to the samples, so only the first run scores
+    for c in bkg_cols + signal_cols:
+        if not len(c):
+            c.arrays['bdtscore'] = np.zeros(0) # Nothing to score
+            continue
+        c.add_derived('bdtscore', args.persist, model=args.model)
+
+    # All samples in contiguous arrays, so histogramming is a single call
     with time_and_log(f'Scoring all backgrounds and signals'):
-        for c in bkg_cols:
-            if not len(c): continue
-            c.arrays['bdtscore'] = model.predict_proba(c.to_numpy(training_features))[:,1]
-        for c in signal_cols:
-            if not len(c): continue
-            c.arrays['bdtscore'] = model.predict_proba(c.to_numpy(training_features))[:,1]
+        bkg = common.SampleCollection(bkg_cols, ['mt', 'bdtscore'])
+        signal = common.SampleCollection(signal_cols, ['mt', 'bdtscore'])
+    del bkg_cols, signal_cols
+
+    # Take BDT eff and fraction inside bins into account in one go;
+    # empty samples have no events to weight, so only avoid dividing by 0
+    bkg_weight = bkg.per_event(bkg.xs * bkg.presel_eff * lumi / np.maximum(bkg.lengths, 1))
+    signal_weight = signal.per_event(signal.xs * signal.presel_eff * lumi / np.maximum(signal.lengths, 1))
 
     out = {}
     out['version'] = 2
@@ -165,50 +169,34 @@ def bdt():
 
     for bdtcut in .1*np.arange(10):
         logger.info(f'bdtcut={bdtcut}')
-        mt_dist_per_bkg_type = {
-            'qcd' : Histogram(mt_axis),
-            'ttjets' : Histogram(mt_axis),
-            'wjets' : Histogram(mt_axis),
-            'zjets' : Histogram(mt_axis)
-            }
-        for c in bkg_cols:
-            # Take BDT eff and fraction inside bins into account in one go
-            mt = c.arrays['mt']
-            mt_dist = np.histogram(mt[c.arrays['bdtscore'] > bdtcut], mt_axis)[0] / len(mt)
-            e = mt_dist.sum()
-            mt_dist *= c.xs * c.presel_eff * lumi
-            logger.debug(
-                f'{c}:\n    bdtcut_eff * mt_range_eff = {e:.3f}'
-                f', xs={c.xs:8.2f}, presel_eff={c.presel_eff:.3f}, lumi={lumi:.2f}'
-                f', n@137.2={mt_dist.sum():.2f}'
-                )
-            mt_dist_per_bkg_type[c.metadata['bkg_type']] += mt_dist
+        mt_dist_per_bkg_type = HistogramSet(mt_axis, ['qcd', 'ttjets', 'wjets', 'zjets'])
+        mt_dists = bkg.group_histogram('mt', mt_axis, weights=bkg_weight, mask=bkg.arrays['bdtscore'] > bdtcut)
+        for bkg_type, mt_dist in mt_dists.items():
+            logger.debug(f'{bkg_type}: n@137.2={mt_dist.sum():.2f}')
+            mt_dist_per_bkg_type.add(bkg_type, mt_dist)
 
         bdtcutkey = f'{bdtcut:.3f}'
         out['histograms'][bdtcutkey] = {}
-        for bkg, hist in mt_dist_per_bkg_type.items():
-            out['histograms'][bdtcutkey][bkg] = hist.json()
-        out['histograms'][bdtcutkey]['bkg'] = sum(mt_dist_per_bkg_type.values()).json()
+        for bkg_type, hist in mt_dist_per_bkg_type.to_histograms().items():
+            out['histograms'][bdtcutkey][bkg_type] = hist.json()
+        out['histograms'][bdtcutkey]['bkg'] = mt_dist_per_bkg_type.sum().json()
 
         # Signals
-        for c in signal_cols:
-            mt = c.arrays['mt']
-            mt_dist = np.histogram(mt[c.arrays['bdtscore'] > bdtcut], mt_axis)[0] / len(mt) * c.effxs * lumi
+        mt_dists = signal.histogram('mt', mt_axis, weights=signal_weight, mask=signal.arrays['bdtscore'] > bdtcut)
+        for sample, mt_dist in zip(signal.samples, mt_dists):
             histogram = Histogram(mt_axis, mt_dist)
-            histogram.metadata.update(c.metadata)
-            key = f"mz{c.metadata['mz']}_mdark{c.metadata['mdark']}_rinv{c.metadata['rinv']:.1f}"
+            histogram.metadata.update(sample.metadata)
+            key = f"mz{sample.metadata['mz']}_mdark{sample.metadata['mdark']}_rinv{sample.metadata['rinv']:.1f}"
             out['histograms'][bdtcutkey][key] = histogram.json()
 
     logger.info(f'Dumping the following dict tree to {args.outfile}:\n{repr_dict(out)}')
-    with open(args.outfile, 'w') as f:
-        json.dump(out, f)
+    common.dump_histograms(out, args.outfile)
 
 
 @scripter
 def ls():
     jsonfile = common.pull_arg('jsonfile', type=str).jsonfile
-    with open(jsonfile, 'r') as f:
-        out = json.load(f)
+    out = common.load_histograms(jsonfile)
     print(repr_dict(out))
 
     print(out['histograms']['0.0']['bsvj_200_10_0.1'])
@@ -1,8 +1,9 @@
 import argparse, os, os.path as osp, math
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
-from common import logger, DATADIR, Columns
+from common import logger, DATADIR, Columns, make_split_index, COLUMNDIR_EXT
 
 
 def split(directory, train_fraction=.9, seed=1001):
@@ -36,12 +37,10 @@ def split(directory, train_fraction=.9, seed=1001):
         sel_test = np.ones(len(cols), dtype=bool)
         sel_test[sel_train] = False
 
-        cols_train = cols.copy()
-        cols_train.arrays = {k:v[sel_train] for k, v in cols_train.arrays.items()}
+        cols_train = cols.select(sel_train)
         cols_train.save(dst_train)
 
-        cols_test = cols.copy()
-        cols_test.arrays = {k:v[sel_test] for k, v in cols_test.arrays.items()}
+        cols_test = cols.select(sel_test)
         cols_test.save(dst_test)
         
         logger.info(
@@ -51,9 +50,39 @@ def split(directory, train_fraction=.9, seed=1001):
             )
 
 
+def split_index(directory, train_fraction=.9, seed=1001, workers=8):
+    """
+    Like split, but only stores a compact train/test index next to every npz
+    file (or inside every column directory); no data is copied.
+    Load a part with Columns.load(path, split='train').
+    """
+    directory = osp.abspath(directory)
+    samples = []
+    for path, directories, files in os.walk(directory):
+        samples.extend(path+'/'+f for f in files if f.endswith('.npz'))
+        for d in list(directories):
+            if d.endswith(COLUMNDIR_EXT):
+                samples.append(path+'/'+d)
+                directories.remove(d)
+    with ThreadPoolExecutor(workers) as pool:
+        outfiles = list(pool.map(lambda f: make_split_index(f, train_fraction, seed, osp.relpath(f, directory)), samples))
+    logger.info(f'Stored train/test index (train fraction {train_fraction}) for {len(outfiles)} files in {directory}')
+
+
 def main():
-    split(DATADIR+'/bkg')
-    split(DATADIR+'/signal')
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--index', action='store_true',
+        help='Only store a train/test index next to the files instead of copying them'
+        )
+    parser.add_argument('--fraction', type=float, default=.9, help='Train fraction')
+    parser.add_argument('--seed', type=int, default=1001)
+    args = parser.parse_args()
+    for directory in [DATADIR+'/bkg', DATADIR+'/signal']:
+        if args.index:
+            split_index(directory, args.fraction, args.seed)
+        else:
+            split(directory, args.fraction, args.seed)
 
 
 if __name__ == '__main__':
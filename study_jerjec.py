@@ -13,6 +13,7 @@ scripter = common.Scripter()
 def plot():
     infiles = common.pull_arg('infiles', type=str, nargs=5).infiles
     model_file = common.pull_arg('modelfile', type=str).modelfile
+    persist = common.pull_arg('--persist', action='store_true', help='Store and reuse the BDT scores').persist
     # mtaxis = list(common.pull_arg('mtaxis', type=float, nargs='*').mtaxis)
     # unnormalized = common.pull_arg('--unnormalized', action='store_true').unnormalized
 
@@ -30,22 +31,17 @@ def plot():
     svj.logger.info(f'jec_down: {jec_down}')
     svj.logger.info(f'central : {central}')
 
-    jer_up = svj.Columns.load(jer_up)
+    jer_up = common.Columns.load(jer_up)
     jer_up.metadata['systvar'] = 'jer_up'
-    jer_down = svj.Columns.load(jer_down)
+    jer_down = common.Columns.load(jer_down)
     jer_down.metadata['systvar'] = 'jer_down'
-    jec_up = svj.Columns.load(jec_up)
+    jec_up = common.Columns.load(jec_up)
     jec_up.metadata['systvar'] = 'jec_up'
-    jec_down = svj.Columns.load(jec_down)
+    jec_down = common.Columns.load(jec_down)
     jec_down.metadata['systvar'] = 'jec_down'
-    central = svj.Columns.load(central)
+    central = common.Columns.load(central)
     central.metadata['systvar'] = 'central'
 
-    features = common.read_training_features(model_file)
-
-    model = xgboost.XGBClassifier()
-    model.load_model(model_file)
-
 
     bins = np.linspace(180, 600, 40) # mT axis
 
@@ -62,8 +58,7 @@ def plot():
         for cols in collection:
             systvar = cols.metadata['systvar']
             common.logger.info(f'Processing {systvar}')
-            X = cols.to_numpy(features)
-            score = model.predict_proba(X)[:,1]
+            score = cols.derived('bdtscore', persist, model=model_file)
 
             sel = (score > .3)
             common.logger.info(f'bdt>.3: selecting {sel.sum()} / {len(sel)} events')
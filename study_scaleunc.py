@@ -30,15 +30,10 @@ def plot():
     model_file = common.pull_arg('modelfile', type=str).modelfile
     mtaxis = list(common.pull_arg('mtaxis', type=float, nargs='*').mtaxis)
     unnormalized = common.pull_arg('--unnormalized', action='store_true').unnormalized
+    persist = common.pull_arg('--persist', action='store_true', help='Store and reuse the BDT scores').persist
 
-    cols = svj.Columns.load(infile)
-    features = common.read_training_features(model_file)
-    X = cols.to_numpy(features)
-
-    model = xgboost.XGBClassifier()
-    model.load_model(model_file)
-
-    score = model.predict_proba(X)[:,1]
+    cols = common.Columns.load(infile)
+    score = cols.derived('bdtscore', persist, model=model_file)
 
     sel = (score > .3)
     common.logger.info(f'bdt>.3: selecting {sel.sum()} / {len(sel)} events')
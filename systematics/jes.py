@@ -116,7 +116,7 @@ def skim_jes():
     for var in ['up', 'down']:
         for match_type in ['both', 'full', 'partial']:
             common.logger.info(f'{var=}, {match_type=}')
-            arrays = svj.open_root(rootfile)
+            arrays = common.open_root(rootfile)
             common.logger.info(f'Loaded, applying jes')
             apply_jes(arrays, var, match_type)
             common.logger.info(f'Done, applying presel')
@@ -155,7 +155,7 @@ def skim_for_truth_stats():
 
     for truth_match_type in ['partial', 'full', 'both']:
         common.logger.info(f'Loading {rootfile}')
-        arrays = svj.open_root(rootfile)
+        arrays = common.open_root(rootfile)
 
         if do_presel:
             common.logger.info('Applying preselection...')
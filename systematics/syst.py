@@ -145,7 +145,7 @@ def basename(meta):
 @scripter
 def skim_jec_jer():
     rootfile = common.pull_arg('rootfile', type=str).rootfile
-    array = svj.open_root(rootfile, load_gen=True, load_jerjec=True)
+    array = common.open_root(rootfile, load_gen=True, load_jerjec=True)
     for var_name, appl in [
         ('jer_up',   svj.apply_jer_up),
         ('jer_down', svj.apply_jer_down),
@@ -164,7 +164,7 @@ def skim_scale():
     Creates the skim with scale weights
     """
     rootfile = common.pull_arg('rootfile', type=str).rootfile
-    array = svj.open_root(rootfile)
+    array = common.open_root(rootfile)
 
     # Compute normalizations before applying cuts
     w = array.array['ScaleWeights'].to_numpy()
@@ -195,7 +195,7 @@ def skim_scale():
 def plot_pu_weight_dist():
     rootfile = common.pull_arg('rootfile', type=str).rootfile
     svj.BRANCHES_GENONLY.extend(['puWeight'])
-    array = svj.open_root(rootfile)
+    array = common.open_root(rootfile)
 
     w = array.array['puWeight'].to_numpy()
     with common.quick_ax(outfile='puweight.png') as ax:
@@ -219,7 +219,7 @@ def skim_central():
         'GenJetsAK15.fCoordinates.fE',
         'puSysUp', 'puSysDown'
         ])
-    array = svj.open_root(rootfile)
+    array = common.open_root(rootfile)
 
     # ______________________________
     # Work before applying preselection
@@ -263,10 +263,56 @@ def skim_central():
 
 
 
+def central_weights(central, lumi, selection):
+    """
+    mt and the weights of the scale, PS, PU and PDF variations for the
+    selected events of the central skim (or of a chunk of it).
+    """
+    sel = mask_cutbased(central) if selection=='cutbased' else slice(None)
+    mt = central.to_numpy(['mt']).ravel()[sel]
+    w = central.to_numpy(['puweight']).ravel()[sel]
+    w = w * (lumi * central.xs / central.cutflow['raw'])
+    weights = dict(central=w)
+
+    # Scale
+    scale_weight = central.to_numpy(['scaleweights'])[sel][:, np.array([0,1,2,3,4,6,8])]
+    weights['scale_up'] = w * np.max(scale_weight, axis=-1)
+    weights['scale_down'] = w * np.min(scale_weight, axis=-1)
+
+    # PS
+    ps_weights = w[:,None] * central.to_numpy(['ps_isr_up', 'ps_isr_down',
+                                       'ps_fsr_up', 'ps_fsr_down'])[sel]
+    weights['isr_up']   = ps_weights[:,0]
+    weights['isr_down'] = ps_weights[:,1]
+    weights['fsr_up']   = ps_weights[:,2]
+    weights['fsr_down'] = ps_weights[:,3]
+
+    # PU
+    pu_weights = central.to_numpy(['pu_sys_up', 'pu_sys_down'])[sel]
+    weights['pu_up'] = pu_weights[:,0]
+    weights['pu_down'] = pu_weights[:,1]
+
+    # PDF
+    pdf_weights = central.to_numpy(['pdf_weights'])[sel]
+    pdf_weights = pdf_weights / pdf_weights[:,:1] # Divide by first pdf
+    mu_pdf = np.mean(pdf_weights, axis=1)
+    sigma_pdf = np.std(pdf_weights, axis=1)
+    pdfw_up = (mu_pdf+sigma_pdf) / central.metadata['pdfw_norm_up']
+    pdfw_down = (mu_pdf-sigma_pdf) / central.metadata['pdfw_norm_down']
+    weights['pdf_up'] = w*pdfw_up
+    weights['pdf_down'] = w*pdfw_down
+    return mt, weights
+
+
 @scripter
 def produce():
+    """
+    With `--chunk-size N`, the skims are read and histogrammed in blocks of
+    N events (the histograms are identical to the default in-memory run).
+    """
     selection = common.pull_arg('selection', type=str, choices=['cutbased', 'bdt']).selection
     skims = common.pull_arg('skims', type=str, nargs='+').skims
+    chunk_size = common.pull_arg('--chunk-size', type=int, help='Number of events per chunk').chunk_size
     def get_by_tag(tag):
         return [s for s in skims if 'central' in s][0]
         
@@ -275,27 +321,25 @@ def produce():
 
     central_skim = get_by_tag('central')
 
-    central = svj.Columns.load(central_skim)
-    sel = mask_cutbased(central) if selection=='cutbased' else None
-    mt = central.to_numpy(['mt']).ravel()[sel]
-    w = central.to_numpy(['puweight']).ravel()[sel]
-    w *= lumi * central.xs / central.cutflow['raw']
+    central = common.Columns.load(central_skim, lazy=chunk_size is not None)
+    hists = common.accumulate_histograms(
+        central, lambda cols: central_weights(cols, lumi, selection), MTHistogram.bins, chunk_size
+        )
 
     # Scale
-    scale_weight = central.to_numpy(['scaleweights'])[sel][:, np.array([0,1,2,3,4,6,8])]
-    weight_up = w * np.max(scale_weight, axis=-1)
-    weight_down = w * np.min(scale_weight, axis=-1)
-    mth_scale_up = MTHistogram(mt, weight_up)
-    mth_scale_down = MTHistogram(mt, weight_down)
+    mth_scale_up = hists.histogram('scale_up')
+    mth_scale_down = hists.histogram('scale_down')
 
     # JEC/JER/JES
     def mth_jerjecjes(tag):
-        col = svj.Columns.load(get_by_tag(tag))
-        sel = mask_cutbased(col) if selection=='cutbased' else None
-        mt = col.to_numpy(['mt']).flatten()[sel]
-        w = col.to_numpy(['puweight']).flatten()[sel]
-        w *= lumi * col.xs / col.cutflow['raw']
-        return MTHistogram(mt, w)
+        col = common.Columns.load(get_by_tag(tag), lazy=chunk_size is not None)
+        def weights(col):
+            sel = mask_cutbased(col) if selection=='cutbased' else slice(None)
+            mt = col.to_numpy(['mt']).flatten()[sel]
+            w = col.to_numpy(['puweight']).flatten()[sel]
+            w *= lumi * col.xs / col.cutflow['raw']
+            return mt, dict(central=w)
+        return common.accumulate_histograms(col, weights, MTHistogram.bins, chunk_size).histogram('central')
     jer_up = mth_jerjecjes('jer_up')
     jer_down = mth_jerjecjes('jer_down')
     jec_up = mth_jerjecjes('jec_up')
@@ -304,31 +348,22 @@ def produce():
     jes_down = mth_jerjecjes('jesdown_both')
 
     # PS
-    ps_weights = w[:,None] * central.to_numpy(['ps_isr_up', 'ps_isr_down',
-                                       'ps_fsr_up', 'ps_fsr_down'])[sel]
-    mth_isr_up   = MTHistogram(mt, ps_weights[:,0])
-    mth_isr_down = MTHistogram(mt, ps_weights[:,1])
-    mth_fsr_up   = MTHistogram(mt, ps_weights[:,2])
-    mth_fsr_down = MTHistogram(mt, ps_weights[:,3])
+    mth_isr_up   = hists.histogram('isr_up')
+    mth_isr_down = hists.histogram('isr_down')
+    mth_fsr_up   = hists.histogram('fsr_up')
+    mth_fsr_down = hists.histogram('fsr_down')
 
     # PU
-    pu_weights = central.to_numpy(['pu_sys_up', 'pu_sys_down'])[sel]
-    mth_pu_up = MTHistogram(mt, pu_weights[:,0])
-    mth_pu_down = MTHistogram(mt, pu_weights[:,1])
+    mth_pu_up = hists.histogram('pu_up')
+    mth_pu_down = hists.histogram('pu_down')
 
     # PDF
-    pdf_weights = central.to_numpy(['pdf_weights'])[sel]
-    pdf_weights /= pdf_weights[:,:1] # Divide by first pdf
-    mu_pdf = np.mean(pdf_weights, axis=1)
-    sigma_pdf = np.std(pdf_weights, axis=1)
-    pdfw_up = (mu_pdf+sigma_pdf) / central.metadata['pdfw_norm_up']
-    pdfw_down = (mu_pdf-sigma_pdf) / central.metadata['pdfw_norm_down']
-    mth_pdf_up = MTHistogram(mt, w*pdfw_up)
-    mth_pdf_down = MTHistogram(mt, w*pdfw_down)
+    mth_pdf_up = hists.histogram('pdf_up')
+    mth_pdf_down = hists.histogram('pdf_down')
 
     # MC stats
-    mth_central = MTHistogram(mt, w)
-    mc_stat_err = np.sqrt(np.histogram(mt, bins=mth_central.binning, weights=w**2)[0])
+    mth_central = hists.histogram('central')
+    mc_stat_err = np.sqrt(hists.sumw2('central'))
 
     mc_stat_up = []
     mc_stat_down = []
@@ -0,0 +1,100 @@
+import os.path as osp, sys
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+import svj_ntuple_processing
+
+# The scripts and common.py live in the repository root
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+import common
+
+
+def random_cols(n=100, seed=1, shift=0.):
+    """
+    In-memory Columns with random training-like arrays: mt and weight, the
+    cut-based selection variables rt and ecfm2b1, features a, b and c
+    (c takes 5 distinct values), and the event number i.
+    Signal-like samples get a `shift` in the features.
+    """
+    rng = np.random.default_rng(seed)
+    cols = common.Columns()
+    cols.arrays = dict(
+        mt=rng.uniform(100., 800., n), weight=rng.exponential(1., n),
+        rt=rng.uniform(1., 1.4, n), ecfm2b1=rng.uniform(0., .2, n),
+        a=rng.normal(shift, 1., n), b=rng.exponential(1.+shift, n),
+        c=rng.integers(0, 5, n).astype(float), i=np.arange(n),
+        )
+    return cols
+
+
+def write_random_sample(path, n=101, seed=1):
+    """Saves random_cols(n, seed) to `path` (.npz or .cols) and returns it"""
+    cols = random_cols(n, seed)
+    cols.save(str(path))
+    return cols
+
+
+@pytest.fixture
+def make_cols():
+    return random_cols
+
+
+@pytest.fixture
+def write_sample():
+    return write_random_sample
+
+
+@pytest.fixture(params=['sample.npz', 'sample.cols'])
+def sample(tmp_path, request):
+    """Path of a random sample, as .npz file and as column directory"""
+    path = tmp_path / request.param
+    write_random_sample(path)
+    return str(path)
+
+
+def write_npz_sample(path, n=500, seed=1):
+    """
+    Writes a sample with the plain svj_ntuple_processing.Columns (the baseline
+    format), with 1D arrays of several dtypes, a 2D array, metadata and cutflow.
+    """
+    rng = np.random.default_rng(seed)
+    cols = svj_ntuple_processing.Columns()
+    cols.arrays = dict(
+        mt=rng.uniform(100., 800., n), pt=rng.exponential(300., n).astype(np.float32),
+        nconst=rng.integers(0, 50, n), scaleweights=rng.normal(1., .1, (n, 9)),
+        )
+    cols.metadata = dict(bkg_type='qcd', ptbin=[300, 470])
+    cols.cutflow = OrderedDict([('raw', 2*n), ('preselection', n)])
+    cols.save(str(path))
+    return str(path)
+
+
+def assert_same_columns(cols, baseline):
+    """Same arrays (values and dtypes), metadata (but src) and cutflow"""
+    assert sorted(cols.arrays) == sorted(baseline.arrays)
+    for key in baseline.arrays:
+        np.testing.assert_array_equal(cols.arrays[key], baseline.arrays[key])
+        assert cols.arrays[key].dtype == baseline.arrays[key].dtype
+    strip = lambda metadata: {k: v for k, v in metadata.items() if k != 'src'}
+    assert strip(cols.metadata) == strip(baseline.metadata)
+    assert list(cols.cutflow.items()) == [
+        (k.decode() if isinstance(k, bytes) else k, v) for k, v in baseline.cutflow.items()
+        ]
+
+
+@pytest.fixture
+def write_npz():
+    return write_npz_sample
+
+
+@pytest.fixture
+def assert_same():
+    return assert_same_columns
+
+
+@pytest.fixture
+def npz(tmp_path):
+    """Path of a sample .npz file written by the baseline Columns.save"""
+    return write_npz_sample(tmp_path / 'sample.npz')
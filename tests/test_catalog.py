@@ -0,0 +1,39 @@
+import os
+
+import svj_ntuple_processing
+
+import common
+
+
+def test_catalog(tmp_path, write_npz, assert_same):
+    datadir = tmp_path / 'bkg'
+    write_npz(datadir / 'qcd_a.npz', n=100, seed=1)
+    write_npz(datadir / 'qcd_b.npz', n=200, seed=2)
+    common.npz_to_columndir(write_npz(datadir / 'ttjets.npz', n=50, seed=3), str(datadir / 'ttjets.cols'))
+    os.remove(datadir / 'ttjets.npz')
+    catalog = common.Catalog.build(str(datadir), workers=2)
+    assert sorted(catalog.entries) == ['qcd_a.npz', 'qcd_b.npz', 'ttjets.cols']
+
+    catalog = common.Catalog.load(str(datadir))
+    cols = catalog.columns('qcd_*')
+    assert [len(c) for c in cols] == [100, 200]
+    assert cols[1].cutflow['raw'] == 400
+    assert cols[1].arrays.loaded_keys() == []
+    assert_same(cols[1], svj_ntuple_processing.Columns.load(str(datadir / 'qcd_b.npz')))
+    assert catalog.query('*.cols') == [str(datadir / 'ttjets.cols')]
+
+
+def test_catalog_ignores_columndir_sidecars(tmp_path, write_npz):
+    datadir = tmp_path / 'bkg'
+    columndir = common.npz_to_columndir(write_npz(tmp_path / 'ttjets.npz'), str(datadir / 'ttjets.cols'))
+    common.Catalog.build(str(datadir))
+    entry = common.Catalog.load(str(datadir)).entries['ttjets.cols']
+    # Sidecars written next to the columns, including a derived/ subdirectory
+    os.makedirs(os.path.join(columndir, 'derived'))
+    with open(os.path.join(columndir, 'derived', 'x.npy'), 'wb') as f: f.write(b'x')
+    with open(os.path.join(columndir, 'selections.sel'), 'wb') as f: f.write(b'x')
+    assert common.content_hash(columndir) == entry['hash']
+    assert common.Catalog.build(str(datadir)).entries['ttjets.cols'] == entry
+    # Resaving the sample is noticed
+    common.Columns.load(columndir).select(slice(0, 10)).save(columndir)
+    assert common.Catalog.build(str(datadir)).entries['ttjets.cols']['n_events'] == 10
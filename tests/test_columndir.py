@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import svj_ntuple_processing
+
+import common
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_columndir_round_trip(npz, lazy, assert_same):
+    baseline = svj_ntuple_processing.Columns.load(npz)
+    columndir = common.npz_to_columndir(npz)
+    assert common.is_columndir(columndir)
+    cols = common.Columns.load(columndir, lazy=lazy)
+    assert sorted(cols.arrays.loaded_keys()) == ([] if lazy else sorted(cols.arrays))
+    assert len(cols) == 500
+    assert_same(cols, baseline)
+    assert cols.metadata['src'] == columndir
+
+
+def test_columndir_projection(npz):
+    cols = common.Columns.load(common.npz_to_columndir(npz), columns=['mt', 'pt'])
+    assert sorted(cols.arrays) == ['mt', 'pt']
+    np.testing.assert_array_equal(cols.arrays['pt'], svj_ntuple_processing.Columns.load(npz).arrays['pt'])
+
+
+def test_missing_column_raises(npz):
+    with pytest.raises(KeyError):
+        common.Columns.load(common.npz_to_columndir(npz), columns=['nope'])
+
+
+def test_in_place_edits_do_not_touch_the_file(npz):
+    columndir = common.npz_to_columndir(npz)
+    cols = common.Columns.load(columndir)
+    cols.arrays['mt'] *= 2.
+    np.testing.assert_array_equal(
+        common.Columns.load(columndir).arrays['mt'], svj_ntuple_processing.Columns.load(npz).arrays['mt']
+        )
+
+
+def test_sorted_by_mt(npz):
+    baseline = svj_ntuple_processing.Columns.load(npz)
+    columndir = common.npz_to_columndir(npz, sort_by='mt')
+    cols = common.Columns.load(columndir)
+    assert cols.metadata['sorted_by'] == 'mt'
+    assert np.all(np.diff(cols.arrays['mt']) >= 0.)
+    window = common.mt_wind(cols, 650., 180.)
+    assert isinstance(window, slice)
+    expected = common.mt_wind(baseline, 650., 180.)
+    np.testing.assert_array_equal(cols.arrays['mt'][window], np.sort(baseline.arrays['mt'][expected]))
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import common
+
+
+def baseline_columns_to_numpy(signal_cols, bkg_cols, features, downsample=.4, mt_high=650, mt_low=180):
+    """The original list-and-concatenate implementation"""
+    X, y, bkg_weight, signal_weight = [], [], [], []
+    for cols in bkg_cols:
+        mtwind = common.mt_wind(cols, mt_high, mt_low)
+        this_X = np.column_stack([cols.arrays[f] for f in features])[mtwind]
+        this_weight = cols.arrays['weight'][mtwind]
+        if downsample < 1.:
+            select = np.random.choice(len(this_weight), int(downsample*len(this_weight)), replace=False)
+            this_X = this_X[select]
+            this_weight = this_weight[select]
+        X.append(this_X)
+        bkg_weight.append(this_weight)
+        y.append(np.zeros(len(this_X)))
+    for cols in signal_cols:
+        sigmtwind = common.mt_wind(cols, mt_high, mt_low)
+        X.append(np.column_stack([cols.arrays[f] for f in features])[sigmtwind])
+        n = len(cols.arrays[features[0]][sigmtwind])
+        y.append(np.ones(n))
+        signal_weight.append((1./n)*np.ones(n))
+    bkg_weight = np.concatenate(bkg_weight)
+    signal_weight = np.concatenate(signal_weight)
+    signal_weight *= np.sum(bkg_weight) / np.sum(signal_weight)
+    return np.concatenate(X), np.concatenate(y), np.concatenate((bkg_weight, signal_weight))
+
+
+@pytest.mark.parametrize('downsample', [1., .4])
+def test_matches_baseline(downsample, make_cols):
+    bkg = [make_cols(1000, 1), make_cols(500, 2)]
+    signal = [make_cols(300, 3), make_cols(200, 4)]
+    np.random.seed(1001)
+    expected = baseline_columns_to_numpy(signal, bkg, ['a', 'b'], downsample)
+    np.random.seed(1001)
+    result = common.columns_to_numpy(signal, bkg, ['a', 'b'], downsample=downsample)
+    for e, r in zip(expected, result):
+        np.testing.assert_array_equal(e, r)
+
+
+def test_empty_trailing_bkg_sample(make_cols):
+    # At downsample=.4 the 1-event bkg sample keeps 0 rows
+    bkg = [make_cols(10, 1), make_cols(1, 2)]
+    bkg[1].arrays['mt'][:] = 300.
+    signal = [make_cols(50, 3)]
+    np.random.seed(1001)
+    expected = baseline_columns_to_numpy(signal, bkg, ['a'], .4)
+    np.random.seed(1001)
+    result = common.columns_to_numpy(signal, bkg, ['a'], downsample=.4)
+    for e, r in zip(expected, result):
+        np.testing.assert_array_equal(e, r)
+
+
+def test_importance_sampling_preserves_weight_sums(make_cols):
+    bkg = [make_cols(5000, 1), make_cols(3000, 2)]
+    signal = [make_cols(500, 3)]
+    X, y, weight = common.columns_to_numpy(
+        signal, bkg, ['a'], downsample=.2, sampling='importance', seed=5
+        )
+    full = sum(c.arrays['weight'][common.mt_wind(c, 650, 180)].sum() for c in bkg)
+    np.testing.assert_allclose(weight[y == 0].sum(), full, rtol=1e-12)
+    assert (y == 0).sum() < .3 * sum(len(c) for c in bkg)
+    # Same seed, same result
+    _, _, weight2 = common.columns_to_numpy(
+        signal, bkg, ['a'], downsample=.2, sampling='importance', seed=5
+        )
+    np.testing.assert_array_equal(weight, weight2)
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+import common
+
+
+@pytest.fixture(autouse=True)
+def calls():
+    """Registers derived column 'scaled_a' for one test; returns its calls"""
+    calls = []
+    def scaled_a(cols, factor=1.):
+        calls.append(factor)
+        return factor * cols.arrays['a']
+    common.DERIVED_COLUMNS['scaled_a'] = common.DerivedColumn('scaled_a', scaled_a, ['a'])
+    yield calls
+    del common.DERIVED_COLUMNS['scaled_a']
+
+
+def test_stored_copy_is_reused_without_reading_inputs(sample, calls):
+    first = common.Columns.load(sample, lazy=True).derived('scaled_a', True, factor=2.)
+    cols = common.Columns.load(sample, lazy=True)
+    second = cols.derived('scaled_a', True, factor=2.)
+    np.testing.assert_array_equal(first, second)
+    assert calls == [2.]
+    assert 'a' not in cols.arrays.loaded_keys()
+    assert len(os.listdir(common.derived_dir(sample))) == 1
+
+
+def test_params_are_part_of_the_key(sample, calls):
+    a = common.Columns.load(sample).arrays['a']
+    for factor in [2., 3., 2., 3.]:
+        cols = common.Columns.load(sample, lazy=True)
+        np.testing.assert_array_equal(cols.derived('scaled_a', True, factor=factor), factor*a)
+    assert calls == [2., 3.]
+
+
+def test_rewritten_sample_invalidates_stored_copy(sample, calls, write_sample):
+    common.Columns.load(sample, lazy=True).derived('scaled_a', True, factor=2.)
+    write_sample(sample, seed=2)
+    cols = common.Columns.load(sample, lazy=True)
+    np.testing.assert_array_equal(cols.derived('scaled_a', True, factor=2.), 2.*cols.arrays['a'])
+    assert calls == [2., 2.]
+    assert len(os.listdir(common.derived_dir(sample))) == 1
+
+
+def test_unwritable_sample_still_computes(sample, monkeypatch):
+    def makedirs(*args, **kwargs):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(common.os, 'makedirs', makedirs)
+    cols = common.Columns.load(sample, lazy=True)
+    np.testing.assert_array_equal(cols.derived('scaled_a', True, factor=2.), 2.*cols.arrays['a'])
+
+
+def test_not_persisted_by_default(sample, calls):
+    for _ in range(2):
+        common.Columns.load(sample, lazy=True).derived('scaled_a', factor=2.)
+    assert calls == [2., 2.]
+    assert not os.path.exists(common.derived_dir(sample))
+
+
+@pytest.mark.parametrize('edit', ['assign', 'in-place'])
+def test_modified_inputs_are_neither_stored_nor_reused(sample, calls, edit):
+    common.Columns.load(sample, lazy=True).derived('scaled_a', True, factor=2.)
+    cols = common.Columns.load(sample)
+    a = cols.arrays['a'].copy()
+    if edit == 'assign':
+        cols.arrays['a'] = a + 1.
+    else:
+        cols.arrays['a'] += 1.
+    np.testing.assert_array_equal(cols.derived('scaled_a', True, factor=2.), 2.*(a + 1.))
+    assert calls == [2., 2.]
+    assert len(os.listdir(common.derived_dir(sample))) == 1
+    # The derived column of unmodified inputs counts as stored
+    cols = common.Columns.load(sample)
+    cols.derived('scaled_a', True, factor=2.)
+    assert 'scaled_a' not in cols.arrays.modified
@@ -0,0 +1,106 @@
+import os, json
+
+import pytest
+
+import common
+import download
+
+
+class FlakyBackend(common.LocalBackend):
+    """Local backend that fails copies of the files in `fail`, and counts copies"""
+    def __init__(self):
+        super().__init__()
+        self.fail = set()
+        self.copies = []
+
+    def copy(self, remote, local):
+        self.copies.append(remote)
+        if os.path.basename(remote) in self.fail: raise IOError('connection reset')
+        super().copy(remote, local)
+
+
+@pytest.fixture
+def source(tmp_path):
+    src = tmp_path / 'src'
+    for name in ['a.npz', 'sub/b.npz', 'sub/deeper/c.npz']:
+        (src / name).parent.mkdir(parents=True, exist_ok=True)
+        (src / name).write_bytes(os.urandom(1000))
+    return str(src)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_download_and_resume(source, tmp_path):
+    datadir = str(tmp_path / 'data')
+    backend = FlakyBackend()
+    backend.fail = {'b.npz'}
+    failed = download.download([(source, 'bkg')], datadir, workers=3, backend=backend)
+    assert failed == ['bkg/sub/b.npz']
+    assert not os.path.exists(os.path.join(datadir, 'bkg/sub/b.npz'))
+    assert [f for f in os.listdir(os.path.join(datadir, 'bkg/sub')) if f.startswith('.tmp')] == []
+
+    with open(os.path.join(datadir, download.MANIFEST_FILE)) as f:
+        files = json.load(f)['files']
+    assert sorted(files) == ['bkg/a.npz', 'bkg/sub/b.npz', 'bkg/sub/deeper/c.npz']
+    assert not files['bkg/sub/b.npz']['done'] and files['bkg/a.npz']['done']
+    assert files['bkg/a.npz']['checksum'] == common.adler32(os.path.join(source, 'a.npz'))
+
+    # Rerunning only copies the file that failed
+    backend.fail = set()
+    backend.copies = []
+    assert download.download([(source, 'bkg')], datadir, workers=3, backend=backend) == []
+    assert backend.copies == [os.path.join(source, 'sub/b.npz')]
+    for name in ['a.npz', 'sub/b.npz', 'sub/deeper/c.npz']:
+        assert read(os.path.join(datadir, 'bkg', name)) == read(os.path.join(source, name))
+
+
+def test_changed_source_is_downloaded_again(source, tmp_path):
+    datadir = str(tmp_path / 'data')
+    backend = FlakyBackend()
+    download.download([(source, 'bkg')], datadir, backend=backend)
+    with open(os.path.join(source, 'a.npz'), 'wb') as f:
+        f.write(b'new contents')
+    backend.copies = []
+    download.download([(source, 'bkg')], datadir, backend=backend)
+    assert backend.copies == [os.path.join(source, 'a.npz')]
+    assert read(os.path.join(datadir, 'bkg/a.npz')) == b'new contents'
+
+
+def test_checksum_mismatch_fails(source, tmp_path, monkeypatch):
+    datadir = str(tmp_path / 'data')
+    backend = FlakyBackend()
+    monkeypatch.setattr(backend, 'checksum', lambda remote: '00000000')
+    failed = download.download([(source, 'bkg')], datadir, backend=backend)
+    assert sorted(failed) == ['bkg/a.npz', 'bkg/sub/b.npz', 'bkg/sub/deeper/c.npz']
+    assert os.listdir(os.path.join(datadir, 'bkg')) == ['sub']
+
+
+def test_other_sources_in_the_manifest_are_left_alone(source, tmp_path):
+    datadir = str(tmp_path / 'data')
+    backend = FlakyBackend()
+    download.download([(source, 'bkg')], datadir, backend=backend)
+    os.remove(os.path.join(datadir, 'bkg/a.npz'))
+    backend.copies = []
+    assert download.download([(source, 'signal')], datadir, backend=backend) == []
+    assert sorted(backend.copies) == sorted(
+        os.path.join(source, name) for name in ['a.npz', 'sub/b.npz', 'sub/deeper/c.npz']
+        )
+    assert not os.path.exists(os.path.join(datadir, 'bkg/a.npz'))
+
+
+def test_manifest_saves_are_batched(source, tmp_path, monkeypatch):
+    saves = []
+    save = download.Manifest.save
+    def counting_save(manifest):
+        saves.append(manifest.path)
+        save(manifest)
+    monkeypatch.setattr(download.Manifest, 'save', counting_save)
+    datadir = str(tmp_path / 'data')
+    download.download([(source, 'bkg')], datadir, backend=FlakyBackend())
+    # After listing, and at the end
+    assert len(saves) == 2
+    with open(os.path.join(datadir, download.MANIFEST_FILE)) as f:
+        assert all(entry['done'] for entry in json.load(f)['files'].values())
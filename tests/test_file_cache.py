@@ -0,0 +1,106 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import common
+
+
+class CountingBackend(common.LocalBackend):
+    def __init__(self, root):
+        super().__init__(root)
+        self.copies = []
+
+    def copy(self, remote, local):
+        self.copies.append(remote)
+        super().copy(remote, local)
+
+
+@pytest.fixture
+def remote(tmp_path):
+    root = tmp_path / 'remote'
+    (root / 'store').mkdir(parents=True)
+    for name, size in [('a.npz', 100), ('b.npz', 200), ('c.npz', 300)]:
+        (root / 'store' / name).write_bytes(os.urandom(size))
+    return str(root)
+
+
+@pytest.fixture
+def cache(remote, tmp_path):
+    return common.FileCache(str(tmp_path / 'cache'), max_bytes=10**6, backend=CountingBackend(remote), grace=0.)
+
+
+def test_get_copies_once(cache, remote):
+    local = cache.get('root://host//store/a.npz')
+    assert os.path.basename(local) == 'a.npz'
+    with open(local, 'rb') as f, open(os.path.join(remote, 'store/a.npz'), 'rb') as g:
+        assert f.read() == g.read()
+    assert cache.get('root://host//store/a.npz') == local
+    assert cache.backend.copies == ['root://host//store/a.npz']
+
+
+def test_changed_remote_is_fetched_again(cache, remote):
+    first = cache.get('root://host//store/a.npz')
+    with open(os.path.join(remote, 'store/a.npz'), 'wb') as f:
+        f.write(b'changed')
+    second = cache.get('root://host//store/a.npz')
+    assert second != first
+    with open(second, 'rb') as f:
+        assert f.read() == b'changed'
+
+
+def test_lru_eviction(cache):
+    cache.max_bytes = 550
+    a = cache.get('root://host//store/a.npz')
+    b = cache.get('root://host//store/b.npz')
+    os.utime(b, (1., 1.)) # b is the least recently used
+    os.utime(a, (2., 2.))
+    cache.get('root://host//store/c.npz')
+    assert os.path.isfile(a) and not os.path.exists(b)
+    assert sum(e[1] for e in cache.entries()) <= cache.max_bytes
+
+
+def test_grace_keeps_recent_entries(cache):
+    cache.max_bytes = 350
+    cache.grace = 300.
+    a = cache.get('root://host//store/a.npz')
+    cache.get('root://host//store/c.npz')
+    assert os.path.isfile(a)
+
+
+def test_columns_load_remote(tmp_path, monkeypatch):
+    remote = tmp_path / 'remote'
+    cols = common.Columns()
+    cols.arrays = dict(a=np.arange(10.))
+    cols.metadata = dict(mz=350)
+    cols.save(str(remote / 'store' / 'sample.npz'))
+    cache = common.FileCache(str(tmp_path / 'cache'), backend=CountingBackend(str(remote)))
+    monkeypatch.setattr(common, '_FILE_CACHE', cache)
+    for _ in range(2):
+        loaded = common.Columns.load('root://host//store/sample.npz')
+        np.testing.assert_array_equal(loaded.arrays['a'], cols.arrays['a'])
+        assert loaded.metadata['src'] == 'root://host//store/sample.npz'
+        assert loaded.metadata['mz'] == 350
+    assert len(cache.backend.copies) == 1
+
+
+def test_ls_wildcard_cached(cache, remote, monkeypatch):
+    monkeypatch.setattr(common, '_FILE_CACHE', cache)
+    pattern = 'root://host//store/*.npz'
+    expected = ['root://host//store/a.npz', 'root://host//store/b.npz', 'root://host//store/c.npz']
+    assert common.ls_wildcard_cached(pattern, ttl=100.) == expected
+    os.remove(os.path.join(remote, 'store/c.npz'))
+    assert common.ls_wildcard_cached(pattern, ttl=100.) == expected
+    assert common.ls_wildcard_cached(pattern, ttl=0) == expected[:2]
+
+
+def test_concurrent_listings_from_threads(remote, cache, monkeypatch):
+    monkeypatch.setattr(common, '_FILE_CACHE', cache)
+    pattern = 'root://host//store/*.npz'
+    def ls(i):
+        return [common.ls_wildcard_cached(pattern, ttl=0) for _ in range(20)]
+    with ThreadPoolExecutor(8) as pool:
+        listings = [paths for result in pool.map(ls, range(8)) for paths in result]
+    assert all(len(paths) == 3 for paths in listings)
+    assert len(os.listdir(os.path.join(cache.cachedir, '.listings'))) == 1
@@ -0,0 +1,62 @@
+import json
+
+import numpy as np
+
+import common
+
+
+def histogram(seed, bins=common.MT_BINS):
+    rng = np.random.default_rng(seed)
+    h = common.Histogram(np.asarray(bins), rng.uniform(0., 10., len(bins)-1), rng.uniform(0., 1., len(bins)-1))
+    h.metadata['seed'] = seed
+    return h
+
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(a.binning, b.binning)
+    np.testing.assert_array_equal(a.vals, b.vals)
+    np.testing.assert_array_equal(a.errs, b.errs)
+
+
+def test_write_load_roundtrip(tmp_path):
+    tree = {
+        'central': histogram(1),
+        'individual': [histogram(2), histogram(3, np.linspace(0., 1., 11))],
+        'empty': [],
+        'version': 3,
+        'histograms': {'0.300': {'qcd': histogram(4).json()}},
+        }
+    f = common.HistogramFile.write(str(tmp_path / 'a.hists'), tree)
+    assert_same(f['central'], tree['central'])
+    assert_same(f['individual/1'], tree['individual'][1])
+    assert f['version'] == 3
+    assert len(f.toc['axes']) == 2
+    loaded = f.load()
+    assert list(loaded) == list(tree)
+    assert loaded['empty'] == []
+    assert_same(loaded['histograms']['0.300']['qcd'], common.Histogram.from_dict(tree['histograms']['0.300']['qcd']))
+
+
+def test_append_replaces_entries(tmp_path):
+    path = str(tmp_path / 'a.hists')
+    h1, h2 = histogram(1), histogram(2)
+    common.HistogramFile.write(path, {'a': h1, 'b': h1})
+    common.HistogramFile(path).append({'a': h2, 'b': h1, 'c': h2})
+    common.HistogramFile(path).append({'b': h2})
+    f = common.HistogramFile(path)
+    assert list(f.keys()) == ['a', 'b', 'c']
+    assert_same(f['a'], h2)
+    assert_same(f['b'], h2)
+    assert_same(f['c'], h2)
+    members = [e['member'] for e in f.toc['entries'].values()]
+    assert len(set(members)) == len(members)
+
+
+def test_json_export_matches_encoder(tmp_path):
+    tree = {'central': histogram(1), 'bkg': [histogram(2)]}
+    with open(tmp_path / 'direct.json', 'w') as f:
+        json.dump(tree, f, cls=common.Encoder, indent=4)
+    common.dump_histograms(tree, str(tmp_path / 'a.hists'))
+    common.HistogramFile(str(tmp_path / 'a.hists')).to_json(str(tmp_path / 'export.json'))
+    assert (tmp_path / 'direct.json').read_text() == (tmp_path / 'export.json').read_text()
+    assert_same(common.load_histograms(str(tmp_path / 'direct.json'))['central'], tree['central'])
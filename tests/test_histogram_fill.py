@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import common
+
+
+BINS = np.linspace(180., 650., 48)
+
+def make_events(n, seed=1, bins=BINS):
+    rng = np.random.default_rng(seed)
+    span = bins[-1] - bins[0]
+    x = rng.uniform(bins[0] - .1*span, bins[-1] + .1*span, n)
+    x[:len(bins)] = bins # Values on the edges
+    weights = dict(nominal=rng.exponential(1., n), up=rng.normal(1., .2, n))
+    return x, weights
+
+
+def fill(accumulator, x, weights, chunks):
+    for chunk in np.array_split(np.arange(len(x)), chunks):
+        accumulator.fill(x[chunk], {name: w[chunk] for name, w in weights.items()})
+    accumulator.finish()
+    return accumulator
+
+
+@pytest.mark.parametrize('n', [100, common.HIST_BLOCK, 3*common.HIST_BLOCK + 17])
+@pytest.mark.parametrize('chunks', [1, 7])
+def test_accumulator_is_bit_identical_to_np_histogram(n, chunks):
+    x, weights = make_events(n)
+    accumulator = fill(common.HistogramAccumulator(BINS), x, weights, chunks)
+    for name, w in weights.items():
+        np.testing.assert_array_equal(accumulator.sumw(name), np.histogram(x, BINS, weights=w)[0])
+        np.testing.assert_array_equal(accumulator.sumw2(name), np.histogram(x, BINS, weights=w**2)[0])
+        h = accumulator.histogram(name)
+        np.testing.assert_array_equal(h.vals, np.histogram(x, BINS, weights=w)[0])
+        np.testing.assert_array_equal(h.errs, np.sqrt(np.histogram(x, BINS, weights=w**2)[0]))
+
+
+def test_accumulate_histograms_over_chunks():
+    x, weights = make_events(3000)
+    cols = common.Columns()
+    cols.arrays = dict(x=x, **weights)
+    fn = lambda chunk: (chunk.arrays['x'], {'nominal': chunk.arrays['nominal']})
+    accumulator = common.accumulate_histograms(cols, fn, BINS, chunk_size=1000, exact=True)
+    np.testing.assert_array_equal(accumulator.sumw('nominal'), np.histogram(x, BINS, weights=weights['nominal'])[0])
+
+
+IRREGULAR = np.array([0., 1.5, 2., 10., 10.5, 30.])
+
+@pytest.mark.parametrize('bins', [BINS, IRREGULAR])
+def test_bin_index_follows_np_histogram(bins):
+    x, _ = make_events(10000, bins=bins)
+    idx = common.bin_index(x, bins)
+    inside = idx >= 0
+    np.testing.assert_array_equal(np.bincount(idx[inside], minlength=len(bins)-1), np.histogram(x, bins)[0])
+    assert not np.any(inside & ((x < bins[0]) | (x > bins[-1])))
+
+
+def assert_within_rounding(sumw, x, bins, w):
+    """Equal to np.histogram up to 1e-12 of the summed absolute weights per bin"""
+    expected = np.histogram(x, bins, weights=w)[0]
+    np.testing.assert_array_less(np.abs(sumw - expected), 1e-12 * np.histogram(x, bins, weights=np.abs(w))[0] + 1e-300)
+
+
+@pytest.mark.parametrize('use_numba', [False, True])
+@pytest.mark.parametrize('bins', [BINS, IRREGULAR])
+def test_bank_matches_np_histogram_and_is_chunk_invariant(use_numba, bins):
+    if use_numba: pytest.importorskip('numba')
+    x, weights = make_events(2*common.HIST_BLOCK + 5, bins=bins)
+    bank = fill(common.HistogramBank(bins, use_numba=use_numba), x, weights, 1)
+    for name, w in weights.items():
+        assert_within_rounding(bank.sumw(name), x, bins, w)
+        assert_within_rounding(bank.sumw2(name), x, bins, w**2)
+    chunked = fill(common.HistogramBank(bins, use_numba=use_numba), x, weights, 13)
+    for name in weights:
+        np.testing.assert_array_equal(chunked.sumw(name), bank.sumw(name))
+        np.testing.assert_array_equal(chunked.sumw2(name), bank.sumw2(name))
+
+
+def test_fill_histograms_matches_mthistogram():
+    x, weights = make_events(5000, bins=common.MTHistogram.bins)
+    hists = common.fill_histograms(x, weights)
+    for name, w in weights.items():
+        expected = common.MTHistogram(x, w)
+        assert_within_rounding(hists[name].vals, x, expected.binning, w)
+        np.testing.assert_allclose(hists[name].errs, expected.errs, rtol=1e-10)
+        np.testing.assert_array_equal(hists[name].binning, expected.binning)
+
+
+def test_accumulate_histograms_is_exact_by_default():
+    x, weights = make_events(3000, bins=common.MTHistogram.bins)
+    cols = common.Columns()
+    cols.arrays = dict(x=x, **weights)
+    fn = lambda chunk: (chunk.arrays['x'], dict(weights=chunk.arrays['up']))
+    for chunk_size in [None, 1000]:
+        accumulator = common.accumulate_histograms(cols, fn, common.MTHistogram.bins, chunk_size)
+        np.testing.assert_array_equal(accumulator.histogram('weights').vals, common.MTHistogram(x, weights['up']).vals)
+    bank = common.accumulate_histograms(cols, fn, common.MTHistogram.bins, 1000, exact=False)
+    assert_within_rounding(bank.sumw('weights'), x, common.MTHistogram.bins, weights['up'])
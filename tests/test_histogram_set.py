@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import common
+
+
+BINS = np.linspace(0., 100., 26)
+NAMES = ['qcd_pt300', 'qcd_pt470', 'ttjets', 'signal']
+
+def histogram(seed):
+    rng = np.random.default_rng(seed)
+    h = common.Histogram(BINS.copy(), rng.exponential(5., 25), rng.uniform(.1, 1., 25))
+    h.metadata = dict(seed=seed)
+    return h
+
+
+@pytest.fixture
+def hists():
+    return {name: histogram(i) for i, name in enumerate(NAMES)}
+
+
+def assert_same(h, expected):
+    np.testing.assert_array_equal(h.binning, expected.binning)
+    np.testing.assert_allclose(h.vals, expected.vals, rtol=1e-12)
+    np.testing.assert_allclose(h.errs, expected.errs, rtol=1e-12)
+
+
+def test_round_trip(hists):
+    hset = common.HistogramSet.from_histograms(hists)
+    assert list(hset) == NAMES and len(hset) == 4
+    for name, h in hset.to_histograms().items():
+        assert_same(h, hists[name])
+        assert h.metadata == hists[name].metadata
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 5])
+def test_rebin_matches_histogram(hists, n):
+    rebinned = common.HistogramSet.from_histograms(hists).rebin(n)
+    for name, h in hists.items():
+        assert_same(rebinned[name], h.rebin(n))
+
+
+@pytest.mark.parametrize('x_max', [50., 52., 100., 200.])
+def test_cut_matches_histogram(hists, x_max):
+    cut = common.HistogramSet.from_histograms(hists).cut(x_max)
+    for name, h in hists.items():
+        assert_same(cut[name], h.cut(x_max))
+
+
+def test_add_matches_histogram(hists):
+    hset = common.HistogramSet(BINS)
+    expected = {}
+    for name, h in hists.items():
+        group = name.split('_')[0]
+        hset.add(group, h)
+        expected[group] = expected[group] + h if group in expected else h.copy()
+    array = np.arange(25.)
+    hset.add('ttjets', array)
+    expected['ttjets'] = expected['ttjets'] + array
+    assert hset.names == ['qcd', 'ttjets', 'signal']
+    for name, h in expected.items():
+        assert_same(hset[name], h)
+
+
+def test_group_sum_normalize_and_sum(hists):
+    hset = common.HistogramSet.from_histograms(hists)
+    grouped = hset.group_sum(lambda name: name.split('_')[0])
+    assert_same(grouped['qcd'], hists['qcd_pt300'] + hists['qcd_pt470'])
+    assert_same(hset.sum(['qcd_pt300', 'qcd_pt470']), grouped['qcd'])
+    normalized = grouped.normalize()
+    np.testing.assert_allclose(normalized.norm, 1.)
+    h = grouped['signal']
+    np.testing.assert_allclose(normalized['signal'].errs, h.errs / h.norm)
+
+
+def test_different_binning_raises(hists):
+    hists['other'] = common.Histogram(np.linspace(0., 100., 11))
+    with pytest.raises(ValueError):
+        common.HistogramSet.from_histograms(hists)
@@ -0,0 +1,33 @@
+import numpy as np
+import svj_ntuple_processing
+
+import common
+
+
+def test_npz_load_matches_baseline(npz, assert_same):
+    baseline = svj_ntuple_processing.Columns.load(npz)
+    assert_same(common.Columns.load(npz), baseline)
+    assert_same(common.Columns.load(npz, lazy=True), baseline)
+
+
+def test_npz_projection(npz):
+    cols = common.Columns.load(npz, columns=['mt', 'pt'])
+    assert sorted(cols.arrays) == ['mt', 'pt']
+    np.testing.assert_array_equal(cols.arrays['pt'], svj_ntuple_processing.Columns.load(npz).arrays['pt'])
+
+
+def test_lazy_len_does_not_unpickle(npz, tmp_path):
+    path = str(tmp_path / 'resaved.npz')
+    common.Columns.load(npz).save(path)
+    # The extra n_events entry does not bother the baseline loader
+    assert len(svj_ntuple_processing.Columns.load(path).arrays['mt']) == 500
+    for columns in [None, ['mt']]:
+        cols = common.Columns.load(path, columns=columns, lazy=True)
+        assert len(cols) == 500
+        assert cols.arrays.loaded_keys() == []
+        assert cols.arrays._pending is not None or cols.arrays._loaders
+
+
+def test_lazy_len_of_baseline_file(npz):
+    # No n_events entry: len() falls back to reading the arrays
+    assert len(common.Columns.load(npz, lazy=True)) == 500
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+import svj_ntuple_processing
+
+import common
+
+
+def test_parquet_round_trip(npz, tmp_path, assert_same):
+    pytest.importorskip('pyarrow')
+    baseline = svj_ntuple_processing.Columns.load(npz)
+    parquet = str(tmp_path / 'sample.parquet')
+    common.Columns.load(npz).save(parquet)
+    assert_same(common.Columns.load(parquet), baseline)
+    filtered = common.Columns.from_parquet(parquet, columns=['mt'], filters=[('mt', '>', 400.)])
+    np.testing.assert_array_equal(filtered.arrays['mt'], baseline.arrays['mt'][baseline.arrays['mt'] > 400.])
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+import common
+
+
+FEATURES = ['a', 'b', 'c']
+
+@pytest.fixture
+def samples(make_cols):
+    return [make_cols(3000, 1), make_cols(2000, 2)], [make_cols(1000, 3, shift=1.)]
+
+
+@pytest.fixture
+def cuts_file(samples, tmp_path):
+    bkg_cols, signal_cols = samples
+    cuts = common.QuantileCuts.compute(bkg_cols + signal_cols, FEATURES, n_bins=64)
+    path = str(tmp_path / 'cuts.json')
+    cuts.save(path)
+    return path
+
+
+def test_quantize_decode(samples):
+    bkg_cols, _ = samples
+    cuts = common.QuantileCuts.compute(bkg_cols, FEATURES, n_bins=64)
+    X = np.concatenate([c.to_numpy(FEATURES) for c in bkg_cols]).astype(np.float32)
+    codes = cuts.quantize(X)
+    assert codes.dtype == np.uint8
+    assert cuts.n_bins <= 64
+    assert len(cuts.edges[2]) == 5 # Only 5 distinct values
+    decoded = cuts.decode(codes)
+    for j, edges in enumerate(cuts.edges):
+        # Decoded values are the lower edge of the bin of every value
+        assert np.all(decoded[:,j] <= X[:,j])
+        upper = np.append(edges[1:], np.inf)[codes[:,j]]
+        assert np.all(X[:,j] < upper)
+    np.testing.assert_array_equal(cuts.quantize(decoded), codes)
+
+
+def test_cuts_round_trip(cuts_file):
+    cuts = common.QuantileCuts.load(cuts_file)
+    assert cuts.features == FEATURES
+    X = np.random.default_rng(5).normal(size=(100, 3))
+    np.testing.assert_array_equal(cuts.quantize(X), common.load_quantile_cuts(cuts_file).quantize(X))
+
+
+def test_columns_to_numpy_quantized(samples, cuts_file):
+    bkg_cols, signal_cols = samples
+    X, y, weight = common.columns_to_numpy(signal_cols, bkg_cols, FEATURES, downsample=.5, seed=7)
+    codes, yq, weightq = common.columns_to_numpy(
+        signal_cols, bkg_cols, FEATURES, downsample=.5, seed=7, quantile_cuts=cuts_file
+        )
+    np.testing.assert_array_equal(codes, common.load_quantile_cuts(cuts_file).quantize(X))
+    np.testing.assert_array_equal(yq, y)
+    np.testing.assert_array_equal(weightq, weight)
+
+
+def test_quantized_training(samples, cuts_file):
+    """The training path of training.py with --quantize"""
+    xgb = pytest.importorskip('xgboost')
+    bkg_cols, signal_cols = samples
+    X, y, weight = common.columns_to_numpy(signal_cols, bkg_cols, FEATURES, dtype=np.float32, seed=7)
+    codes, y, weight = common.columns_to_numpy(
+        signal_cols, bkg_cols, FEATURES, seed=7, quantile_cuts=cuts_file
+        )
+    cuts = common.load_quantile_cuts(cuts_file)
+    dtrain = common.quantile_dmatrix(codes, y, weight, cuts, chunk_size=1000)
+    assert dtrain.num_row() == len(y) and dtrain.num_col() == len(FEATURES)
+    parameters = dict(objective='binary:logistic', tree_method='hist', max_bin=cuts.n_bins, eta=.3, max_depth=3)
+    booster = xgb.train(parameters, dtrain, num_boost_round=20)
+    # Thresholds are on bin edges: raw features give the same scores as the decoded codes
+    score = booster.inplace_predict(X)
+    np.testing.assert_array_equal(score, booster.inplace_predict(cuts.decode(codes)))
+    assert score[y==1].mean() > score[y==0].mean()
+
+
+def test_nan_is_missing(make_cols):
+    cols = make_cols(1000)
+    cols.arrays['a'][::10] = np.nan
+    cuts = common.QuantileCuts.compute([cols], FEATURES, n_bins=64)
+    assert np.all(np.isfinite(cuts.edges[0]))
+    X = cols.to_numpy(FEATURES)
+    codes = cuts.quantize(X)
+    np.testing.assert_array_equal(codes[:,0] == cuts.MISSING, np.isnan(X[:,0]))
+    decoded = cuts.decode(codes)
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(X))
+
+
+def test_quantile_dmatrix_uses_stored_cuts(samples, cuts_file):
+    pytest.importorskip('xgboost')
+    bkg_cols, signal_cols = samples
+    codes, y, weight = common.columns_to_numpy(
+        signal_cols, bkg_cols, FEATURES, seed=7, quantile_cuts=cuts_file
+        )
+    cuts = common.load_quantile_cuts(cuts_file)
+    # Few events, which do not fill all bins: a new sketch would give other cuts
+    indptr, values = common.quantile_dmatrix(codes[:50], y[:50], weight[:50], cuts, chunk_size=20).get_quantile_cut()
+    # One bin per code: the lowest edge is the lower bound, the other edges are bin boundaries
+    for j, edges in enumerate(cuts.edges):
+        np.testing.assert_array_equal(values[indptr[j]+1:indptr[j+1]-1], edges[1:])
+
+
+def test_xgb_train_args():
+    params, num_boost_round = common.xgb_train_args(
+        dict(learning_rate=.1, max_depth=4, n_estimators=850, reg_lambda=2., use_label_encoder=False)
+        )
+    assert num_boost_round == 850
+    assert params == dict(objective='binary:logistic', eta=.1, max_depth=4, **{'lambda': 2.})
+    assert common.xgb_train_args(dict(eta=.05))[1] == 100
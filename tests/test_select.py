@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import common
+
+
+class Counting(np.ndarray):
+    """Array counting how often rows are taken from it"""
+    def __getitem__(self, index):
+        self.takes.append(index)
+        return np.asarray(self)[index]
+
+
+def counting(array):
+    array = array.view(Counting)
+    array.takes = []
+    return array
+
+
+SELECTIONS = [
+    slice(5, 40), slice(None, None, -2), np.arange(50) % 3 == 0,
+    np.array([7, 3, 3, 20, 41]),
+    ]
+
+@pytest.mark.parametrize('first', SELECTIONS)
+@pytest.mark.parametrize('second', [slice(1, None, 2), np.array([0, 2, 1]), 'mask'])
+def test_chained_select_matches_numpy(first, second, make_cols):
+    cols = make_cols(50)
+    a = cols.arrays['a']
+    view = cols.select(first)
+    expected = a[first]
+    if isinstance(second, str): second = np.arange(len(view)) % 2 == 1
+    np.testing.assert_array_equal(view.select(second).arrays['a'], expected[second])
+
+
+def test_chained_select_gathers_from_root(make_cols):
+    cols = make_cols(50)
+    a = counting(cols.arrays['a'])
+    cols.arrays['a'] = a
+    view = cols.select(np.arange(50) % 2 == 0).select(slice(2, 10)).select(np.array([1, 0, 4]))
+    np.testing.assert_array_equal(view.arrays['a'], np.asarray(a)[0::2][2:10][[1, 0, 4]])
+    # One gather straight from the root, none of the intermediate views is read
+    assert len(a.takes) == 1
+    np.testing.assert_array_equal(a.takes[0], [6, 4, 12])
+
+
+def test_array_set_on_view_is_selected_from_view(make_cols):
+    cols = make_cols(50)
+    view = cols.select(slice(10, 30))
+    view.arrays['a2'] = 2. * view.arrays['a']
+    np.testing.assert_array_equal(view.select(slice(0, 5)).arrays['a2'], 2. * cols.arrays['a'][10:15])
+    assert 'a2' not in cols.arrays
+
+
+def test_empty_select(make_cols):
+    cols = make_cols(50)
+    assert len(cols.select(slice(10, 10)).select(np.zeros(0, dtype=int)).arrays['a']) == 0
+
+
+def test_mask_length_mismatch(make_cols):
+    with pytest.raises(ValueError):
+        make_cols(50).select(np.ones(3, dtype=bool))
@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+import common
+
+
+@pytest.mark.parametrize('n', [1, 8, 13, 64, 101])
+def test_bitmap_matches_boolean_ops(n):
+    rng = np.random.default_rng(n)
+    a, b = rng.random(n) < .5, rng.random(n) < .3
+    ba, bb = common.Bitmap.from_mask(a), common.Bitmap.from_mask(b)
+    np.testing.assert_array_equal(ba.mask(), a)
+    np.testing.assert_array_equal((ba & bb).mask(), a & b)
+    np.testing.assert_array_equal((ba | bb).mask(), a | b)
+    np.testing.assert_array_equal((~ba).mask(), ~a)
+    assert (~ba).count() == np.count_nonzero(~a)
+    assert len(ba) == n
+
+
+def test_bitmap_length_mismatch():
+    with pytest.raises(ValueError):
+        common.Bitmap.from_mask(np.ones(8, bool)) & common.Bitmap.from_mask(np.ones(9, bool))
+
+
+def test_selection_matches_mask_and_is_persisted(sample):
+    cols = common.Columns.load(sample)
+    expected = common.mask_cutbased(cols)
+    np.testing.assert_array_equal(cols.selection('cutbased').mask(), expected)
+    window = cols.selection('mt_window', mt_low=300., mt_high=500.)
+    np.testing.assert_array_equal(window.mask(), (cols.arrays['mt'] > 300.) & (cols.arrays['mt'] < 500.))
+
+    # A new instance reads both bitmaps from the index, without the feature columns
+    cols = common.Columns.load(sample, lazy=True)
+    np.testing.assert_array_equal(cols.selection('cutbased').mask(), expected)
+    assert cols.arrays.loaded_keys() == []
+    assert len(cols.selection_index.bitmaps) == 2
+
+
+def test_rewritten_sample_drops_index(sample, write_sample):
+    common.Columns.load(sample).selection('cutbased')
+    write_sample(sample, seed=2)
+    cols = common.Columns.load(sample)
+    np.testing.assert_array_equal(cols.selection('cutbased').mask(), common.mask_cutbased(cols))
+
+
+def test_unwritable_index_is_kept_in_memory(sample, monkeypatch):
+    def replace(*args):
+        raise PermissionError('read-only')
+    monkeypatch.setattr(common.os, 'replace', replace)
+    cols = common.Columns.load(sample)
+    np.testing.assert_array_equal(cols.selection('cutbased').mask(), common.mask_cutbased(cols))
+    np.testing.assert_array_equal(cols.selection('cutbased').mask(), common.mask_cutbased(cols))
+    assert not cols.selection_index.writable
+    assert not os.path.exists(cols.selection_index.path)
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+import common
+
+
+def test_split_round_trip(sample):
+    common.make_split_index(sample, train_fraction=.7, seed=3)
+    a = common.Columns.load(sample).arrays['a']
+    train = common.Columns.load(sample, split='train')
+    test = common.Columns.load(sample, split='test', lazy=True)
+    assert len(train) == 71 and len(test) == 30
+    i_train, i_test = train.arrays['i'], test.arrays['i']
+    assert np.intersect1d(i_train, i_test).size == 0
+    np.testing.assert_array_equal(np.sort(np.concatenate((i_train, i_test))), np.arange(101))
+    np.testing.assert_array_equal(train.arrays['a'], a[i_train])
+    np.testing.assert_array_equal(test.arrays['a'], a[i_test])
+
+
+def test_split_is_reproducible(sample):
+    common.make_split_index(sample, seed=3)
+    first = common.load_split_mask(sample, 'train')
+    common.make_split_index(sample, seed=3)
+    np.testing.assert_array_equal(common.load_split_mask(sample, 'train'), first)
+    common.make_split_index(sample, seed=4)
+    assert not np.array_equal(common.load_split_mask(sample, 'train'), first)
+
+
+def test_changed_sample_raises(sample, write_sample):
+    common.make_split_index(sample)
+    if common.is_columndir(sample):
+        # Rewriting a column directory would also remove the index in it
+        index = os.path.join(sample, common.COLUMNDIR_INDEX)
+        os.utime(index, ns=(0, os.stat(index).st_mtime_ns + 10**9))
+    else:
+        write_sample(sample, n=90, seed=2)
+    with pytest.raises(ValueError, match='changed'):
+        common.Columns.load(sample, split='train')
+
+
+def test_length_mismatch_raises(tmp_path, write_sample):
+    sample = str(tmp_path / 'sample.cols')
+    write_sample(sample)
+    index = common.make_split_index(sample)
+    with np.load(index) as d:
+        fields = dict(d)
+    fields['n_events'] = 90
+    fields['train'] = common.Bitmap.from_mask(np.ones(90, bool)).bits
+    with open(index, 'wb') as f:
+        np.savez(f, **fields)
+    with pytest.raises(ValueError, match='90 events'):
+        common.Columns.load(sample, split='train')
+
+
+def test_bad_split_name(sample):
+    common.make_split_index(sample)
+    with pytest.raises(ValueError):
+        common.load_split_mask(sample, 'validation')
+
+
+def test_split_is_per_sample_and_location_independent(tmp_path, write_sample):
+    import shutil, split_train_test
+    for subdir in ['qcd', 'ttjets']:
+        write_sample(tmp_path / 'data' / subdir / 'sample.npz')
+    split_train_test.split_index(str(tmp_path / 'data'), workers=2)
+    masks = [common.load_split_mask(str(tmp_path / 'data' / d / 'sample.npz'), 'train') for d in ['qcd', 'ttjets']]
+    # Same file name and contents, but different samples
+    assert not np.array_equal(*masks)
+    shutil.copytree(tmp_path / 'data', tmp_path / 'moved', copy_function=shutil.copy2)
+    split_train_test.split_index(str(tmp_path / 'moved'), workers=2)
+    np.testing.assert_array_equal(common.load_split_mask(str(tmp_path / 'moved' / 'qcd' / 'sample.npz'), 'train'), masks[0])
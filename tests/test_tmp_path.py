@@ -0,0 +1,18 @@
+import os, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+
+
+def test_tmp_path_is_unique_per_thread(tmp_path):
+    path = str(tmp_path / 'file.json')
+    barrier = threading.Barrier(4) # Four threads alive at the same time
+    def name(i):
+        barrier.wait()
+        return common.tmp_path(path)
+    with ThreadPoolExecutor(4) as pool:
+        assert len(set(pool.map(name, range(4)))) == 4
+    hidden = common.tmp_path(path, hidden=True)
+    assert os.path.dirname(hidden) == str(tmp_path)
+    assert os.path.basename(hidden).startswith('.') and hidden.endswith('file.json')
+
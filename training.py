@@ -6,7 +6,8 @@ import matplotlib.pyplot as plt
 
 np.random.seed(1001)
 
-from common import logger, DATADIR, Columns, time_and_log, columns_to_numpy, set_matplotlib_fontsizes, imgcat, add_key_value_to_json, filter_pt, mt_wind
+from common import logger, DATADIR, Columns, time_and_log, columns_to_numpy, set_matplotlib_fontsizes, imgcat, add_key_value_to_json, filter_pt, mt_wind, load_columns
+from common import QuantileCuts, load_quantile_cuts, quantile_dmatrix, xgb_train_args
 
 
 training_features = [
@@ -88,6 +89,22 @@ def reweight(reference, samples, reweight_var, make_test_plot=False):
 
 
 
+def quantize(cuts_file, signal_cols, bkg_cols, weight_key='weight'):
+    """
+    Makes sure the quantile cuts for the training features exist; computes
+    them with the training weights `weight_key` (signal scaled to the bkg
+    total) otherwise. Returns `cuts_file`, or None if no quantization is requested.
+    """
+    if cuts_file is None or osp.isfile(cuts_file): return cuts_file
+    bkg_weights = [c.arrays[weight_key] for c in bkg_cols]
+    total_bkg_weight = sum(np.sum(w) for w in bkg_weights)
+    signal_weights = [np.full(len(c), total_bkg_weight / len(c) / len(signal_cols)) for c in signal_cols]
+    with time_and_log(f'Computing quantile cuts for {training_features}'):
+        cuts = QuantileCuts.compute(bkg_cols + signal_cols, training_features, bkg_weights + signal_weights)
+    cuts.save(cuts_file)
+    return cuts_file
+
+
 def print_weight_table(bkg_cols, signal_cols, weight_col='weight'):
     bkg_cols.sort(key=lambda s: (s.metadata['bkg_type'], s.metadata.get('ptbin',[0,0]), s.metadata.get('htbin',[0,0])))
     signal_cols.sort(key=lambda s: (s.metadata['mz'], s.metadata['rinv']))
@@ -141,6 +158,10 @@ def main():
     parser.add_argument('--reweight', type=str)
     parser.add_argument('--reweighttestplot', action='store_true')
     parser.add_argument('--downsample', type=float, default=.4)
+    parser.add_argument(
+        '--sampling', type=str, default='uniform', choices=['uniform', 'importance'],
+        help='How bkg is downsampled; importance keeps high-weight events and preserves the bkg weight (use e.g. --downsample .1)'
+        )
     parser.add_argument('--dry', action='store_true')
     parser.add_argument('--node', type=str, help='Run training on a different lpc node.')
     parser.add_argument('--tag', type=str, help='Add some output to the output model file')
@@ -148,6 +169,14 @@ def main():
     parser.add_argument('--gradientboost', action='store_true')
     parser.add_argument('--use_eta', action='store_true')
     parser.add_argument('--ref', type=str, help='path to the npz file for the reference distribution for reweighting.')
+    parser.add_argument(
+        '--splitindex', action='store_true',
+        help='Train on the train part of data/signal and data/bkg (see split_train_test.py --index) instead of data/train_*'
+        )
+    parser.add_argument(
+        '--quantize', type=str,
+        help='Path to a quantile cuts .json file (created if it does not exist). Trains on uint8 bin codes stored next to the samples.'
+        )
     # adding signal models
     parser.add_argument('--mdark', type=str, default='10.')
     parser.add_argument('--rinv', type=str, default='0.3')
@@ -182,22 +211,22 @@ def main():
 
     logger.info(f'Running training script; args={args}')
 
-    signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/train_signal/*.npz')]
-    bkg_cols = [
-        Columns.load(f) for f in
-        glob.glob(DATADIR+'/train_bkg/Summer20UL18/QCD_*.npz')
-        + glob.glob(DATADIR+'/train_bkg/Summer20UL18/TTJets_*.npz')
-        ]
+    signal_filter = {}
+    if args.mdark: signal_filter['mdark'] = args.mdark
+    if args.rinv: signal_filter['rinv'] = args.rinv
+    # Either the copied train directories, or the train part of the full directories
+    train_prefix = '/' if args.splitindex else '/train_'
+    load_kwargs = dict(split='train') if args.splitindex else {}
 
-    if args.mdark:
-        signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/train_signal/*mdark'+args.mdark+'*.npz')]
-    if args.rinv:
-        signal_cols = [Columns.load(f) for f in glob.glob(DATADIR+'/train_signal/*rinv'+args.rinv+'*.npz')]
+    signal_cols = load_columns(DATADIR+train_prefix+'signal/*.npz', filters=signal_filter, **load_kwargs)
 
     # Throw away the very low QCD bins (very low number of events)
     logger.info('Using QCD bins starting from pt>=300')
     # bkg_cols = list(filter(lambda cols: cols.metadata['bkg_type']!='qcd' or cols.metadata['ptbin'][0]>=300., bkg_cols))
-    bkg_cols = filter_pt(bkg_cols, 300.)
+    bkg_cols = load_columns(
+        [DATADIR+train_prefix+'bkg/Summer20UL18/QCD_*.npz', DATADIR+train_prefix+'bkg/Summer20UL18/TTJets_*.npz'],
+        filters=lambda cols: filter_pt(cols, 300.), **load_kwargs
+        )
     #bkg_cols = mt_wind(bkg_cols, 180, 650)
     #signal_cols = mt_wind(signal_cols, 180, 650)
 
@@ -279,7 +308,7 @@ def main():
             # Add a 'reweight' column to all samples:
             cols = bkg_cols + signal_cols
             if args.ref:
-                reference_col = Columns.load(osp.abspath(args.ref))
+                reference_col = Columns.load(osp.abspath(args.ref), lazy=True)
                 reference = [col for col in cols if col.metadata == reference_col.metadata][0]
             else:
                 # Use a default reference of mz=350, rinv=.3
@@ -298,7 +327,8 @@ def main():
             # Get samples using the new 'reweight' key (instead of the default 'weight')
             X, y, weight = columns_to_numpy(
                 signal_cols, bkg_cols, training_features,
-                weight_key='reweight', downsample=args.downsample
+                weight_key='reweight', downsample=args.downsample, sampling=args.sampling,
+                dtype=np.float32, quantile_cuts=quantize(args.quantize, signal_cols, bkg_cols, 'reweight')
                 )
             weight *= 100. # For training stability
             outfile = strftime(f'models/svjbdt_%b%d_reweight_{args.reweight}_allsignals_ttjets_refmz250.json')
@@ -306,7 +336,8 @@ def main():
             print_weight_table(bkg_cols, signal_cols, 'weight')
             X, y, weight = columns_to_numpy(
                 signal_cols, bkg_cols, training_features,
-                downsample=args.downsample
+                downsample=args.downsample, sampling=args.sampling, dtype=np.float32,
+                quantile_cuts=quantize(args.quantize, signal_cols, bkg_cols)
                 )
             outfile = strftime('models/svjbdt_%b%d_allsignals_qcdttjets.json')
 
@@ -318,10 +349,20 @@ def main():
         if args.dry:
             logger.info('Dry mode: Quitting')
             return
-        with time_and_log(f'Begin training, dst={outfile}. This can take a while...'):
-            model.fit(X, y, sample_weight=weight)
         if not osp.isdir('models'): os.makedirs('models')
-        model.save_model(outfile)
+        if args.quantize:
+            # X holds uint8 bin codes; xgboost gets them through a QuantileDMatrix
+            cuts = load_quantile_cuts(args.quantize)
+            dtrain = quantile_dmatrix(X, y, weight, cuts)
+            train_parameters, num_boost_round = xgb_train_args(parameters)
+            train_parameters.update(tree_method='hist', max_bin=cuts.n_bins)
+            with time_and_log(f'Begin training on quantized features, dst={outfile}. This can take a while...'):
+                booster = xgb.train(train_parameters, dtrain, num_boost_round=num_boost_round)
+            booster.save_model(outfile)
+        else:
+            with time_and_log(f'Begin training, dst={outfile}. This can take a while...'):
+                model.fit(X, y, sample_weight=weight)
+            model.save_model(outfile)
         logger.info(f'Dumped trained model to {outfile}')
         add_key_value_to_json(outfile, 'features', training_features)
 